@@ -1,26 +1,118 @@
+import threading
+import time
 import pandas as pd
 import requests
 import pendulum
+from requests.adapters import HTTPAdapter
 from .. import settings
-from ..share.tools import DocInherit, FormatKlines
+from ..share.tools import DocInherit, FormatKlines, RetryPolicy
 
 doc_inherit = DocInherit
 
 #!TODO: Translate docstrings and delete useless commented blocks
 
 
-def get_response(endpoint: str) -> requests.models.Response:
-    try:
-        with requests.get(endpoint) as response:
-            if response.status_code == 200:
+class TransportStats:
+    __slots__ = ["requests", "retries", "failures", "total_latency"]
+
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.total_latency = 0.0  # seconds
+
+    @property
+    def mean_latency(self) -> float:
+        return self.total_latency / self.requests if self.requests else 0.0
+
+
+class BrokerTransport:
+    """HTTP transport shared by the requests made to a broker: a persistent
+    session (keep-alive connections pool, compressed responses) retrying
+    failed requests according to a 'RetryPolicy'.
+    """
+
+    def __init__(self,
+                 retry_policy: RetryPolicy = None,
+                 pool_maxsize: int = 10,
+                 timeout: float = 10.0):
+
+        self.retry_policy = retry_policy if retry_policy else RetryPolicy()
+        self.timeout = timeout
+        self.stats = TransportStats()
+        self._stats_lock = threading.Lock()
+        self.session = requests.Session()
+        self.session.headers.update({"Accept-Encoding": "gzip, deflate"})
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _account(self, latency: float, retried: bool, failed: bool):
+        with self._stats_lock:
+            self.stats.requests += 1
+            self.stats.total_latency += latency
+            self.stats.retries += int(retried)
+            self.stats.failures += int(failed)
+
+    def get(self, endpoint: str) -> requests.models.Response:
+        attempt = 0
+
+        while True:
+            response, error, start = None, None, time.perf_counter()
+            try:
+                response = self.session.get(endpoint, timeout=self.timeout)
+            except requests.RequestException as e:
+                error = e
+
+            succeeded = bool(response is not None
+                             and response.status_code == 200)
+            retrying = (not succeeded
+                        and self.retry_policy.should_retry(attempt, response))
+
+            self._account(time.perf_counter() - start,
+                          retried=retrying,
+                          failed=not (succeeded or retrying))
+            if succeeded:
                 return response
-    except Exception as e:
-        raise ConnectionError( #TODO: To logging
-            "Could not establish a broker connection. Details: {}".format(e)
-        )
+
+            if not retrying:
+                failure = ConnectionError(  # TODO: To logging
+                    "Could not establish a broker connection. Details: {}"
+                    .format(error if error is not None else "HTTP {} {}"
+                            .format(response.status_code, response.text)))
+                failure.response = response  # None on network errors
+                raise failure
+
+            time.sleep(self.retry_policy.delay(attempt, response))
+            attempt += 1
+
+    def close(self):
+        self.session.close()
+
+
+_default_transport = None  # Created on first use, not on import
+_default_transport_lock = threading.Lock()
+
+
+def _get_default_transport() -> BrokerTransport:
+    global _default_transport
+    with _default_transport_lock:
+        if _default_transport is None:
+            _default_transport = BrokerTransport()
+        return _default_transport
+
+
+def get_response(endpoint: str,
+                 transport: BrokerTransport = None) -> requests.models.Response:
+    return (transport if transport else _get_default_transport()).get(
+        endpoint)
 
 
 def remove_last_if_unclosed(klines):
+    if klines.empty:
+        return klines
+
     last_open_time = klines[-1:].Open_time.item()
     delta_time = (pendulum.now(tz="UTC")).int_timestamp - last_open_time
     unclosed = bool(delta_time < klines.attrs["SecondsTimeFrame"])
@@ -31,6 +123,58 @@ def remove_last_if_unclosed(klines):
 
 
 class DataBroker:
+    def __init__(self):
+        self.transport = BrokerTransport(
+            retry_policy=RetryPolicy(max_retries=self.max_retries,
+                                     backoff_factor=self.backoff_factor,
+                                     max_backoff=self.max_backoff),
+            pool_maxsize=self.max_concurrent_requests,
+            timeout=self.request_timeout)
+        self._weight_lock = threading.Lock()
+        self._used_weight = None
+        self._weight_minute = None
+
+    def _current_minute(self) -> int:
+        return int(time.time() // 60)
+
+    def _reserve_request_weight(self, weight: int) -> None:
+        """Blocks the calling thread until a request of the given weight
+        fits in the budget of the current minute, reserving it. As on the
+        broker side, the counter is reset when the minute turns. The lock
+        is not held while sleeping.
+        """
+
+        while True:
+            with self._weight_lock:
+                minute = self._current_minute()
+                if minute != self._weight_minute:
+                    self._weight_minute, self._used_weight = minute, 0
+
+                if (self._used_weight + weight
+                        <= self._request_weight_per_minute):
+                    self._used_weight += weight
+                    return
+                wait = 60 - time.time() % 60
+
+            # TODO: To logger instead print
+            print("Sleeping cause request limit was hit.")
+            time.sleep(wait)
+
+    def _update_used_weight(self, response: requests.models.Response):
+        """Updates the weight used on the current minute with the value
+        reported by the broker, on the response header itself.
+        """
+
+        reported = response.headers.get(self._used_weight_header)
+        if reported is None:
+            return
+
+        with self._weight_lock:
+            minute = self._current_minute()
+            if minute != self._weight_minute:
+                self._weight_minute, self._used_weight = minute, 0
+            self._used_weight = max(self._used_weight, int(reported))
+
     def server_time(self) -> int:
         """Data e horário do servidor da corretora
 
@@ -95,20 +239,20 @@ class BinanceDataBroker(DataBroker, settings.BinanceSettings):
 
     @doc_inherit
     def server_time(self) -> int:
-        return int(
-            float((get_response(self._time_endpoint)).json()["serverTime"])
-            / 1000
-        )
+        response = get_response(self._time_endpoint, self.transport)
+        return int(float(response.json()["serverTime"]) / 1000)
 
     @doc_inherit
     def was_request_limit_reached(self) -> bool:
-        requests_on_current_minute = int(
-            (get_response(self._ping_endpoint)).headers["x-mbx-used-weight-1m"]
-        )
-        if requests_on_current_minute >= self._request_weight_per_minute:
-            return True
+        if self._weight_minute != self._current_minute():
+            self._update_used_weight(get_response(self._ping_endpoint, self.transport))
 
-        return False
+        with self._weight_lock:
+            used_weight = (self._used_weight
+                           if self._weight_minute == self._current_minute()
+                           else 0)
+
+        return bool(used_weight >= self._request_weight_per_minute)
 
     @doc_inherit
     def get_klines(
@@ -131,7 +275,11 @@ class BinanceDataBroker(DataBroker, settings.BinanceSettings):
             endpoint += "&endTime={}".format(str(until * 1000))
         if number_of_candles:
             endpoint += "&limit={}".format(str(number_of_candles))
-        raw_klines = (get_response(endpoint)).json()
+
+        self._reserve_request_weight(self._klines_request_weight)
+        response = get_response(endpoint, self.transport)
+        self._update_used_weight(response)
+        raw_klines = response.json()
 
         klines = FormatKlines(
             time_frame,
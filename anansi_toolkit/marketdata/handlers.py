@@ -1,59 +1,95 @@
-import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
+import numpy as np
 import pandas as pd
 import pendulum
 from . import indicators, data_brokers as brokers
-from ..share.tools import ParseDateTime, seconds_in
-from ..share.db_handlers import StorageKlines
+from .. import settings
+from ..share.tools import (
+    KlinesBuffer,
+    ParseDateTime,
+    human_readable_to_timestamps,
+    open_time_offset,
+    resample_klines,
+    seconds_in,
+    timestamps_to_human_readable,
+)
+from ..share import db_handlers
 
 pd.options.mode.chained_assignment = None
 
 
 @pd.api.extensions.register_dataframe_accessor("KlinesDateTime")
 class KlinesDateTime:
+    _datetime_columns = ["Open_time", "Close_time"]
+
     def __init__(self, klines: pd.DataFrame):
         self._klines = klines
 
+    def _columns(self) -> list:
+        return [column for column in self._datetime_columns
+                if column in self._klines]
+
     def from_human_readable_to_timestamp(self):
-        self._klines.loc[:, "Open_time"] = self._klines.apply(
-            lambda date_time: ParseDateTime(
-                date_time["Open_time"]
-            ).from_human_readable_to_timestamp(),
-            axis=1,
-        )
-
-        if "Close_time" in self._klines:
-            self._klines.loc[:, "Close_time"] = self._klines.apply(
-                lambda date_time: ParseDateTime(
-                    date_time["Close_time"]
-                ).from_human_readable_to_timestamp(),
-                axis=1,
-            )
+        for column in self._columns():
+            self._klines[column] = human_readable_to_timestamps(
+                self._klines[column].to_numpy())
 
     def from_timestamp_to_human_readable(self):
-        self._klines.loc[:, "Open_time"] = self._klines.apply(
-            lambda date_time: ParseDateTime(
-                date_time["Open_time"]
-            ).from_timestamp_to_human_readable(),
-            axis=1,
-        )
-
-        if "Close_time" in self._klines:
-            self._klines.loc[:, "Close_time"] = self._klines.apply(
-                lambda date_time: ParseDateTime(
-                    date_time["Close_time"]
-                ).from_timestamp_to_human_readable(),
-                axis=1,
-            )
+        for column in self._columns():
+            self._klines[column] = timestamps_to_human_readable(
+                self._klines[column].to_numpy())
+
+    def as_human_readable(self) -> pd.DataFrame:
+        """A copy of the klines, with human readable datetimes, leaving the
+        (integer timestamps) klines untouched.
+        """
+
+        klines = self._klines.copy()
+        klines.KlinesDateTime.from_timestamp_to_human_readable()
+        return klines
+
+
+def _with_overlap(chunks, overlap: int):
+    """Each of the klines 'chunks' preceded by the last 'overlap' rows
+    already yielded (their number on attrs["overlap"]), as the storages
+    'chunks' (see 'share.db_handlers.RangeReader.chunks').
+    """
+
+    carried = None
+    for klines in chunks:
+        if klines.empty:
+            continue
+
+        repeated = 0 if carried is None else len(carried)
+        if repeated:
+            klines = pd.concat([carried, klines], ignore_index=True)
+        if overlap:
+            carried = klines[-overlap:].copy()
+        klines.attrs.update({"overlap": repeated})
+        yield klines
 
 
 @pd.api.extensions.register_dataframe_accessor("apply_indicator")
 class ApplyIndicator:
     def __init__(self, klines):
         self._klines = klines
-        self.trend = indicators.Trend(self._klines)
-        self.momentum = indicators.Momentum(self._klines)
-        self.volatility = indicators.Volatility(self._klines)
-        self.volume = indicators.Volume(self._klines)
+
+    @cached_property
+    def trend(self):
+        return indicators.Trend(self._klines)
+
+    @cached_property
+    def momentum(self):
+        return indicators.Momentum(self._klines)
+
+    @cached_property
+    def volatility(self):
+        return indicators.Volatility(self._klines)
+
+    @cached_property
+    def volume(self):
+        return indicators.Volume(self._klines)
 
 
 class KlinesFromBroker:
@@ -63,6 +99,13 @@ class KlinesFromBroker:
     If a request limit is close to being reached, will pause the queue,
     until cooldown time pass.
     Returns sanitized klines to the client, formatted as pandas DataFrame.
+    Closed candles are kept on a local storage ('klines.db', or memory-mapped
+    column files under 'klines/' with 'storage' = 'ColumnarStorageKlines'),
+    working as a read-through cache: only the ranges not stored yet are
+    requested to the broker (unless 'use_local_cache' is False).
+    With 'human_readable_datetime' False, the returned klines keep the
+    integer timestamps (use 'klines.KlinesDateTime.as_human_readable()' to
+    see them as dates).
     """
 
     __slots__ = [
@@ -72,12 +115,19 @@ class KlinesFromBroker:
         "_time_frame",
         "_since",
         "_until",
+        "_oldest_open_time_cache",
+        "_storage",
+        "human_readable_datetime",
+        "storage",
     ]
 
     def __init__(self,
                  broker_name: str,
                  ticker_symbol: str,
-                 time_frame: str = None):
+                 time_frame: str = None,
+                 use_local_cache: bool = True,
+                 human_readable_datetime: bool = True,
+                 storage: str = settings.ImplementedKlinesStorages.SQLite):
 
         self.broker_name = broker_name.lower()
         self.ticker_symbol = ticker_symbol.upper()
@@ -88,6 +138,13 @@ class KlinesFromBroker:
                             else "1m")  # self._broker.minimal_time_frame)
         self._since = 1
         self._until = 2
+        self._oldest_open_time_cache = None
+        self._storage = None
+        self.human_readable_datetime = human_readable_datetime
+        self.storage = storage
+
+        if use_local_cache:
+            self._storage = self._open_storage()
 
     @property
     def time_frame(self):
@@ -96,6 +153,21 @@ class KlinesFromBroker:
     @time_frame.setter
     def time_frame(self, time_frame_to_set):
         self._time_frame = time_frame_to_set
+        self._oldest_open_time_cache = None
+
+        if self._storage:
+            self._storage = self._open_storage()
+
+    def _table_name(self) -> str:
+        return "{}_{}_{}_raw".format(
+            self.broker_name, self.ticker_symbol.lower(), self._time_frame)
+
+    def _open_storage(self):
+        storage = getattr(db_handlers, self.storage)(self._table_name())
+        storage.create_table()
+        if not storage.coverage():  # Klines stored before the coverage map
+            storage.rebuild_coverage(self.SecondsTimeFrame())
+        return storage
 
     def _now(self) -> int:
         return (pendulum.now(tz="UTC")).int_timestamp
@@ -104,12 +176,16 @@ class KlinesFromBroker:
         return seconds_in(self._time_frame)
 
     def _oldest_open_time(self) -> int:
-        return (
-            self._broker.get_klines(
-                ticker_symbol=self.ticker_symbol,
-                time_frame=self._time_frame,
-                since=1,
-                number_of_candles=1).Open_time.item())
+        # The first candle of a market never changes, so it is asked to
+        # the broker only once per instance.
+        if self._oldest_open_time_cache is None:
+            self._oldest_open_time_cache = (
+                self._broker.get_klines(
+                    ticker_symbol=self.ticker_symbol,
+                    time_frame=self._time_frame,
+                    since=1,
+                    number_of_candles=1).Open_time.item())
+        return self._oldest_open_time_cache
 
     def _newest_open_time(self):
         return self._now()
@@ -117,38 +193,114 @@ class KlinesFromBroker:
     def _request_step(self) -> int:
         return self._broker.records_per_request * self.SecondsTimeFrame()
 
-    def _get_raw_(self, appending_raw_to_db=False) -> pd.DataFrame:
+    def _first_open_time_from(self, timestamp: int) -> int:
+        step = self.SecondsTimeFrame()
+        offset = open_time_offset(self._time_frame)
+        return -((offset - timestamp) // step) * step + offset
 
-        table_name = "{}_{}_{}_raw".format(
-            self.broker_name, self.ticker_symbol.lower(), self._time_frame)
+    def _last_open_time_until(self, timestamp: int) -> int:
+        step = self.SecondsTimeFrame()
+        offset = open_time_offset(self._time_frame)
+        return ((timestamp - offset) // step) * step + offset
+
+    def _get_page(self, since: int, until: int) -> pd.DataFrame:
+        """Failed requests are retried by the broker transport (see its
+        'RetryPolicy'); its final 'ConnectionError' is raised.
+        """
 
-        Storage, klines = StorageKlines(table_name), pd.DataFrame()
+        raw_klines = self._broker.get_klines(
+            self.ticker_symbol, self._time_frame, since=since)
+        return raw_klines[(raw_klines.Open_time >= since)
+                          & (raw_klines.Open_time <= until)]
+
+    def _download(self, since: int, until: int,
+                  appending_raw_to_db=False,
+                  keeping_klines=True) -> pd.DataFrame:
+        """Requests the pages of [since, until] concurrently, keeping up to
+        'max_concurrent_requests' of them in flight. The broker itself
+        holds each request until it fits in the weight budget. Pages are
+        collected on a columnar buffer (if 'keeping_klines'), and the
+        dataframe is built once, at the end.
+        """
 
-        for timestamp in range(self._since,
-                               self._until + 1,  # 1 sec after '_until'
-                               self._request_step()):
-            while True:
-                try:
-                    raw_klines = self._broker.get_klines(
-                        self.ticker_symbol, self._time_frame, since=timestamp)
+        Storage = (None if not appending_raw_to_db
+                   else self._storage if self._storage
+                   else self._open_storage())
+        klines = KlinesBuffer()
+        timestamps = range(since,
+                           until + 1,  # 1 sec after 'until'
+                           self._request_step())
+
+        # Open times known to be stored once a page is appended
+        covered_until = min(
+            self._last_open_time_until(until) + self.SecondsTimeFrame(),
+            self._newest_closed_open_time() + 1)
+
+        with ThreadPoolExecutor(
+                max_workers=self._broker.max_concurrent_requests) as executor:
+
+            pages = executor.map(
+                lambda timestamp: self._get_page(timestamp, until),
+                timestamps)
+
+            for timestamp, raw_klines in zip(timestamps, pages):  # In order
+                if appending_raw_to_db:
+                    Storage.append_dataframe(
+                        raw_klines,
+                        covering=(timestamp, min(
+                            timestamp + self._request_step(), covered_until)))
+                if keeping_klines:
+                    klines.append(raw_klines)
+
+        return klines.to_dataframe()
+
+    def _newest_closed_open_time(self) -> int:
+        return self._now() - self.SecondsTimeFrame()
+
+    def _missing_ranges(self, since: int, until: int) -> list:
+        """Ranges of open times, inside [since, until], which are not on
+        the local storage yet (by its coverage map). Candles still opened
+        are never asked.
+        """
 
-                    if appending_raw_to_db:
-                        Storage.append_dataframe(raw_klines)
-                    klines = klines.append(raw_klines, ignore_index=True)
-                    break
+        until = min(until, self._newest_closed_open_time())
+        if since > until:
+            return []
 
-                except Exception as e:  # Usually connection issues.
-                    # TODO: To logger instead print
-                    print("Fail, due the error: ", e)
-                    time.sleep(60)  # 60 sec cooldown time.
+        missing = []
+        for _since, _until in self._storage.missing_ranges(since, until + 1):
+            first = self._first_open_time_from(_since)
+            last = self._last_open_time_until(_until - 1)
+            if first <= last:  # Holds some candle
+                missing.append((first, last))
+        return missing
 
-            if self._broker.was_request_limit_reached():
-                time.sleep(10)  # 10 sec cooldown time.
-                # TODO: To logger instead print
-                print("Sleeping cause request limit was hit.")
+    def _stored_klines(self, since: int, until: int) -> pd.DataFrame:
+        klines = self._storage.range(
+            since, until, columns=settings.kline_desired_informations,
+            as_dataframe=True)
 
+        klines.attrs.update({"SecondsTimeFrame": self.SecondsTimeFrame()})
         return klines
 
+    def _get_raw_(self, appending_raw_to_db=False) -> pd.DataFrame:
+        """Klines between '_since' and '_until'. If the local cache is
+        enabled, closed candles already stored are served from disk, and
+        only the missing ranges are downloaded (and stored).
+        """
+
+        if not self._storage:
+            return self._download(self._since, self._until,
+                                  appending_raw_to_db)
+
+        self._fill_local_cache(self._since, self._until)
+        return self._stored_klines(self._since, self._until)
+
+    def _fill_local_cache(self, since: int, until: int):
+        for _since, _until in self._missing_ranges(since, until):
+            self._download(_since, _until,
+                           appending_raw_to_db=True, keeping_klines=False)
+
     # TODO: Sanitize since/until to avoid ValueError until < since
     def _until_given_since_n(self, since, number_of_candles):
         until = (number_of_candles + 1) * self.SecondsTimeFrame() + since
@@ -180,7 +332,10 @@ class KlinesFromBroker:
         self._since = self._oldest_open_time()
         self._until = self._now()
 
-        self._get_raw_(appending_raw_to_db=True)
+        if self._storage:
+            self._fill_local_cache(self._since, self._until)
+        else:
+            self._get_raw_(appending_raw_to_db=True)
 
     def _sanitize_input_dt(self, datetime) -> int:
         try:
@@ -212,9 +367,44 @@ class KlinesFromBroker:
             if number_of_candles and until and not since
             else pd.DataFrame())  # Errors imply an empty dataframe
 
-        klines.KlinesDateTime.from_timestamp_to_human_readable()
+        if self.human_readable_datetime:
+            klines.KlinesDateTime.from_timestamp_to_human_readable()
         return klines
 
+    def chunks(self, since, until, chunk_size: int = 100000,
+               overlap: int = 0):
+        """Yields the klines of [since, until] by dataframes of up to
+        'chunk_size' candles, each preceded by the last 'overlap' candles
+        of the previous one (see 'share.db_handlers.RangeReader.chunks').
+        Only a chunk is held in memory at a time; the klines are read
+        through the local storage or, with no local cache, downloaded
+        chunk by chunk (and not stored).
+        """
+
+        since = self._sanitize_input_dt(since)
+        until = self._sanitize_input_dt(until)
+
+        for klines in self._chunks(since, until, chunk_size, overlap):
+            klines.attrs.update({"SecondsTimeFrame": self.SecondsTimeFrame()})
+            if self.human_readable_datetime:
+                klines.KlinesDateTime.from_timestamp_to_human_readable()
+            yield klines
+
+    def _chunks(self, since: int, until: int, chunk_size: int,
+                overlap: int):
+        if self._storage:
+            self._fill_local_cache(since, until)
+            return self._storage.chunks(
+                since, until, chunk_size,
+                columns=settings.kline_desired_informations, overlap=overlap)
+
+        span = chunk_size * self.SecondsTimeFrame()
+        return _with_overlap(
+            (self._download(chunk_since, min(chunk_since + span - 1, until))[
+                settings.kline_desired_informations]
+             for chunk_since in range(since, until + 1, span)),
+            overlap)
+
     def oldest(self, number_of_candles=1) -> pd.DataFrame:
         return self.get(number_of_candles=number_of_candles,
                         since=self._oldest_open_time())
@@ -224,14 +414,88 @@ class KlinesFromBroker:
                         until=self._now())
 
 
+class ResampledKlines(KlinesFromBroker):
+    """Klines of 'time_frame' built locally from the 1m ones (the only ones
+    requested to the broker and stored), aligned as the broker candles (see
+    'share.tools.resample_klines'). Candles whose time is not over yet are
+    left out.
+    """
+
+    __slots__ = ["_minute_klines"]
+
+    _minute_chunk = 100000  # 1m klines read at once, at most
+
+    def __init__(self,
+                 broker_name: str,
+                 ticker_symbol: str,
+                 time_frame: str,
+                 use_local_cache: bool = True,
+                 human_readable_datetime: bool = True,
+                 storage: str = settings.ImplementedKlinesStorages.SQLite):
+
+        super(ResampledKlines, self).__init__(
+            broker_name, ticker_symbol, time_frame,
+            use_local_cache=False,
+            human_readable_datetime=human_readable_datetime)
+
+        self._minute_klines = KlinesFromBroker(
+            broker_name, ticker_symbol, "1m",
+            use_local_cache=use_local_cache,
+            human_readable_datetime=False,
+            storage=storage)
+
+    def _oldest_open_time(self) -> int:
+        return self._last_open_time_until(
+            self._minute_klines._oldest_open_time())
+
+    def _get_raw_(self, appending_raw_to_db=False) -> pd.DataFrame:
+        step = self.SecondsTimeFrame()
+        klines = resample_klines(
+            self._minute_klines.get(
+                since=self._first_open_time_from(self._since),
+                until=self._last_open_time_until(self._until) + step - 1),
+            self._time_frame)
+
+        return klines[klines.Open_time + step <= self._now()]
+
+    def _raw_back_testing(self):
+        self._minute_klines._raw_back_testing()
+
+    def _chunks(self, since: int, until: int, chunk_size: int,
+                overlap: int):
+        """The 1m klines are read by ranges aligned to the candles of
+        'time_frame' (up to '_minute_chunk' 1m klines each), so no candle
+        is split across chunks; each range is resampled on its own.
+        """
+
+        step = self.SecondsTimeFrame()
+        span = max(1, min(chunk_size, self._minute_chunk * 60 // step)) * step
+        last = self._last_open_time_until(until)
+
+        def resampled(chunk_since: int) -> pd.DataFrame:
+            klines = resample_klines(
+                self._minute_klines.get(
+                    since=chunk_since,
+                    until=min(chunk_since + span, last + step) - 1),
+                self._time_frame)
+            return klines[klines.Open_time + step <= self._now()]
+
+        return _with_overlap(
+            (resampled(chunk_since) for chunk_since in range(
+                self._first_open_time_from(since), last + 1, span)),
+            overlap)
+
+
 class BackTestingKlines(KlinesFromBroker):  # just mocking for while
     def __init__(self,
                  broker_name: str,
                  ticker_symbol: str,
-                 time_frame=None):
+                 time_frame=None,
+                 human_readable_datetime: bool = False):
 
         super(BackTestingKlines, self).__init__(
-            broker_name, ticker_symbol, time_frame)
+            broker_name, ticker_symbol, time_frame,
+            human_readable_datetime=human_readable_datetime)
 
 
 class PriceGetter:
@@ -244,26 +508,97 @@ class PriceGetter:
 
 
 class BackTestingPriceGetter:
+    """ The price at some moment is the mean of the 5 candles SMA (ohlc4)
+    over the 100 one minute candles until 'at' + 3000 s. The 1m series is
+    loaded once, by chunks, to sorted arrays (see 'preload'), where the
+    smoothed price of each candle is precomputed; so getting a price is a
+    binary search.
+
+    It's possible that the broker - due to a server side issue, does not
+    have data for the requested period. Around those gaps the 100 candles
+    window is not full, and the price is computed over the candles found
+    (NaN if none). This issue will be checked in the next refactoring,
+    after an interpolation process to complete the missing data.
+    """
+
+    _number_of_candles = 100
+    _smoothing_candles = 5
+    _look_ahead = 3000  # seconds
+    _preload_chunk = 30 * 86400  # seconds
+    _price_columns = ["Open_time", "Open", "High", "Low", "Close"]  # ohlc4
+
     def __init__(self, broker_name: str, ticker_symbol: str):
         self.klines = BackTestingKlines(broker_name,
                                         ticker_symbol,
                                         time_frame="1m")
-
-    def get(self, at: int) -> float:
-        """ It's possible that the broker - due to a server side issue, 
-        does not have data for the requested period, making the returned
-        klines an empty dataframe. It is possible to reproduce the error
-        by comment/uncomment out the 'klines' variable below. The lower
-        the 'number_of_candles', the greater the possibility of an
-        error. This issue will be checked in the next refactoring, when
-        the klines and prices for back testing will be get from an owned
-        database, after an interpolation process to complete the missing
-        data.
+        self._loaded_since = None
+        self._loaded_until = None
+        self._open_times = np.empty(0, dtype=np.int64)
+        self._prices = np.empty(0)
+        self._smoothed_prices = np.empty(0)
+
+    def _window(self) -> int:
+        return (self._number_of_candles + 1) * self.klines.SecondsTimeFrame()
+
+    def _klines_between(self, since: int, until: int) -> pd.DataFrame:
+        if not self.klines._storage:
+            return self.klines.get(since=since, until=until)
+
+        return self.klines._storage.range(
+            since, until, columns=self._price_columns, as_dataframe=True)
+
+    def _load(self, since: int, until: int):
+        since = max(since, self.klines._oldest_open_time())
+        open_times, prices = [], []
+        if self.klines._storage:  # Chunks are then read as typed arrays
+            self.klines._fill_local_cache(since, until)
+
+        for chunk_since in range(since, until + 1, self._preload_chunk):
+            klines = self._klines_between(
+                chunk_since, min(chunk_since + self._preload_chunk - 1, until))
+            if klines.empty:
+                continue
+            open_times.append(klines.Open_time.to_numpy(dtype=np.int64))
+            prices.append(
+                klines.PriceFromKline.using("ohlc4")._series.to_numpy())
+
+        self._open_times = (np.concatenate(open_times) if open_times
+                            else np.empty(0, dtype=np.int64))
+        self._prices = (np.concatenate(prices) if prices else np.empty(0))
+        self._smoothed_prices = (
+            pd.Series(self._prices)
+            .rolling(window=self._smoothing_candles).mean()
+            .rolling(window=(self._number_of_candles
+                             - self._smoothing_candles + 1)).mean()
+            .to_numpy())
+
+    def preload(self, since: int, until: int):
+        """Loads the prices to be got from 'since' until 'until'.
         """
 
-        klines = self.klines.get(number_of_candles=100, until=at+3000)
-        #klines = self.klines.get(number_of_candles=10, until=at+300)
-        price = klines.apply_indicator.trend.simple_moving_average(
-            number_of_candles=5,
-            metrics="ohlc4")
-        return float(price._series.mean())
+        self._loaded_since = since
+        self._loaded_until = until
+        self._load(since - self._window() + self._look_ahead,
+                   until + self._look_ahead)
+
+    def _is_loaded(self, at: int) -> bool:
+        return bool(self._loaded_since is not None
+                    and self._loaded_since <= at <= self._loaded_until)
+
+    def get(self, at: int) -> float:
+        if not self._is_loaded(at):
+            self.preload(since=at, until=at + self._preload_chunk)
+
+        until = at + self._look_ahead
+        last = np.searchsorted(self._open_times, until, side="right")
+        first = max(
+            np.searchsorted(self._open_times, until - self._window()),
+            last - self._number_of_candles)
+
+        if last - first == self._number_of_candles:
+            return float(self._smoothed_prices[last - 1])
+
+        # Not a full window (gap on data)
+        price = (pd.Series(self._prices[first:last])
+                 .rolling(window=self._smoothing_candles).mean())
+        return float(price.mean())
@@ -12,10 +12,27 @@ parameter, as well as the associated calculation.
 "oh2"   = ("Open" + "High")/2
 "olc3"  = ("Open" + "Low" + "Close")/3
 "ohlc4" = ("Open" + "High" + "Low" + "Close")/4
+
+Besides the batch indicators, computed over the whole dataframe, there are
+incremental ones ('IncrementalIndicator'), which keep their state and are
+updated candle by candle, in constant time.
+
+Batch prices and indicators are memoized per dataframe ('IndicatorsCache'),
+by name and parameters, so classifiers sharing inputs compute them once.
+
+The incremental moving averages sum the prices exactly (as integer
+multiples of the smallest float), so they give the correctly rounded mean,
+whatever the magnitude of the prices; the batch ones (pandas rolling means)
+match them up to the float rounding.
 """
 
+import math
+from collections import OrderedDict, deque
 import pandas as pd
 
+# Every finite float is an integer multiple of 2 ** -1074
+_exact_scale = 1074
+
 _columns = {
     "o": ["Open"],
     "h": ["High"],
@@ -38,6 +55,179 @@ class Indicator(object):
         return self._series.tail(1).item()
 
 
+def price_from_candle(candle, metrics="ohlc4") -> float:
+    """Same as 'PriceFromKline.using', for a single candle (dict, Series).
+    """
+
+    values = [float(candle[column]) for column in _columns[metrics]]
+    return sum(values) / len(values)
+
+
+def _price_of(klines: pd.DataFrame, metrics: str) -> pd.Series:
+    # Summed column by column, in the order of 'price_from_candle'
+    columns = _columns[metrics]
+    total = klines[columns[0]].astype(float)
+    for column in columns[1:]:
+        total = total + klines[column]
+    return total / len(columns)
+
+
+def _exact(price: float) -> int:
+    numerator, denominator = price.as_integer_ratio()
+    return numerator << (_exact_scale - denominator.bit_length() + 1)
+
+
+class IncrementalIndicator(object):
+    """Base of the indicators updated one candle at a time. Candles with an
+    'Open_time' not newer than the last one fed are ignored.
+    """
+
+    __slots__ = ["name", "metrics", "last_open_time", "_last"]
+
+    def __init__(self, name="", metrics="ohlc4"):
+        self.name = name
+        self.metrics = metrics
+        self.last_open_time = None
+        self._last = math.nan
+
+    def _is_new(self, candle) -> bool:
+        open_time = candle.get("Open_time")
+        if open_time is None:
+            return True
+        if self.last_open_time is not None and open_time <= self.last_open_time:
+            return False
+
+        self.last_open_time = open_time
+        return True
+
+    def _next_value(self, price: float) -> float:
+        raise NotImplementedError
+
+    def update(self, candle) -> float:
+        if self._is_new(candle):
+            self._last = self._next_value(
+                price_from_candle(candle, self.metrics))
+        return self._last
+
+    def update_with(self, klines: pd.DataFrame):
+        for candle in klines.to_dict(orient="records"):
+            self.update(candle)
+        return self
+
+    def last(self) -> float:
+        return self._last
+
+    def state(self) -> tuple:
+        """Snapshot of the indicator, to 'restore' it (e.g. after a
+        discarded update).
+        """
+
+        return (self.last_open_time, self._last)
+
+    def restore(self, state: tuple):
+        self.last_open_time, self._last = state
+
+
+class IncrementalSimpleMovingAverage(IncrementalIndicator):
+    """Keeps the window of prices and their exact sum (a python int, so it
+    neither overflows nor loses the digits of small prices); the mean is
+    correctly rounded, as the batch 'simple_moving_average' up to the float
+    rounding of the pandas rolling mean.
+    """
+
+    __slots__ = ["number_of_candles", "_window", "_sum", "_nans"]
+
+    def __init__(self, number_of_candles: int, metrics="ohlc4"):
+        super(IncrementalSimpleMovingAverage, self).__init__(
+            name="sma_{}_{}".format(metrics, str(number_of_candles)),
+            metrics=metrics)
+
+        self.number_of_candles = number_of_candles
+        self._window = deque()  # Exact prices, None for NaN ones
+        self._sum = 0
+        self._nans = 0
+
+    def _next_value(self, price: float) -> float:
+        if len(self._window) == self.number_of_candles:
+            removed = self._window.popleft()
+            if removed is None:
+                self._nans -= 1
+            else:
+                self._sum -= removed
+
+        exact = None if price != price else _exact(price)
+        self._window.append(exact)
+        if exact is None:
+            self._nans += 1
+        else:
+            self._sum += exact
+
+        if len(self._window) < self.number_of_candles or self._nans:
+            return math.nan
+        # int by int division, correctly rounded
+        return self._sum / (self.number_of_candles << _exact_scale)
+
+    def state(self) -> tuple:
+        return super(IncrementalSimpleMovingAverage, self).state() + (
+            tuple(self._window), self._sum, self._nans)
+
+    def restore(self, state: tuple):
+        super(IncrementalSimpleMovingAverage, self).restore(state[:2])
+        window, self._sum, self._nans = state[2:]
+        self._window = deque(window)
+
+
+@pd.api.extensions.register_dataframe_accessor("IndicatorsCache")
+class IndicatorsCache:
+    """Derived series of a klines dataframe, by key (name and parameters).
+    They are dropped as soon as the klines rows change (rows appended,
+    removed or replaced). Values edited in place, on the middle rows, are
+    not noticed: use 'clear()' after such edits. With a 'max_size' (None,
+    unbounded, by default), the least recently used series are dropped
+    beyond it.
+    """
+
+    __slots__ = ["_klines", "_fingerprint", "_cached", "max_size"]
+
+    _watched_columns = ["Open_time", "Open", "High", "Low", "Close", "Volume"]
+
+    def __init__(self, klines: pd.DataFrame):
+        self._klines = klines
+        self._fingerprint = None
+        self._cached = OrderedDict()
+        self.max_size = None
+
+    def _current_fingerprint(self) -> tuple:
+        if self._klines.empty:
+            return (0,)
+
+        columns = [column for column in self._watched_columns
+                   if column in self._klines]
+        edges = self._klines[columns].iloc[[0, -1]]
+        return (len(self._klines),
+                self._klines.index[0],
+                self._klines.index[-1],
+                tuple(edges.to_numpy().ravel().tolist()))
+
+    def get(self, key: tuple, compute):
+        fingerprint = self._current_fingerprint()
+        if fingerprint != self._fingerprint:
+            self._cached.clear()
+            self._fingerprint = fingerprint
+
+        if key in self._cached:
+            self._cached.move_to_end(key)
+            return self._cached[key]
+
+        value = self._cached[key] = compute()
+        while self.max_size is not None and len(self._cached) > self.max_size:
+            self._cached.popitem(last=False)
+        return value
+
+    def clear(self):
+        self._cached.clear()
+
+
 @pd.api.extensions.register_dataframe_accessor("PriceFromKline")
 class PriceFromKline:
     __slots__ = ["_klines"]
@@ -48,10 +238,11 @@ class PriceFromKline:
     def using(self, metrics: str, **kwargs) -> Indicator:
         indicator_column = kwargs.get("indicator_column")
 
-        indicator = Indicator(
-            name="price_{}".format(metrics),
-            _series=(self._klines[_columns[metrics]]).mean(
-                axis=1))
+        indicator = self._klines.IndicatorsCache.get(
+            ("price", metrics),
+            lambda: Indicator(
+                name="price_{}".format(metrics),
+                _series=_price_of(self._klines, metrics)))
 
         if indicator_column:
             self._klines.loc[:, indicator_column] = indicator._series
@@ -69,15 +260,24 @@ class Trend:
 
         indicator_column = kwargs.get("indicator_column")
 
-        indicator = Indicator(
-            name="sma_{}_{}".format(metrics, str(number_of_candles)),
-            _series=(self._klines.PriceFromKline.using(metrics))
-            ._series.rolling(window=number_of_candles).mean())
+        indicator = self._klines.IndicatorsCache.get(
+            ("sma", metrics, number_of_candles),
+            lambda: Indicator(
+                name="sma_{}_{}".format(metrics, str(number_of_candles)),
+                _series=self._klines.PriceFromKline.using(metrics)
+                ._series.rolling(window=number_of_candles).mean()))
 
         if indicator_column:
             self._klines.loc[:, indicator_column] = indicator._series
         return indicator
 
+    def incremental_simple_moving_average(
+            self, number_of_candles: int,
+            metrics="ohlc4") -> IncrementalSimpleMovingAverage:
+
+        return IncrementalSimpleMovingAverage(
+            number_of_candles, metrics).update_with(self._klines)
+
 
 class Momentum:
     def __init__(self, klines):
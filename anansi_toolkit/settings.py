@@ -48,6 +48,11 @@ class ImplementedClassifiers:
     CrossSMA = "CrossSMA"
 
 
+class ImplementedKlinesStorages:
+    SQLite = "StorageKlines"
+    Columnar = "ColumnarStorageKlines"
+
+
 class ImplementedStopLosses:
     StopTrailing3T = "StopTrailing3T"
 
@@ -122,6 +127,13 @@ class BinanceSettings:
     _time_endpoint = _base_endpoint + "time"
     _klines_endpoint = _base_endpoint + "klines?symbol={}&interval={}"
     _request_weight_per_minute = 1100  # Default: 1200/min/IP
+    _used_weight_header = "x-mbx-used-weight-1m"
+    _klines_request_weight = 2
+    max_concurrent_requests = 8
+    request_timeout = 10  # seconds
+    max_retries = 5
+    backoff_factor = 0.5  # seconds, doubled on each retry
+    max_backoff = 60  # seconds
     records_per_request = 500  # Default: 500 | Limit: 1000 samples/response
     minimal_time_frame = "1m"
     fee_rate_decimal = 0.001
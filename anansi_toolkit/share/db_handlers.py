@@ -1,18 +1,97 @@
+import bisect
+import json
+import os
+import shutil
 import sqlite3
+import threading
+import numpy as np
+import pandas as pd
 
 # TODO: Cuidar do parâmetro 'attributes'
 
 
-class SQLite3:
+class RangeReader:
+    """Typed reading, by ranges of the order key ('_order_key'), for the
+    storages implementing '_range(since, until, columns, limit)', which
+    returns a dict of numpy arrays (one per column, in 'columns' order).
+    """
+
+    __slots__ = []
+
+    def range(self, since: int, until: int, columns: list = None,
+              as_dataframe=False):
+        """Rows with the order key in [since, until], sought by its index,
+        as a dict of typed numpy arrays, or a dataframe built from them.
+        """
+
+        arrays = self._range(since, until, columns)
+        return (pd.DataFrame(arrays, columns=list(arrays)) if as_dataframe
+                else arrays)
+
+    def chunks(self, since: int, until: int, chunk_size: int = 100000,
+               columns: list = None, overlap: int = 0, as_dataframe=True):
+        """Yields the rows of [since, until] by chunks of up to 'chunk_size'
+        new rows, each preceded by the last 'overlap' rows already yielded
+        (so windowed indicators of up to 'overlap' + 1 rows are computed
+        across the chunks boundaries). Only a chunk is held at a time.
+        Dataframes carry the number of repeated rows on attrs["overlap"].
+        """
+
+        key = self._order_key
+        asked = list(columns) if columns else None
+        if asked and key not in asked:
+            asked.append(key)  # Needed to seek the next chunk
+        carried = None
+
+        while since <= until:
+            arrays = self._range(since, until, asked, limit=chunk_size)
+            if not len(arrays[key]):
+                return
+            since = int(arrays[key][-1]) + 1
+
+            repeated = len(carried[key]) if carried else 0
+            if repeated:
+                arrays = {column: np.concatenate([carried[column], values])
+                          for column, values in arrays.items()}
+            if overlap:
+                carried = {column: values[-overlap:].copy()
+                           for column, values in arrays.items()}
+
+            chunk = {column: arrays[column]
+                     for column in (columns if columns else arrays)}
+            if as_dataframe:
+                chunk = pd.DataFrame(chunk, columns=list(chunk))
+                chunk.attrs.update({"overlap": repeated})
+            yield chunk
+
+
+class SQLite3(RangeReader):
+    """Holds a long-lived connection (WAL journal and tuned pragmas) to the
+    database, opened on first use and shared by all the operations of the
+    instance (thread-safe). Bulk appends are a single transaction, rolled
+    back as a whole if it fails. Database errors ('sqlite3.Error') are
+    raised to the caller.
+    """
 
     __slots__ = [
         "_db_name",
         "_table_name",
         "_primary_key",
         "_order_key",
-        "table_exists"
+        "table_exists",
+        "_conn",
+        "_lock",
     ]
 
+    _pragmas = (
+        "journal_mode=WAL",
+        "synchronous=NORMAL",
+        "temp_store=MEMORY",
+        "cache_size=-65536",  # KiB
+        "mmap_size=268435456",  # bytes
+        "busy_timeout=5000",  # ms
+    )
+
     def __init__(self, db_name: str,
                  table_name: str,
                  primary_key: str = None,
@@ -22,91 +101,147 @@ class SQLite3:
         self._primary_key = primary_key
         self._order_key = order_key if order_key != None else primary_key
         self.table_exists = False
-
-    def _perform_sql(self, query):
-
+        self._conn = None
+        self._lock = threading.RLock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(
+                self._db_name, check_same_thread=False)
+            for pragma in self._pragmas:
+                self._conn.execute("PRAGMA {};".format(pragma))
+        return self._conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def __del__(self):
         try:
-            with sqlite3.connect(self._db_name) as conn:
-                c = conn.cursor()
-                c.execute(query)
-            _status = True
-
-        except (Exception, sqlite3.OperationalError) as e:
-            print(e)
-            _status = False
+            self.close()
+        except Exception:
+            pass
 
-        finally:
-            c.close()
-            conn.close()
-
-        return _status
+    def _perform_sql(self, query):
+        with self._lock, self._connection() as conn:
+            conn.execute(query)
 
     def create_table(self):
         query = "CREATE TABLE IF NOT EXISTS {} {};".format(
             self._table_name, self.attributes)
 
-        self.table_exists = self._perform_sql(query)
+        self._perform_sql(query)
+        self.table_exists = True
 
     def rename_table_to(self, new_table_name: str):
         query = "ALTER TABLE {} RENAME TO {};".format(
             self._table_name, new_table_name)
 
-        renamed = self._perform_sql(query)
-        if renamed:
-            self._table_name = new_table_name
+        self._perform_sql(query)
+        self._table_name = new_table_name
 
     def drop_table(self):
         query = "DROP TABLE IF EXISTS {};".format(self._table_name)
         self._perform_sql(query)
 
     def append_dataframe(self, dataframe_to_append):
-        self._save_in_slices(dataframe_to_append)
-
-    def _save_in_slices(self, dataframe_in, step=500):
-        _end = len(dataframe_in)
-
-        for i in range(0, _end, step):
-            _from, _until = i, i + step
-
-            if _until > _end:
-                _until = _end
-            self._append_dataframe(dataframe_in[_from:_until])
-
-    def _append_dataframe(self, dataframe_to_append):
-
-        try:
-            with sqlite3.connect(self._db_name) as conn:
-                dataframe_to_append.to_sql(
-                    name=self._table_name,
-                    con=conn,
-                    if_exists="append",
-                    index=False,
-                    index_label=self._primary_key,
-                    method="multi")
-
-        except (Exception, sqlite3.OperationalError) as e:
-            print(e)
-
-        finally:
-            conn.close()
+        self._append_dataframe(dataframe_to_append)
+
+    def upsert_dataframe(self, dataframe_to_upsert):
+        """As 'append_dataframe', but rows whose primary key is already
+        stored are updated instead of failing (and rolling back the
+        whole dataframe).
+        """
+
+        self._append_dataframe(dataframe_to_upsert,
+                               query=self._upsert_query(
+                                   list(dataframe_to_upsert.columns)))
+
+    def _rows_of(self, dataframe) -> zip:
+        # Python natives (sqlite3 does not bind numpy scalars), column wise
+        return zip(*[dataframe[column].to_numpy().tolist()
+                     for column in dataframe.columns])
+
+    def _insert_query(self, columns: list) -> str:
+        return "INSERT INTO {} ({}) VALUES ({})".format(
+            self._table_name,
+            ", ".join(columns),
+            ", ".join("?" * len(columns)))
+
+    def _upsert_query(self, columns: list) -> str:
+        to_update = ", ".join("{0} = excluded.{0}".format(column)
+                              for column in columns
+                              if column != self._primary_key)
+
+        return "{} ON CONFLICT({}) DO {}".format(
+            self._insert_query(columns),
+            self._primary_key,
+            "UPDATE SET {}".format(to_update) if to_update else "NOTHING")
+
+    def _ensure_table_for(self, dataframe, conn):
+        if not self.table_exists:  # Schema infered from dataframe
+            dataframe[:0].to_sql(
+                name=self._table_name, con=conn, if_exists="append",
+                index=False, index_label=self._primary_key)
+            self.table_exists = True
+
+    def _append_dataframe(self, dataframe_to_append, query=None,
+                          along_with=None):
+        """Writes the dataframe in one transaction, which also runs
+        'along_with(conn)', if given; if any of them fails, nothing is
+        written.
+        """
+
+        if dataframe_to_append.empty and along_with is None:
+            return
+
+        with self._lock, self._connection() as conn:  # One transaction
+            self._ensure_table_for(dataframe_to_append, conn)
+            conn.executemany(
+                query if query else self._insert_query(
+                    list(dataframe_to_append.columns)),
+                self._rows_of(dataframe_to_append))
+
+            if along_with:
+                along_with(conn)
+
+    def _fetch(self, query: str, parameters=()) -> list:
+        with self._lock:
+            return self._connection().execute(query, parameters).fetchall()
 
     def _proceed_search(self, query="") -> list:
-        _query = "SELECT * FROM {} {};".format(self._table_name, query)
-        search_result = []
-        try:
-            with sqlite3.connect(self._db_name) as conn:
-                c = conn.cursor()
-                c.execute(_query)
-                search_result = c.fetchall()
-
-        except (Exception, sqlite3.OperationalError) as e:
-            print(e)
-
-        finally:
-            c.close()
-            conn.close()
-
-        return search_result
+        return self._fetch(
+            "SELECT * FROM {} {};".format(self._table_name, query))
+
+    def _numpy_types(self) -> dict:
+        # By the declared type affinity; numeric columns only
+        return {column[1]: (np.dtype(np.int64) if "INT" in column[2].upper()
+                            else np.dtype(np.float64))
+                for column in self._fetch(
+                    "PRAGMA table_info({});".format(self._table_name))}
+
+    def _range(self, since, until, columns: list = None,
+               limit: int = None) -> dict:
+        # Rows go from the cursor straight into a structured array, with
+        # no list of rows kept
+        types = self._numpy_types()
+        columns = columns if columns else list(types)
+        dtype = np.dtype([(column, types.get(column, np.dtype(np.float64)))
+                          for column in columns])
+        query = ("SELECT {} FROM {} WHERE {} BETWEEN ? AND ? "
+                 "ORDER BY {}{};").format(
+                     ", ".join(columns), self._table_name, self._order_key,
+                     self._order_key,
+                     " LIMIT {}".format(int(limit)) if limit else "")
+        with self._lock:
+            rows = np.fromiter(
+                self._connection().execute(query, (since, until)),
+                dtype=dtype)
+
+        return {column: np.ascontiguousarray(rows[column])
+                for column in columns}
 
     def _get_all(self):
         return self._proceed_search()
@@ -131,9 +266,16 @@ class SQLite3:
 
 
 class StorageKlines(SQLite3):
+    """Klines are upserted by 'Open_time'. Along with the klines, a
+    coverage map is kept (table '<table_name>_coverage'): the disjoint
+    half-open intervals [since, until) of open times already stored (or
+    known to have no candles), merged as they are appended.
+    """
+
     _attributes = (
         "Open_time INTEGER primary key",
-        "Open REAL, High REAL",
+        "Open REAL",
+        "High REAL",
         "Low REAL",
         "Close REAL",
         "Volume REAL",
@@ -145,6 +287,133 @@ class StorageKlines(SQLite3):
             db_name="klines.db", table_name=table_name, primary_key="Open_time"
         )
 
+    def _coverage_table(self) -> str:
+        return "{}_coverage".format(self._table_name)
+
+    def create_table(self):
+        super(StorageKlines, self).create_table()
+        self._ensure_unique_open_times()
+        self._perform_sql(
+            "CREATE TABLE IF NOT EXISTS {} (since INTEGER primary key, "
+            "until INTEGER NOT NULL);".format(self._coverage_table()))
+
+    def _ensure_unique_open_times(self):
+        """Tables created by older versions (from the dataframe schema) lack
+        the primary key, and may hold repeated open times.
+        """
+
+        columns = self._fetch("PRAGMA table_info({});".format(self._table_name))
+        indexes = self._fetch("PRAGMA index_list({});".format(self._table_name))
+        if (any(column[1] == "Open_time" and column[5] for column in columns)
+                or any(index[1] == "{}_Open_time".format(self._table_name)
+                       for index in indexes)):
+            return
+
+        self._perform_sql(
+            """DELETE FROM {0} WHERE rowid NOT IN (
+                SELECT MIN(rowid) FROM {0} GROUP BY Open_time);""".format(
+                self._table_name))
+        self._perform_sql(
+            "CREATE UNIQUE INDEX IF NOT EXISTS {0}_Open_time ON {0} "
+            "(Open_time);".format(self._table_name))
+
+    def append_dataframe(self, dataframe_to_append, covering: tuple = None):
+        """Upserts the klines and, on the same transaction, marks the
+        half-open interval 'covering' = (since, until) as stored.
+        """
+
+        along_with = (None if covering is None else
+                      lambda conn: self._cover(conn, *covering))
+
+        self._append_dataframe(
+            dataframe_to_append,
+            query=self._upsert_query(list(dataframe_to_append.columns)),
+            along_with=along_with)
+
+    def _intervals_around(self, conn, since: int, until: int) -> list:
+        """Stored intervals touching [since, until], by index seeks: the
+        last one starting at or before 'since', and the following ones
+        starting until 'until'.
+        """
+
+        return [row for row in conn.execute(
+            """SELECT since, until FROM {0}
+            WHERE since <= :until AND since >= COALESCE(
+                (SELECT since FROM {0} WHERE since <= :since
+                ORDER BY since DESC LIMIT 1), :since)
+            ORDER BY since;""".format(self._coverage_table()),
+            dict(since=since, until=until)).fetchall()
+            if row[1] >= since]
+
+    def _cover(self, conn, since: int, until: int):
+        if not until > since:
+            return
+
+        touching = self._intervals_around(conn, since, until)
+        if touching:
+            since = min(since, touching[0][0])
+            until = max(until, touching[-1][1])
+            conn.executemany(
+                "DELETE FROM {} WHERE since = ?;".format(self._coverage_table()),
+                [(interval[0],) for interval in touching])
+
+        conn.execute(
+            "INSERT INTO {} (since, until) VALUES (?, ?);".format(
+                self._coverage_table()), (since, until))
+
+    def cover(self, since: int, until: int):
+        """Marks [since, until) as stored (e.g. ranges with no candles).
+        """
+
+        with self._lock, self._connection() as conn:
+            self._cover(conn, since, until)
+
+    def coverage(self) -> list:
+        return self._fetch("SELECT since, until FROM {} ORDER BY since;".format(
+            self._coverage_table()))
+
+    def missing_ranges(self, since: int, until: int) -> list:
+        """Half-open intervals, inside [since, until), not covered yet.
+        """
+
+        missing, expected = [], since
+        with self._lock:
+            covered = self._intervals_around(
+                self._connection(), since, until - 1)
+
+        for covered_since, covered_until in covered:
+            if covered_since > expected:
+                missing.append((expected, min(covered_since, until)))
+            expected = max(expected, covered_until)
+
+        if until > expected:
+            missing.append((expected, until))
+        return missing
+
+    def rebuild_coverage(self, step: int):
+        """Coverage from the stored open times: each run of candles 'step'
+        apart covers [first, last + step).
+        """
+
+        open_times = np.array(
+            [row[0] for row in self._fetch(
+                "SELECT Open_time FROM {} ORDER BY Open_time;".format(
+                    self._table_name))], dtype=np.int64)
+
+        if not len(open_times):
+            return
+
+        breaks = np.flatnonzero(np.diff(open_times) != step) + 1
+        firsts = open_times[np.r_[0, breaks]]
+        lasts = open_times[np.r_[breaks - 1, len(open_times) - 1]] + step
+
+        with self._lock, self._connection() as conn:
+            conn.execute("DELETE FROM {};".format(self._coverage_table()))
+            conn.executemany(
+                "INSERT INTO {} (since, until) VALUES (?, ?);".format(
+                    self._coverage_table()),
+                zip(firsts.tolist(), lasts.tolist()))
+
 
 class Storage(SQLite3):
     def __init__(self, db_name: str, table_name: str, primary_key: str):
@@ -152,3 +421,271 @@ class Storage(SQLite3):
             db_name=db_name,
             table_name=table_name,
             primary_key=primary_key)
+
+
+class ColumnarStorageKlines(RangeReader):
+    """Klines as fixed width column files ('<month>.<column>.bin', raw
+    little endian int64/float64), one set per month of open times, under
+    '<root>/<table_name>/'. A manifest ('manifest.json') holds the columns
+    dtypes, the rows of each month and the coverage map; a partition is
+    only valid up to the rows on the manifest, which is replaced after the
+    columns are written. Reads are memory-mapped: a range only touches the
+    pages of its months (no copy when inside a single month).
+    Same interface of 'StorageKlines', so both are pluggable on
+    'KlinesFromBroker'. A failed append raises, leaving the manifest (so
+    the stored rows and the coverage) as it was.
+    """
+
+    __slots__ = [
+        "_table_name",
+        "_path",
+        "_manifest",
+        "_lock",
+        "table_exists",
+    ]
+
+    _dtypes = {"Open_time": "<i8"}  # Others are "<f8"
+    _order_key = "Open_time"
+
+    def __init__(self, table_name: str, root: str = "klines"):
+        self._table_name = table_name
+        self._path = os.path.join(root, table_name)
+        self._manifest = dict(columns=dict(), partitions=dict(), coverage=[])
+        self._lock = threading.RLock()
+        self.table_exists = False
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self._path, "manifest.json")
+
+    def _column_path(self, partition: str, column: str) -> str:
+        return os.path.join(self._path, "{}.{}.bin".format(partition, column))
+
+    def create_table(self):
+        os.makedirs(self._path, exist_ok=True)
+        if os.path.exists(self._manifest_path()):
+            with open(self._manifest_path()) as manifest:
+                self._manifest = json.load(manifest)
+        self.table_exists = True
+
+    def drop_table(self):
+        with self._lock:
+            shutil.rmtree(self._path, ignore_errors=True)
+            self._manifest = dict(columns=dict(), partitions=dict(),
+                                  coverage=[])
+            self.table_exists = False
+
+    def close(self):
+        pass  # Nothing is kept opened between calls
+
+    def _save_manifest(self):
+        temporary = "{}.tmp".format(self._manifest_path())
+        with open(temporary, "w") as manifest:
+            json.dump(self._manifest, manifest)
+        os.replace(temporary, self._manifest_path())
+
+    @staticmethod
+    def _partitions_of(open_times: np.ndarray) -> np.ndarray:
+        return np.datetime_as_string(
+            open_times.astype("datetime64[s]").astype("datetime64[M]"))
+
+    @staticmethod
+    def _partition_at(timestamp: int) -> str:
+        return str(np.datetime64(int(timestamp), "s").astype("datetime64[M]"))
+
+    def _read(self, partition: str, column: str) -> np.ndarray:
+        rows = self._manifest["partitions"][partition]["rows"]
+        dtype = np.dtype(self._manifest["columns"][column])
+        if not rows:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(self._column_path(partition, column),
+                         dtype=dtype, mode="r", shape=(rows,))
+
+    def _write(self, partition: str, columns: dict, appending: bool,
+               replacing: list):
+        """Appends the columns to the partition files, or rewrites them: to
+        temporary files, moved over them by the caller ('replacing' gets
+        their paths) once all the partitions are written.
+        """
+
+        rows = self._manifest["partitions"].get(partition, {}).get("rows", 0)
+
+        for column, values in columns.items():
+            path = self._column_path(partition, column)
+            if appending:
+                with open(path, "ab") as column_file:
+                    # Drops bytes of an append not on the manifest
+                    column_file.truncate(rows * values.dtype.itemsize)
+                    column_file.write(values.tobytes())
+            else:
+                values.tofile("{}.tmp".format(path))
+                replacing.append(path)
+
+        open_times = columns["Open_time"]
+        self._manifest["partitions"][partition] = dict(
+            rows=(rows if appending else 0) + len(open_times),
+            first=(self._manifest["partitions"][partition]["first"]
+                   if appending and rows else int(open_times[0])),
+            last=int(open_times[-1]))
+
+    def _upsert_partition(self, partition: str, columns: dict,
+                          replacing: list):
+        stored = self._manifest["partitions"].get(partition)
+
+        if not stored or columns["Open_time"][0] > stored["last"]:
+            self._write(partition, columns, appending=bool(stored),
+                        replacing=replacing)
+            return
+
+        merged = {column: np.concatenate([self._read(partition, column),
+                                          values])
+                  for column, values in columns.items()}
+        open_times = merged["Open_time"]
+        order = np.argsort(open_times, kind="stable")  # Stored ones first
+        sorted_open_times = open_times[order]
+        last_of_each = np.r_[sorted_open_times[1:] != sorted_open_times[:-1],
+                             True]  # The newest row of each open time
+        keep = order[last_of_each]
+
+        self._write(partition,
+                    {column: np.ascontiguousarray(values[keep])
+                     for column, values in merged.items()},
+                    appending=False, replacing=replacing)
+
+    def append_dataframe(self, dataframe_to_append, covering: tuple = None):
+        """Upserts the klines (by 'Open_time') and marks the half-open
+        interval 'covering' = (since, until) as stored.
+        """
+
+        with self._lock:
+            manifest = json.loads(json.dumps(self._manifest))
+            replacing = []
+            try:
+                self._append(dataframe_to_append, covering, replacing)
+            except Exception:
+                self._manifest = manifest
+                for path in replacing:
+                    if os.path.exists("{}.tmp".format(path)):
+                        os.remove("{}.tmp".format(path))
+                raise
+
+    def _append(self, dataframe_to_append, covering: tuple,
+                replacing: list):
+        if not dataframe_to_append.empty:
+            klines = dataframe_to_append.sort_values("Open_time")
+            for column in klines.columns:
+                self._manifest["columns"].setdefault(
+                    column, self._dtypes.get(column, "<f8"))
+
+            columns = {
+                column: klines[column].to_numpy(
+                    dtype=self._manifest["columns"][column])
+                for column in klines.columns}
+            partitions = self._partitions_of(columns["Open_time"])
+            bounds = np.flatnonzero(
+                np.r_[True, partitions[1:] != partitions[:-1], True])
+
+            for first, last in zip(bounds[:-1], bounds[1:]):
+                self._upsert_partition(
+                    partitions[first],
+                    {column: values[first:last]
+                     for column, values in columns.items()},
+                    replacing)
+
+        if covering is not None:
+            self._cover(*covering)
+        for path in replacing:
+            os.replace("{}.tmp".format(path), path)
+        self._save_manifest()
+
+    upsert_dataframe = append_dataframe
+
+    def _cover(self, since: int, until: int):
+        if not until > since:
+            return
+
+        kept = []
+        for covered_since, covered_until in self._manifest["coverage"]:
+            if covered_until < since or covered_since > until:
+                kept.append([covered_since, covered_until])
+            else:  # Touching: merged
+                since = min(since, covered_since)
+                until = max(until, covered_until)
+
+        kept.insert(bisect.bisect(kept, [since, until]), [since, until])
+        self._manifest["coverage"] = kept
+
+    def cover(self, since: int, until: int):
+        """Marks [since, until) as stored (e.g. ranges with no candles).
+        """
+
+        with self._lock:
+            self._cover(since, until)
+            self._save_manifest()
+
+    def coverage(self) -> list:
+        return [tuple(interval) for interval in self._manifest["coverage"]]
+
+    def missing_ranges(self, since: int, until: int) -> list:
+        """Half-open intervals, inside [since, until), not covered yet.
+        """
+
+        coverage = self._manifest["coverage"]
+        first = max(bisect.bisect(coverage, [since, since]) - 1, 0)
+        missing, expected = [], since
+
+        for covered_since, covered_until in coverage[first:]:
+            if covered_since >= until:
+                break
+            if covered_since > expected:
+                missing.append((expected, covered_since))
+            expected = max(expected, covered_until)
+
+        if until > expected:
+            missing.append((expected, until))
+        return missing
+
+    def rebuild_coverage(self, step: int):
+        """Coverage from the stored open times: each run of candles 'step'
+        apart covers [first, last + step).
+        """
+
+        with self._lock:
+            self._manifest["coverage"] = []
+            for partition in sorted(self._manifest["partitions"]):
+                open_times = self._read(partition, "Open_time")
+                if not len(open_times):
+                    continue
+
+                breaks = np.flatnonzero(np.diff(open_times) != step) + 1
+                for first, last in zip(np.r_[0, breaks],
+                                       np.r_[breaks - 1, len(open_times) - 1]):
+                    self._cover(int(open_times[first]),
+                                int(open_times[last]) + step)
+            self._save_manifest()
+
+    def _range(self, since: int, until: int, columns: list = None,
+               limit: int = None) -> dict:
+        # Memory-mapped views when the range is inside a single month
+        columns = columns if columns else list(self._manifest["columns"])
+        first, last = self._partition_at(since), self._partition_at(until)
+        pieces = {column: [] for column in columns}
+        remaining = limit if limit else np.inf
+
+        with self._lock:
+            for partition in sorted(self._manifest["partitions"]):
+                if not first <= partition <= last or not remaining:
+                    continue
+
+                open_times = self._read(partition, "Open_time")
+                begin = np.searchsorted(open_times, since, side="left")
+                end = min(np.searchsorted(open_times, until, side="right"),
+                          begin + remaining)
+                remaining -= end - begin
+                for column in columns:
+                    pieces[column].append(
+                        self._read(partition, column)[begin:end])
+
+        return {column: (found[0] if len(found) == 1 else np.concatenate(
+                    found or [np.empty(0, dtype=self._dtypes.get(
+                        column, "<f8"))]))
+                for column, found in pieces.items()}
@@ -4,10 +4,14 @@
 from ..settings import (PossibleSides as SIDE,
                         PossibleSignals as SIG, PossibleOrderTypes as ORD)
 import json
+import random
 from collections import namedtuple
+from email.utils import parsedate_to_datetime
 from functools import wraps, partial
+from multiprocessing import shared_memory
 from time import time
 import pendulum
+import numpy as np
 import pandas as pd
 from tabulate import tabulate
 
@@ -25,6 +29,22 @@ class ParseDateTime:
         return pendulum.from_timestamp(self.date_time_in).to_datetime_string()
 
 
+def timestamps_to_human_readable(timestamps) -> np.ndarray:
+    """Vectorized 'ParseDateTime.from_timestamp_to_human_readable'.
+    """
+
+    date_times = np.asarray(timestamps, dtype=np.int64).astype("datetime64[s]")
+    return np.char.replace(
+        np.datetime_as_string(date_times), "T", " ").astype(object)
+
+
+def human_readable_to_timestamps(date_times) -> np.ndarray:
+    """Vectorized 'ParseDateTime.from_human_readable_to_timestamp'.
+    """
+
+    return np.asarray(date_times, dtype="datetime64[s]").astype(np.int64)
+
+
 def seconds_in(time_frame: str) -> int:
     conversor_for = {"m": 60, "h": 3600, "d": 86400, "w": 604800}
     time_unit = time_frame[-1]
@@ -33,6 +53,14 @@ def seconds_in(time_frame: str) -> int:
     return time_amount*conversor_for[time_unit]
 
 
+def open_time_offset(time_frame: str) -> int:
+    """Open times of a time frame are multiples of its seconds, plus this
+    offset: weekly candles open on mondays (the epoch was on a thursday).
+    """
+
+    return 345600 % seconds_in(time_frame) if time_frame[-1] == "w" else 0
+
+
 class Serialize:
     def __init__(self, Target: object):
         self.Target = Target
@@ -119,6 +147,10 @@ class DocInherit(object):
 
 
 class FormatKlines:
+    """Parses the raw klines (list of lists, as returned by the broker),
+    column by column, into typed numpy arrays, in one pass.
+    """
+
     __slots__ = [
         "time_frame",
         "DateTimeFmt",
@@ -139,50 +171,194 @@ class FormatKlines:
         self.DateTimeFmt = DateTimeFmt
         self.DateTimeUnit = DateTimeUnit
         self.columns = columns
-        self.formatted_klines = [self.format_each(kline) for kline in klines]
+        self.formatted_klines = self.format_columns(klines)
 
     def format_datetime(self,
                         datetime_in,
-                        truncate_seconds_to_zero=False) -> int:
+                        truncate_seconds_to_zero=False) -> np.ndarray:
 
         if self.DateTimeFmt == "timestamp":
             if self.DateTimeUnit == "seconds":
-                datetime_out = int(float(datetime_in))
+                datetime_out = np.asarray(
+                    datetime_in, dtype=np.float64).astype(np.int64)
 
             elif self.DateTimeUnit == "milliseconds":
-                datetime_out = int(float(datetime_in) / 1000)
+                datetime_out = np.asarray(datetime_in, dtype=np.int64) // 1000
 
             if truncate_seconds_to_zero:
-                _date_time = pendulum.from_timestamp(int(datetime_out))
-
-                if _date_time.second != 0:
-                    datetime_out = (
-                        _date_time.subtract(
-                            seconds=_date_time.second)).int_timestamp
+                datetime_out = datetime_out - datetime_out % 60
 
         return datetime_out
 
-    def format_each(self, kline: list) -> list:
+    def format_columns(self, klines: list) -> dict:
+        raw_columns = (list(zip(*klines)) if klines
+                       else [()] * len(self.columns))
 
-        return [
-            self.format_datetime(_item, truncate_seconds_to_zero=True)
-            if kline.index(_item) == self.columns.index("Open_time")
-            else self.format_datetime(_item)
-            if kline.index(_item) == self.columns.index("Close_time")
-            else float(_item)
-            for _item in kline
-        ]
+        return {
+            column: self.format_datetime(values, truncate_seconds_to_zero=True)
+            if column == "Open_time"
+            else self.format_datetime(values)
+            if column == "Close_time"
+            else np.asarray(values, dtype=np.float64)
+            for column, values in zip(self.columns, raw_columns)
+        }
 
     def to_dataframe(self) -> pd.DataFrame:
-        klines = pd.DataFrame(
-            self.formatted_klines,
-            columns=self.columns
-        ).astype({"Open_time": "int32", "Close_time": "int32"})
+        klines = pd.DataFrame(self.formatted_klines, columns=self.columns)
 
         klines.attrs.update(
             {"SecondsTimeFrame": seconds_in(self.time_frame)})
         return klines
 
+
+class KlinesBuffer:
+    """Accumulates klines (pages, chunks) as columnar arrays, so the
+    resulting dataframe is built only once, on 'to_dataframe', in linear
+    time, instead of copying the whole accumulated frame on each append.
+    """
+
+    __slots__ = ["columns", "attrs", "_chunks", "_length"]
+
+    def __init__(self, columns: list = None):
+        self.columns = columns
+        self.attrs = dict()
+        self._chunks = []
+        self._length = 0
+
+    def __len__(self) -> int:
+        return self._length
+
+    def append(self, klines: pd.DataFrame):
+        self.attrs.update(klines.attrs)
+        if klines.empty:
+            return
+
+        if self.columns is None:
+            self.columns = list(klines.columns)
+        self._chunks.append(
+            [klines[column].to_numpy() for column in self.columns])
+        self._length += len(klines)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        if not self._chunks:
+            klines = pd.DataFrame(columns=self.columns)
+        else:
+            klines = pd.DataFrame(
+                {column: np.concatenate([chunk[i] for chunk in self._chunks])
+                 for i, column in enumerate(self.columns)},
+                columns=self.columns)
+
+        klines.attrs.update(self.attrs)
+        return klines
+
+
+_resampling_of = {
+    "Open": "first",
+    "High": "max",
+    "Low": "min",
+    "Close": "last",
+    "Volume": "sum",
+}
+
+
+def resample_klines(klines: pd.DataFrame, time_frame: str) -> pd.DataFrame:
+    """Aggregates klines (sorted, with integer 'Open_time') into candles of
+    'time_frame', aligned as the broker ones: first Open, max High, min Low,
+    last Close and summed Volume. Other columns are dropped. The last
+    candle may still be incomplete.
+    """
+
+    step = seconds_in(time_frame)
+    offset = open_time_offset(time_frame)
+    columns = ["Open_time"] + [column for column in klines.columns
+                               if column in _resampling_of]
+
+    open_times = klines.Open_time.to_numpy(dtype=np.int64)
+    if not len(open_times):
+        resampled = pd.DataFrame(
+            {column: np.empty(0, dtype=np.int64 if column == "Open_time"
+                              else np.float64) for column in columns},
+            columns=columns)
+        resampled.attrs.update({"SecondsTimeFrame": step})
+        return resampled
+
+    buckets = (open_times - offset) // step * step + offset
+    firsts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    lasts = np.r_[firsts[1:] - 1, len(buckets) - 1]
+
+    aggregate = {
+        "first": lambda values: values[firsts],
+        "max": lambda values: np.maximum.reduceat(values, firsts),
+        "min": lambda values: np.minimum.reduceat(values, firsts),
+        "last": lambda values: values[lasts],
+        "sum": lambda values: np.add.reduceat(values, firsts),
+    }
+    resampled = pd.DataFrame(
+        dict([("Open_time", buckets[firsts])]
+             + [(column, aggregate[_resampling_of[column]](
+                 klines[column].to_numpy()))
+                for column in columns[1:]]),
+        columns=columns)
+
+    resampled.attrs.update({"SecondsTimeFrame": step})
+    return resampled
+
+
+class KlinesResampler:
+    """Resamples a stream of klines (of 'source_time_frame') into klines of
+    'time_frame'. Each 'update' takes the klines arrived (those not newer
+    than the last fed are ignored), in O(new klines), and returns the
+    candles they closed; the candle being formed is kept on 'forming'.
+    """
+
+    __slots__ = ["time_frame", "source_time_frame", "last_open_time",
+                 "forming"]
+
+    def __init__(self, time_frame: str, source_time_frame: str = "1m"):
+        self.time_frame = time_frame
+        self.source_time_frame = source_time_frame
+        self.last_open_time = None
+        self.forming = None  # One row dataframe
+
+    def _closed(self, resampled: pd.DataFrame) -> np.ndarray:
+        # The last source candle of a bucket was fed (or a later one)
+        return (resampled.Open_time.to_numpy() + seconds_in(self.time_frame)
+                <= self.last_open_time + seconds_in(self.source_time_frame))
+
+    def update(self, klines: pd.DataFrame) -> pd.DataFrame:
+        if self.last_open_time is not None:
+            klines = klines[klines.Open_time > self.last_open_time]
+        resampled = resample_klines(klines, self.time_frame)
+
+        if resampled.empty:
+            return resampled
+        self.last_open_time = int(klines.Open_time.iloc[-1])
+
+        if self.forming is not None:
+            if self.forming.Open_time.item() == resampled.Open_time.iloc[0]:
+                for column in resampled.columns[1:]:
+                    formed, arrived = (self.forming[column].item(),
+                                       resampled.at[0, column])
+                    resampled.at[0, column] = {
+                        "first": formed,
+                        "max": max(formed, arrived),
+                        "min": min(formed, arrived),
+                        "last": arrived,
+                        "sum": formed + arrived,
+                    }[_resampling_of[column]]
+            else:
+                resampled = pd.concat([self.forming, resampled],
+                                      ignore_index=True)
+
+        closed = self._closed(resampled)
+        self.forming = None if closed[-1] else resampled[-1:].reset_index(
+            drop=True)
+
+        candles = resampled[closed].reset_index(drop=True)
+        candles.attrs.update({"SecondsTimeFrame": seconds_in(self.time_frame)})
+        return candles
+
+
 def table_from_dict(my_dict:dict)->str:
     return tabulate([list(my_dict.values())], headers=list(my_dict.keys()))
 
@@ -190,4 +366,123 @@ def table_from_dict(my_dict:dict)->str:
 class EventContainer:
     def __init__(self, reporter: str, description: str = None):
         self.reporter = reporter
-        self.description = description
\ No newline at end of file
+        self.description = description
+
+
+class RetryPolicy:
+    """Exponential backoff, with jitter, between attempts of a request (or
+    of any other operation, as a database commit). When a broker answers
+    429 (too many requests) or 418 (IP banned for a while), its
+    'Retry-After' header (in seconds or as an HTTP date) takes precedence.
+    """
+
+    __slots__ = [
+        "max_retries",
+        "backoff_factor",
+        "max_backoff",
+        "jitter",
+        "retry_on_status",
+    ]
+
+    def __init__(self,
+                 max_retries: int = 5,
+                 backoff_factor: float = 0.5,
+                 max_backoff: float = 60.0,
+                 jitter: float = 0.5,
+                 retry_on_status: tuple = (418, 429, 500, 502, 503, 504)):
+
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.retry_on_status = retry_on_status
+
+    def should_retry(self, attempt: int, response=None) -> bool:
+        if attempt >= self.max_retries:
+            return False
+        return bool(response is None
+                    or response.status_code in self.retry_on_status)
+
+    @staticmethod
+    def _retry_after(response) -> float:
+        """Seconds asked by the 'Retry-After' header, given in seconds or as
+        an HTTP date (None if missing or not understood).
+        """
+
+        retry_after = response.headers.get("Retry-After")
+        if retry_after is None:
+            return None
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp()
+                       - time())
+        except (TypeError, ValueError):
+            return None
+
+    def delay(self, attempt: int, response=None) -> float:
+        if response is not None and response.status_code in (418, 429):
+            retry_after = self._retry_after(response)
+            if retry_after is not None:
+                return retry_after
+
+        backoff = min(self.max_backoff, self.backoff_factor * 2 ** attempt)
+        return backoff * random.uniform(1 - self.jitter, 1)
+
+
+class SharedArrays:
+    """Named numpy arrays on a single block of shared memory: created (and
+    filled) once by a process, with 'create', and attached by others with
+    no copies, given its 'descriptor' (picklable). The creator must
+    'unlink' it when done; each process 'close's it when it does not need
+    the arrays anymore.
+    """
+
+    __slots__ = ["_shm", "layout", "arrays"]
+
+    _alignment = 64  # bytes
+
+    def __init__(self, shm: shared_memory.SharedMemory, layout: dict):
+        self._shm = shm
+        self.layout = layout  # name -> (dtype, shape, offset)
+        self.arrays = {name: np.ndarray(shape, dtype=dtype, buffer=shm.buf,
+                                        offset=offset)
+                       for name, (dtype, shape, offset) in layout.items()}
+
+    @classmethod
+    def create(cls, arrays: dict):
+        layout, size = dict(), 0
+        for name, array in arrays.items():
+            array = np.asarray(array)
+            layout[name] = (array.dtype.str, array.shape, size)
+            size += -(-array.nbytes // cls._alignment) * cls._alignment
+
+        shared = cls(shared_memory.SharedMemory(create=True, size=max(size, 1)),
+                     layout)
+        for name, array in arrays.items():
+            shared.arrays[name][...] = array
+        return shared
+
+    @classmethod
+    def attach(cls, descriptor: tuple):
+        name, layout = descriptor
+        return cls(shared_memory.SharedMemory(name=name), layout)
+
+    @property
+    def descriptor(self) -> tuple:
+        return (self._shm.name, self.layout)
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.arrays[name]
+
+    def close(self):
+        """The arrays (and any view of them) must not be used afterwards.
+        """
+
+        self.arrays = dict()
+        self._shm.close()
+
+    def unlink(self):
+        self._shm.unlink()
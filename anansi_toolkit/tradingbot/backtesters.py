@@ -0,0 +1,230 @@
+import math
+import numpy as np
+from ..settings import (
+    PossibleModes as MODE,
+    PossibleSides as SIDE,
+    PossibleSignals as SIG,
+    PossibleStatuses as STAT,
+)
+from .models import run_unit_of_work
+from .orders import SignalGenerator, backtesting_fill, order_amount
+from .traders import SimpleKlinesTrader
+
+
+class Simulation:
+    """Simulates the orders of a back testing over the sides suggested by a
+    classifier for all the steps at once. The rules are the same of the step
+    by step trader ('SignalGenerator', amounts and fills from 'orders'), but
+    only the steps on which the suggested side differs from the position
+    side are visited.
+    """
+
+    def __init__(self,
+                 initial_base_amount: float,
+                 fee_rate_decimal: float,
+                 minimal_amount: float,
+                 allowed_special_signals: list):
+
+        self.SigGen = SignalGenerator(allowed_special_signals)
+        self.fee_rate_decimal = fee_rate_decimal
+        self.minimal_amount = minimal_amount
+        self.side = SIDE.Zeroed
+        self.base = initial_base_amount
+        self.quote = 0.0
+        self.trades = []
+        self.holdings = []  # (base, quote) after each trade
+        self._steps_out_of = dict()
+
+    def _next_step_out_of(self, sides, side: str, after: int):
+        """First step, after 'after', whose suggested side is not 'side'.
+        """
+
+        if side not in self._steps_out_of:
+            self._steps_out_of[side] = np.flatnonzero(sides != side)
+
+        steps = self._steps_out_of[side]
+        i = np.searchsorted(steps, after, side="right")
+        return int(steps[i]) if i < len(steps) else None
+
+    def _execute(self, timestamp: int, to_side: str, price: float):
+        self.SigGen.process(self.side, to_side, due_to_stop=False)
+        signal = self.SigGen.signal
+
+        if signal in [SIG.Hold, SIG.SkippedDueToStopLoss]:
+            return
+
+        amount = order_amount(
+            signal, self.base, self.quote, price, self.minimal_amount)
+        if not amount > self.minimal_amount:
+            return
+
+        fill = backtesting_fill(signal, amount, price, self.base, self.quote,
+                                self.fee_rate_decimal)
+        if fill:
+            self.quote, self.base, fee = fill
+            self.side = self.SigGen.side
+            self.trades.append(dict(
+                timestamp=int(timestamp),
+                signal=signal,
+                price=price,
+                quote_amount=amount,
+                fee=fee,
+            ))
+            self.holdings.append((self.base, self.quote))
+
+    def run(self, timestamps, sides, price_at) -> list:
+        """Args:
+            timestamps: 'now' of each step
+            sides: side suggested on each step (None if the analysis failed)
+            price_at: callable returning the price at a timestamp (NaN, or
+            an exception, if it could not be got)
+
+        Returns:
+            list: The trades details, as on the operation trades log.
+        """
+
+        sides = np.asarray(sides, dtype=object)
+        step = self._next_step_out_of(sides, self.side, -1)
+
+        while step is not None:
+            suggested = sides[step]
+
+            if suggested is None:
+                step = self._next_step_out_of(sides, self.side, step)
+                continue
+
+            try:
+                price = price_at(int(timestamps[step]))
+            except Exception:
+                price = math.nan
+
+            if not math.isnan(price):
+                self._execute(timestamps[step], suggested, price)
+
+            if self.side == suggested:
+                step = self._next_step_out_of(sides, self.side, step)
+
+            elif self.SigGen.signal == SIG.Hold and not math.isnan(price):
+                # Not allowed signal: holds until the suggestion changes.
+                change = self._next_step_out_of(sides, suggested, step)
+                step = (None if change is None else
+                        self._next_step_out_of(sides, self.side, change - 1))
+
+            else:  # No funds or no price: tries again on the next step.
+                step = step + 1 if step + 1 < len(sides) else None
+
+        return self.trades
+
+
+def suggested_sides(classifier, steps: np.ndarray, klines) -> np.ndarray:
+    """Side suggested by the classifier on each step, given the
+    'number_of_candles' klines until that step. Where the klines have gaps,
+    the window of a step is not full; those steps are analyzed one by one.
+    """
+
+    n = classifier.number_of_candles
+    open_times = klines.Open_time.to_numpy()
+    last = np.searchsorted(open_times, steps, side="right")
+    first = np.searchsorted(
+        open_times, steps - (n + 1) * classifier.step, side="left")
+
+    full = (last - first) >= n
+    sides = np.empty(len(steps), dtype=object)
+    sides[full] = (classifier.get_results_for_series(klines)
+                   .side.to_numpy()[last[full] - 1])
+
+    for i in np.flatnonzero(~full):
+        try:
+            sides[i] = classifier.get_result_for_this(
+                klines[first[i]:last[i]][-n:]).side
+        except Exception:  # As on the trader, no order on this step
+            sides[i] = None
+
+    return sides
+
+
+class VectorizedBackTester(SimpleKlinesTrader):
+    """Back testing of an operation evaluating its classifier over the whole
+    klines series at once ('get_results_for_series'), instead of running the
+    trader cycle candle by candle. Ends with the same trades log, position
+    and assets of 'SimpleKlinesTrader.run', but logs only the last cycle.
+    """
+
+    def __init__(self, operation, report_every: int = 1,
+                 log_sink=None):
+        if operation.mode != MODE.BackTesting:
+            raise ValueError(
+                "{} only runs on {} mode".format(
+                    self.__class__.__name__, MODE.BackTesting))
+        if operation.is_stop_loss_enabled:
+            raise ValueError(
+                "{} does not simulate the stop loss yet".format(
+                    self.__class__.__name__))
+
+        super(VectorizedBackTester, self).__init__(
+            operation, report_every, log_sink)
+
+    def _steps(self) -> np.ndarray:
+        # Same 'now' sequence of the step by step back testing
+        final = max(self._now, self._final_backtesting_now)
+        return np.arange(self._now, final + 1, self.Classifier.step)
+
+    def _sides_at(self, steps: np.ndarray, klines) -> np.ndarray:
+        return suggested_sides(self.Classifier, steps, klines)
+
+    def _persist(self, simulation: Simulation):
+        for trade_details in simulation.trades:
+            self.operation.new_trade_log(trade_details)
+
+        self.operation.position.assets.update(
+            quote=simulation.quote, base=simulation.base)
+
+        if simulation.trades:
+            last_trade = simulation.trades[-1]
+            self.operation.position.update(
+                side=simulation.side,
+                traded_price=last_trade["price"],
+                traded_at=last_trade["timestamp"],
+                due_to_signal=last_trade["signal"],
+                exit_reference_price=None,
+                extreme_price=None,
+            )
+
+    def _log_last_cycle(self, klines):
+        try:
+            self._get_price()
+            self.last_result = self.Classifier.get_result_for_this(
+                klines[klines.Open_time <= self._now]
+                [-self.Classifier.number_of_candles:])
+        except (Exception, ConnectionError) as e:
+            self._report_to_log(str(e))
+
+        self.operation.last_check.update(by_classifier_at=self._now)
+        self._consolidate_log()
+        self.log.flush()
+
+    def _finish(self, simulation: Simulation, steps: np.ndarray, klines):
+        self._persist(simulation)
+        self._now = int(steps[-1])
+        self._log_last_cycle(klines)
+        self.operation.update(status=STAT.NotRunning)
+
+    def run(self):
+        run_unit_of_work(self._start, on_retry=self._refresh)
+        steps = self._steps()
+
+        klines = self.KlinesGetter.get(
+            since=self.KlinesGetter._oldest_open_time(), until=int(steps[-1]))
+
+        simulation = Simulation(
+            initial_base_amount=self.operation.position.assets.base,
+            fee_rate_decimal=self.OrderHandler.broker.fee_rate_decimal,
+            minimal_amount=self.OrderHandler.broker.mininal_amount,
+            allowed_special_signals=self.operation.allowed_special_signals,
+        )
+        simulation.run(steps, self._sides_at(steps, klines),
+                       price_at=lambda at: self.PriceGetter.get(at=at))
+        run_unit_of_work(self._finish, simulation, steps, klines,
+                         on_retry=self._refresh)
+        if self.report_every:
+            self.operation.print_report(log=self.log.last_record)
@@ -1,5 +1,7 @@
 from ..settings import PossibleSides as SIDE
 import json
+import numpy as np
+import pandas as pd
 from ..share.tools import Serialize, Deserialize, seconds_in
 deserialize = Deserialize()
 
@@ -23,24 +25,75 @@ class CrossSMA:
         self.analyzed_data = None
         self.number_of_candles = self.parameters.larger_sample
         self.step = seconds_in(self.parameters.time_frame)
+        self._SMA_smaller = None
+        self._SMA_larger = None
 
     def _append_to_log(self, data, result):
         self.log.analyzed_by = self.__class__.__name__
         self.log.analysis_result = Serialize(result).to_dict()
         self.log.last_analyzed_data = (data.to_dict(orient="records")[0])
 
-    def get_result_for_this(self, data):
-        result = Result()
+    def _continues_the_analyzed(self, data) -> int:
+        """Position, on 'data', of the last candle already fed to the
+        incremental SMAs (or None, if 'data' does not continue them).
+        """
 
-        result.SMA_smaller = (
-            data.apply_indicator.trend.simple_moving_average(
-                number_of_candles=self.parameters.smaller_sample,
-                metrics=self.parameters.price_metrics)).last()
+        if self._SMA_larger is None or self._SMA_larger.last_open_time is None:
+            return None
 
-        result.SMA_larger = (
-            data.apply_indicator.trend.simple_moving_average(
+        last = self._SMA_larger.last_open_time
+        position = data.Open_time.searchsorted(last)
+        if position < len(data) and data.Open_time.iloc[position] == last:
+            return position
+        return None
+
+    def _update_SMAs(self, data):
+        """Each new candle costs O(1) to the incremental SMAs. They are
+        rebuilt from 'data' if it does not continue the candles already fed
+        or if it is not full (then, the SMA over the larger sample is NaN,
+        as for the batch computation).
+        """
+
+        position = (self._continues_the_analyzed(data)
+                    if len(data) >= self.parameters.larger_sample else None)
+
+        if position is None:
+            trend = data.apply_indicator.trend
+            self._SMA_smaller = trend.incremental_simple_moving_average(
+                number_of_candles=self.parameters.smaller_sample,
+                metrics=self.parameters.price_metrics)
+            self._SMA_larger = trend.incremental_simple_moving_average(
                 number_of_candles=self.parameters.larger_sample,
-                metrics=self.parameters.price_metrics)).last()
+                metrics=self.parameters.price_metrics)
+            return
+
+        for candle in data[position + 1:].to_dict(orient="records"):
+            self._SMA_smaller.update(candle)
+            self._SMA_larger.update(candle)
+
+    def state(self) -> tuple:
+        """Snapshot of what an analysis changes (the incremental SMAs), to
+        'restore' it.
+        """
+
+        return tuple((sma, None if sma is None else sma.state())
+                     for sma in (self._SMA_smaller, self._SMA_larger))
+
+    def restore(self, state: tuple):
+        (self._SMA_smaller, _), (self._SMA_larger, _) = state
+        for sma, sma_state in state:
+            if sma is not None:
+                sma.restore(sma_state)
+
+    def get_result_for_this(self, data):
+        if data.empty:
+            raise ValueError("There is no data to be analyzed")
+
+        result = Result()
+        self._update_SMAs(data)
+
+        result.SMA_smaller = self._SMA_smaller.last()
+        result.SMA_larger = self._SMA_larger.last()
 
         result.side = (
             SIDE.Long if result.SMA_smaller > result.SMA_larger
@@ -49,3 +102,24 @@ class CrossSMA:
         #data.KlinesDateTime.from_human_readable_to_timestamp()
         self._append_to_log(data[-1:], result)
         return result
+
+    def get_results_for_series(self, data) -> pd.DataFrame:
+        """Vectorized version of 'get_result_for_this': each row holds the
+        result the classifier would give if 'data' ended on that row.
+        """
+
+        results = pd.DataFrame(index=data.index)
+
+        results["SMA_smaller"] = (
+            data.apply_indicator.trend.simple_moving_average(
+                number_of_candles=self.parameters.smaller_sample,
+                metrics=self.parameters.price_metrics))._series
+
+        results["SMA_larger"] = (
+            data.apply_indicator.trend.simple_moving_average(
+                number_of_candles=self.parameters.larger_sample,
+                metrics=self.parameters.price_metrics))._series
+
+        results["side"] = np.where(
+            results.SMA_smaller > results.SMA_larger, SIDE.Long, SIDE.Zeroed)
+        return results
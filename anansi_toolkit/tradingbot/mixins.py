@@ -1,18 +1,17 @@
 # pylint: skip-file
-import json
 from anansi_toolkit.share.tools import ParseDateTime
 from pony.orm import select, desc
 from ..share.tools import table_from_dict
 
 class Report:
-    def _init(self):
+    def _init(self, log=None):
         self.sub_h = "### Cycle information ###"
         self.pos_h = "> Position"
         self.dta_h = "> Last Analyzed Data"
         self.res_h = "> Analysis Result"
         self.ord_h = "> Order" 
         self.err_h = "> Errors, exceptions, warnings"
-        self._log = (
+        self._log = log if log is not None else (
                 select(
                     log for log in self.operational_log
                 ).order_by(
@@ -31,24 +30,41 @@ class Report:
                                       self.mode, 
                                       dt)
 
+    def _cached_table(self, name: str, key: tuple, table) -> str:
+        """The 'table()' rendered again only when 'key' changes (the
+        handlers are the same all along an operation, the position changes
+        only on trades).
+        """
+
+        if not hasattr(self, "_tables_cache"):
+            self._tables_cache = dict()
+        cached = self._tables_cache.get(name)
+        if cached is None or cached[0] != key:
+            cached = (key, table())
+            self._tables_cache[name] = cached
+        return cached[1]
+
     def _handlers_table(self):
         _handlers = dict(Trader=self.trader,
                         Classifier=self.classifier.name,
                         StopLoss=self.stop_loss.name)
 
-        return table_from_dict(_handlers)
+        return self._cached_table("handlers", tuple(_handlers.values()),
+                                  lambda: table_from_dict(_handlers))
 
     def _gains(self):
         _amount_initial = self.initial_base_amount
 
         _cumulated_gain_percent = ((self._amount_now - _amount_initial)/_amount_initial)*100
         
-        _delta = self._log.price - self.position.traded_price
+        _traded_price = self.position.traded_price
+        _delta = self._log.price - _traded_price if _traded_price else 0.0
         _position_gain = (
             _delta if self.position.side == "Long"
             else - _delta if self.position.side == "Sell"
             else 0.0)
-        _position_gain_percent = (_position_gain/self.position.traded_price)*100
+        _position_gain_percent = (
+            (_position_gain/_traded_price)*100 if _traded_price else 0.0)
 
         return "Cumulated ({}%) <> Due to position ({}%)".format(
             round(_cumulated_gain_percent,2), round(_position_gain_percent,2))
@@ -60,13 +76,19 @@ class Report:
                           self._log.price)
 
     def _position_table(self):
-        _position  = dict(Side=self.position.side,
-                          TradedPrice=self.position.traded_price,
-                          TradedAt=ParseDateTime(
-                              self.position.traded_at
-                          ).from_timestamp_to_human_readable()
-                         )
-        return table_from_dict(_position)
+        def _table():
+            _position  = dict(Side=self.position.side,
+                              TradedPrice=self.position.traded_price,
+                              TradedAt=ParseDateTime(
+                                  self.position.traded_at
+                              ).from_timestamp_to_human_readable()
+                              if self.position.traded_at else None
+                             )
+            return table_from_dict(_position)
+
+        _key = (self.position.side, self.position.traded_price,
+                self.position.traded_at)
+        return self._cached_table("position", _key, _table)
     
     def  _total_display(self):
         _msg = "{} equivalent total:\t{}"        
@@ -84,13 +106,18 @@ class Report:
             self._header(), self._gains(), self._total_display(), self._handlers_table(), 
             self._summary(), self.sub_h, self.pos_h, self._position_table())
     
-    def msg(self):
-        self._init()
+    def msg(self, log=None):
+        """Report of the given operational log record (as the one kept on
+        'DefaultLog.last_record'), or of the newest one on the database.
+        """
+
+        self._init(log)
         self._msg = self._base_msg()
-        _data = json.loads(self._log.last_analyzed_data)
-        _result = json.loads(self._log.analysis_result)
-        _order = json.loads(self._log.order)
-        _warnings = json.loads(self._log.events)
+        _details = self._log.details()
+        _data = _details["last_analyzed_data"]
+        _result = _details["analysis_result"]
+        _order = _details["order"]
+        _warnings = _details["events"]
         
         if _data:
             self._add_display(_data, title=self.dta_h)
@@ -106,6 +133,6 @@ class Report:
             
         return self._msg
     
-    def print_report(self):
-        print(self.msg())
+    def print_report(self, log=None):
+        print(self.msg(log))
         return
\ No newline at end of file
@@ -1,13 +1,24 @@
+import atexit
 import json
+import threading
+import time
+import weakref
+import zlib
+from collections import namedtuple
+from contextlib import contextmanager
 import pendulum
 from pony.orm import (
     Database,
+    DatabaseError,
     Json,
+    OperationalError,
     Optional,
     Required,
     Set,
     StrArray,
     commit,
+    composite_index,
+    db_session,
     rollback,
     sql_debug,
     TransactionError,
@@ -15,8 +26,10 @@ from pony.orm import (
 from ..settings import (
     Default,
     Environments,
+    PossibleModes as MODE,
     PossibleSides as SIDE,
 )
+from ..share.tools import RetryPolicy
 from .mixins import Report
 
 db, env = Database(), Environments.ENV
@@ -25,25 +38,131 @@ db.bind(**env.ORM_bind_to)
 sql_debug(env.SqlDebug)
 
 
-def _safety_commit(retry=15):
-    attempts = 0
-    while attempts < retry:
-        attempts += 1
-        try:
-            commit()
-            break
-        except:  #!TODO: To logging
-            continue
-    if attempts >= retry:
+_commit_retry_policy = RetryPolicy(
+    max_retries=15, backoff_factor=0.01, max_backoff=2.0)
+
+
+class CommitError(Exception):
+    """A unit of work could not be committed (e.g. the database was locked
+    by another writer); its transaction was rolled back.
+    """
+
+
+class MigrationError(Exception):
+    """A table of an older schema could not be brought up to date.
+    """
+
+
+def _is_locked(error: Exception) -> bool:
+    return isinstance(error, OperationalError) and (
+        "locked" in str(error) or "busy" in str(error))
+
+
+class _UnitOfWork(threading.local):
+    depth = 0
+
+    def __init__(self):
+        self.after_commit = []
+
+
+_unit_of_work = _UnitOfWork()
+
+
+def after_commit(callback):
+    """Calls 'callback' once the current unit of work is committed (at once,
+    out of a unit); it is dropped if the unit is rolled back.
+    """
+
+    if _unit_of_work.depth:
+        _unit_of_work.after_commit.append(callback)
+    else:
+        callback()
+
+
+def _commit():
+    try:
+        commit()
+    except Exception as e:
         rollback()
-    return
+        raise CommitError(e) from e
+
+
+def _safety_commit():
+    """Commits the changes made out of a unit of work (inside one, they are
+    committed at its end). A failed commit is rolled back and raised: the
+    entities read on that transaction can't be changed anymore, so it can
+    not simply be tried again (see 'run_unit_of_work').
+    """
+
+    if _unit_of_work.depth:  # Committed once, at the end of the unit
+        return
+    _commit()
+
+
+@contextmanager
+def unit_of_work():
+    """The entities changes made inside the context (e.g. a trader cycle)
+    are committed at once, on its exit, instead of on each update; if it
+    raises, they are all rolled back. Nested units join the outermost one.
+    A failed commit, or a locked database, raises 'CommitError'.
+    """
+
+    outermost = not _unit_of_work.depth
+    _unit_of_work.depth += 1
+    try:
+        yield
+    except BaseException as e:
+        _unit_of_work.depth -= 1
+        if outermost:
+            _unit_of_work.after_commit = []
+            rollback()
+            if _is_locked(e):  # On a write, before the commit
+                raise CommitError(e) from e
+        raise
+
+    _unit_of_work.depth -= 1
+    if outermost:
+        callbacks, _unit_of_work.after_commit = _unit_of_work.after_commit, []
+        _commit()
+        for callback in callbacks:
+            callback()
+
+
+def run_unit_of_work(body, *args, on_retry=None,
+                     retry_policy: RetryPolicy = _commit_retry_policy,
+                     **kwargs):
+    """Runs 'body(*args, **kwargs)' as a unit of work, returning its result.
+    If it can't be committed (e.g. the database is locked), the whole unit
+    runs again, on a fresh transaction, as 'retry_policy' allows. The
+    entities read before a failed commit can't be changed anymore:
+    'on_retry' is called before each new run, to get them again (and to
+    bring back any state 'body' changed out of the database). Inside another
+    unit, 'body' just joins it.
+    """
+
+    if _unit_of_work.depth:
+        return body(*args, **kwargs)
+
+    attempt = 0
+    while True:
+        try:
+            with unit_of_work():
+                return body(*args, **kwargs)
+        except CommitError as e:
+            if not retry_policy.should_retry(attempt):
+                raise
+            print("Fail to commit, trying again, due: ", e)  #!TODO: To logging
+            time.sleep(retry_policy.delay(attempt))
+            attempt += 1
+            if on_retry:
+                on_retry()
 
 
 class AttributeUpdater(object):
     def update(self, **kwargs):
         for item in kwargs.items():
             setattr(self, item[0], item[1])
-            _safety_commit()
+        _safety_commit()
         return
 
 
@@ -66,6 +185,7 @@ class Position(db.Entity, AttributeUpdater):
     traded_at = Optional(int)  # UTC timestamp
     due_to_signal = Optional(str)
     exit_reference_price = Optional(float)
+    extreme_price = Optional(float)  # Since traded, followed by the stop
 
 
 class Assets(db.Entity, AttributeUpdater):
@@ -125,8 +245,9 @@ class OperationMixIn:
         return
 
     def reset(self):
-        self.last_check.update(by_classifier_at=0)
-        self.position.update(side=SIDE.Zeroed)
+        self.last_check.update(by_classifier_at=0, by_stop_loss_at=0)
+        self.position.update(side=SIDE.Zeroed, exit_reference_price=None,
+                             extreme_price=None)
         self._reset_assets()
         self.clear_logs()
         return
@@ -157,6 +278,42 @@ class Operation(db.Entity, AttributeUpdater, OperationMixIn, Report):
     trades_log = Set(lambda: TradeLog, cascade_delete=True)
 
 
+_payload_fields = ["last_analyzed_data", "analysis_result", "order", "events"]
+
+# Typed columns holding analysis result (and order) values, left out of the
+# payload: column -> key
+_typed_result_keys = dict(
+    side="side", sma_smaller="SMA_smaller", sma_larger="SMA_larger")
+_typed_order_keys = dict(signal="signal")
+
+# Preset dictionary of the recurrent payload content, as the payloads are
+# too small to be compressed on their own.
+_payload_zdict = (
+    b'{"last_analyzed_data":{"Open_time":,"Open":,"High":,"Low":,"Close":'
+    b',"Volume":},"analysis_result":{"due_to_stop":false},"order":{'
+    b'"timestamp":,"from_side":"Zeroed","to_side":"Long","price":,'
+    b'"due_to_stop":false,"amount":},"events":{}}')
+
+
+def compress_payload(details: dict) -> bytes:
+    compressor = zlib.compressobj(level=9, zdict=_payload_zdict)
+    return (compressor.compress(json.dumps(
+        details, separators=(",", ":")).encode("utf-8"))
+        + compressor.flush())
+
+
+def decompress_payload(payload: bytes) -> dict:
+    if not payload:
+        return {field: dict() for field in _payload_fields}
+    decompressor = zlib.decompressobj(zdict=_payload_zdict)
+    return json.loads(decompressor.decompress(payload).decode("utf-8"))
+
+
+def _without(details: dict, keys: dict) -> dict:
+    return {key: value for key, value in details.items()
+            if key not in keys.values()}
+
+
 class OperationalLog(db.Entity):
     # Present in all logs:
     operation = Optional(Operation)  # Foreing key
@@ -165,12 +322,27 @@ class OperationalLog(db.Entity):
     equivalent_base_amount = Optional(
         float
     )  # TODO: The OperationMixIn will do this (maybe.)
-    # Optional for each log:
+    # Optional for each log, typed (queryable without the payload):
     analyzed_by = Optional(str)
-    last_analyzed_data = Optional(Json)
-    analysis_result = Optional(Json)
-    order = Optional(Json)
-    events = Optional(Json)
+    side = Optional(str)
+    sma_smaller = Optional(float)
+    sma_larger = Optional(float)
+    signal = Optional(str)
+    # Compressed json of the data, result, order and events of the cycle
+    payload = Optional(bytes)
+    composite_index(operation, timestamp)  # Newest logs of an operation
+
+    def details(self) -> dict:
+        details = decompress_payload(self.payload)
+        if self.side:  # Typed values of the analysis result
+            details["analysis_result"].update(
+                {key: getattr(self, column)
+                 for column, key in _typed_result_keys.items()})
+        if self.signal:
+            details["order"].update(
+                {key: getattr(self, column)
+                 for column, key in _typed_order_keys.items()})
+        return details
 
 
 class TradeLog(db.Entity, AttributeUpdater):
@@ -182,6 +354,146 @@ class TradeLog(db.Entity, AttributeUpdater):
     fee = Optional(float)  # base units
 
 
+class OperationalLogRecord(namedtuple("OperationalLogRecord", [
+        "timestamp",
+        "price",
+        "equivalent_base_amount",
+        "analyzed_by",
+        "side",
+        "sma_smaller",
+        "sma_larger",
+        "signal",
+        "last_analyzed_data",
+        "analysis_result",
+        "order",
+        "events"])):
+    """A cycle of the operational log, as kept in memory, before going to
+    the database.
+    """
+
+    __slots__ = ()
+
+    def details(self) -> dict:
+        return {field: getattr(self, field) for field in _payload_fields}
+
+    def as_log_attributes(self) -> dict:
+        attributes = {field: value for field, value in self._asdict().items()
+                      if field not in _payload_fields}
+        details = self.details()
+        details.update(
+            analysis_result=_without(details["analysis_result"],
+                                     _typed_result_keys),
+            order=_without(details["order"], _typed_order_keys))
+        attributes.update(payload=compress_payload(details))
+        return attributes
+
+
+_open_sinks = weakref.WeakSet()
+
+
+@atexit.register
+def _close_open_sinks():
+    for sink in list(_open_sinks):
+        try:
+            sink.close()
+        except Exception as e:  # TODO: To logger instead print
+            print("Fail to flush the operational log, due: ", e)
+
+
+class BufferedLogSink:
+    """Write-behind queue of operational log records, appended to the
+    database in order, by batches: when 'max_records' are queued, on
+    'flush', on 'close' (also at the interpreter exit, for the sinks still
+    open) and, with 'background', every 'max_delay' seconds by a thread of
+    its own. Up to 'max_records' (or 'max_delay' seconds of) records can be
+    lost on a crash.
+    """
+
+    def __init__(self, operation,
+                 max_records: int = 1000,
+                 max_delay: float = 5.0,
+                 background: bool = False):
+
+        self._operation_id = operation.id
+        self.max_records = max_records
+        self.max_delay = max_delay
+        self._queue = []
+        self._queue_lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # Keeps the batches in order
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread = None
+
+        if background:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        _open_sinks.add(self)
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def append(self, record: OperationalLogRecord):
+        """Inside a unit of work, the record is queued once it commits.
+        """
+
+        after_commit(lambda: self._enqueue(record))
+
+    def _enqueue(self, record: OperationalLogRecord):
+        with self._queue_lock:
+            self._queue.append(record)
+            full = len(self._queue) >= self.max_records
+
+        if full:
+            self.flush()
+
+    def _create(self, records: list):
+        operation = Operation[self._operation_id]
+        for record in records:
+            operation.operational_log.create(**record.as_log_attributes())
+
+    def _write(self, records: list):
+        # Nested on the caller's db session, if any
+        with db_session:
+            run_unit_of_work(self._create, records)
+
+    def flush(self):
+        """Inside a unit of work, the queue is written once it commits.
+        """
+
+        if _unit_of_work.depth:
+            after_commit(self.flush)
+            return
+
+        with self._flush_lock:
+            with self._queue_lock:
+                records, self._queue = self._queue, []
+            if records:
+                try:
+                    self._write(records)
+                except Exception:  # Kept, to be written on the next flush
+                    with self._queue_lock:
+                        self._queue = records + self._queue
+                    raise
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.max_delay)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:  # TODO: To logger instead print
+                print("Fail to flush the operational log, due: ", e)
+
+    def close(self):
+        _open_sinks.discard(self)
+        self._closed = True
+        if self._thread:
+            self._wakeup.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+
 class DefaultLog:
     """TODO: Refactoring suggestion: Make the log 100% json ('noSQl'), thus
     having total freedom over what to append, for each mode, on each cycle.
@@ -189,11 +501,18 @@ class DefaultLog:
     they gona need to be computed and reported.
     """
 
-    def __init__(self, operation):
+    _cycle_fields = ["analyzed_by", "last_analyzed_data", "analysis_result",
+                     "order", "events_on_a_cycle"]
+
+    def __init__(self, operation, sink: BufferedLogSink = None):
         self.operation = operation
         self.append_log_to_database = getattr(
             self, "_{}_log_append".format((operation.mode).lower())
         )
+        # Back testing flushes synchronously (on size and at the end)
+        self.sink = sink if sink else BufferedLogSink(
+            operation, background=bool(operation.mode != MODE.BackTesting))
+        self.last_record: OperationalLogRecord = None
         self._reset()
         self._price: float = None
         self._equivalent_base_amount: float = None
@@ -208,6 +527,17 @@ class DefaultLog:
             if price_to_set > 0.0:
                 self._price = price_to_set
 
+    def state(self) -> tuple:
+        """Snapshot of the fields written on a cycle, to 'restore' them
+        (they are replaced, not changed in place).
+        """
+
+        return tuple(getattr(self, name) for name in self._cycle_fields)
+
+    def restore(self, state: tuple):
+        for name, value in zip(self._cycle_fields, state):
+            setattr(self, name, value)
+
     def _reset(self):
         self._timestamp = 0
         self.analyzed_by = ""
@@ -216,20 +546,16 @@ class DefaultLog:
         self.order = dict()
         self.events_on_a_cycle = dict()
 
-    def _log_dicts_to_json(self):
-        self.last_analyzed_data = json.dumps(self.last_analyzed_data)
-        self.analysis_result = json.dumps(self.analysis_result)
-        self.events_on_a_cycle = json.dumps(self.events_on_a_cycle)
-        self.order = json.dumps(self.order)
-
     def _create_operational_log(self, **kwargs):
-        self.operation.operational_log.create(
-            **kwargs, timestamp=self._timestamp
-        )
-        _safety_commit()
+        self.last_record = OperationalLogRecord(
+            **kwargs, timestamp=self._timestamp)
+        self.sink.append(self.last_record)
         self._reset()
         return
 
+    def flush(self):
+        self.sink.flush()
+
     # TODO: Refactoring suggestion: in 'settings', declare the modes
     # as subclasses of 'PossibleModes' and better describe these
     # modes, with attributes like 'info_should_be_logged: list'.
@@ -242,6 +568,12 @@ class DefaultLog:
             price=self._price,
             equivalent_base_amount=self._equivalent_base_amount,
             analyzed_by=self.analyzed_by,
+            side=self.analysis_result.get(_typed_result_keys["side"]) or "",
+            sma_smaller=self.analysis_result.get(
+                _typed_result_keys["sma_smaller"]),
+            sma_larger=self.analysis_result.get(
+                _typed_result_keys["sma_larger"]),
+            signal=self.order.get(_typed_order_keys["signal"]) or "",
             last_analyzed_data=self.last_analyzed_data,
             analysis_result=self.analysis_result,
             order=self.order,
@@ -272,8 +604,121 @@ class DefaultLog:
         self._timestamp = (
             pendulum.now().int_timestamp if not timestamp else timestamp
         )
-        self._log_dicts_to_json()
         self.append_log_to_database()
 
 
+# Schema changes, for databases created by older versions (pony only
+# creates the missing tables). Column types by dialect.
+_column_types = dict(
+    SQLite=dict(str="TEXT NOT NULL DEFAULT ''", float="REAL", bytes="BLOB"),
+    PostgreSQL=dict(str="TEXT NOT NULL DEFAULT ''", float="DOUBLE PRECISION",
+                    bytes="BYTEA"),
+)
+
+
+def _columns_of(database: Database, table: str) -> set:
+    """Columns of 'table' (none, if there is no such table).
+    """
+
+    try:
+        with db_session:
+            cursor = database.execute(
+                'SELECT * FROM "{}" WHERE 0 = 1'.format(table))
+            return {column[0] for column in cursor.description}
+    except DatabaseError:
+        return set()
+
+
+def _add_columns(database: Database, table: str, columns: dict):
+    types = _column_types[database.provider.dialect]
+    for column, of_type in columns.items():
+        database.execute('ALTER TABLE "{}" ADD COLUMN "{}" {}'.format(
+            table, column, types[of_type]))
+
+
+def _drop_columns(database: Database, table: str, columns: list):
+    # SQLite does it from 3.35 on
+    for column in columns:
+        database.execute('ALTER TABLE "{}" DROP COLUMN "{}"'.format(
+            table, column))
+
+
+def _json_column(value) -> dict:
+    if isinstance(value, str):
+        value = json.loads(value)
+    return value if value else dict()
+
+
+def _operational_log_payload(database: Database):
+    """The json columns of the operational log (up to 0.1.0-alpha.0) go to
+    the typed columns and the compressed payload, and are dropped.
+    """
+
+    _add_columns(database, "OperationalLog", dict(
+        side="str", sma_smaller="float", sma_larger="float", signal="str",
+        payload="bytes"))
+    rows = database.execute(
+        'SELECT "id", "analyzed_by", {} FROM "OperationalLog"'.format(
+            ", ".join('"{}"'.format(field) for field in _payload_fields)))
+    for row in rows.fetchall():
+        details = dict(zip(_payload_fields, map(_json_column, row[2:])))
+        attributes = OperationalLogRecord(
+            timestamp=None, price=None, equivalent_base_amount=None,
+            analyzed_by=row[1],
+            side=details["analysis_result"].get(
+                _typed_result_keys["side"]) or "",
+            sma_smaller=details["analysis_result"].get(
+                _typed_result_keys["sma_smaller"]),
+            sma_larger=details["analysis_result"].get(
+                _typed_result_keys["sma_larger"]),
+            signal=details["order"].get(_typed_order_keys["signal"]) or "",
+            **details).as_log_attributes()
+        log_id = row[0]
+        side, signal = attributes["side"], attributes["signal"]
+        sma_smaller, sma_larger = (
+            attributes["sma_smaller"], attributes["sma_larger"])
+        payload = attributes["payload"]
+        database.execute(
+            'UPDATE "OperationalLog" SET "side" = $side, '
+            '"sma_smaller" = $sma_smaller, "sma_larger" = $sma_larger, '
+            '"signal" = $signal, "payload" = $payload WHERE "id" = $log_id')
+    _drop_columns(database, "OperationalLog", _payload_fields)
+
+
+def _position_extreme_price(database: Database):
+    """Up to 0.1.0-alpha.0, the stop did not follow the extreme price since
+    the entry; it starts over from the reference one.
+    """
+
+    _add_columns(database, "Position", dict(extreme_price="float"))
+
+
+# (table, column the step adds, step), in order
+_migrations = [
+    ("OperationalLog", "payload", _operational_log_payload),
+    ("Position", "extreme_price", _position_extreme_price),
+]
+
+
+def migrate(database: Database):
+    """Brings the tables of an older schema up to date, each step on its
+    own transaction. It must run before the mapping is generated.
+    """
+
+    for table, column, step in _migrations:
+        columns = _columns_of(database, table)
+        if not columns or column in columns:
+            continue
+        print("Migrating the table {} ({})".format(table, step.__name__))
+        try:
+            with db_session:
+                step(database)
+        except DatabaseError as e:
+            raise MigrationError(
+                "The table {} has an older schema and could not be migrated "
+                "({}); upgrade SQLite to 3.35 or newer, or recreate the "
+                "database".format(table, e)) from e
+
+
+migrate(db)
 db.generate_mapping(create_tables=True)
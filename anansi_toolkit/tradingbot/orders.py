@@ -9,6 +9,50 @@ from ..settings import (
 from ..share.tools import EventContainer, Serialize, table_from_dict
 from .trade_brokers import trade_broker
 
+def order_amount(signal: str, base: float, quote: float, price: float,
+                 minimal_amount: float) -> float:
+    """Amount (quote units) to be traded on a signal, given the avaliable
+    assets, floored to a multiple of the minimal amount allowed.
+    """
+
+    raw_amount = 0.0
+
+    if signal in [SIG.Buy, SIG.StopFromShort]:  # , SIG.DoubleBuy]:
+        raw_amount = base / price
+
+    elif signal in [SIG.Sell, SIG.StopFromLong]:  # , SIG.DoubleSell]:
+        raw_amount = quote
+
+    factor = int(raw_amount / minimal_amount)
+    return factor * minimal_amount
+
+
+def backtesting_fill(signal: str, amount: float, price: float, base: float,
+                     quote: float, fee_rate_decimal: float):
+    """Simulated fill of an order. Returns the new quote and base amounts
+    and the fee (base units), or None if the signal is not tradeable.
+    """
+
+    fee_quote = fee_rate_decimal * amount
+    fee_base = fee_quote * price
+
+    if signal in [SIG.Buy, SIG.StopFromShort]:  # , SIG.DoubleBuy]:
+        spent_base_amount = amount * price
+        bought_quote_amount = amount - fee_quote
+        return (quote + bought_quote_amount,
+                base - spent_base_amount,
+                fee_base)
+
+    if signal in [SIG.Sell, SIG.StopFromLong]:  # , SIG.DoubleSell]:
+        spent_quote_amount = amount
+        bought_base_amount = amount * price - fee_base
+        return (quote - spent_quote_amount,
+                base + bought_base_amount,
+                fee_base)
+
+    return None
+
+
 class Order:
     def __init__(
         self,
@@ -33,6 +77,12 @@ class SignalGenerator:
         self.signal = SIG.Hold
         self.side = SIDE.Zeroed
 
+    def state(self) -> tuple:
+        return (self.signal, self.side)
+
+    def restore(self, state: tuple):
+        self.signal, self.side = state
+
     def process(self, from_side: str, to_side: str, due_to_stop=False):
         self.side = to_side
         if from_side == to_side:
@@ -102,18 +152,10 @@ class Handler:
         self._quote = self.operation.position.assets.quote
 
     def _calculate_amount(self):
-        signal = self.SigGen.signal
-        raw_amount = 0.0
         self._get_avaliable()
-
-        if signal in [SIG.Buy, SIG.StopFromShort]:  # , SIG.DoubleBuy]:
-            raw_amount = self._base / self.order.price
-
-        elif signal in [SIG.Sell, SIG.StopFromLong]:  # , SIG.DoubleSell]:
-            raw_amount = self._quote
-
-        factor = int(raw_amount / self.broker.mininal_amount)
-        self.order.amount = factor * self.broker.mininal_amount
+        self.order.amount = order_amount(
+            self.SigGen.signal, self._base, self._quote, self.order.price,
+            self.broker.mininal_amount)
 
     def _proceed_updates(self):
         self.operation.position.assets.update(
@@ -124,6 +166,8 @@ class Handler:
             traded_price=self.order.price,
             traded_at=self.order.timestamp,
             due_to_signal=self.order.signal,
+            exit_reference_price=None,  # The stop follows the new position
+            extreme_price=None,
         )
         self._trade_details = dict(
             timestamp=self.order.timestamp,
@@ -141,24 +185,12 @@ class Handler:
         return
 
     def _backtesting_executor(self):
-        signal = self.order.signal
-        self.fee_quote = self.broker.fee_rate_decimal * self.order.amount
-        self.fee_base = self.fee_quote * self.order.price
-
-        if signal in [SIG.Buy, SIG.StopFromShort]:  # , SIG.DoubleBuy]:
-            spent_base_amount = self.order.amount * self.order.price
-            bought_quote_amount = self.order.amount - self.fee_quote
-            self._new_quote_amount = self._quote + bought_quote_amount
-            self._new_base_amount = self._base - spent_base_amount
-            self._proceed_updates()
+        fill = backtesting_fill(
+            self.order.signal, self.order.amount, self.order.price,
+            self._base, self._quote, self.broker.fee_rate_decimal)
 
-        elif signal in [SIG.Sell, SIG.StopFromLong]:  # , SIG.DoubleSell]:
-            spent_quote_amount = self.order.amount
-            bought_base_amount = (
-                self.order.amount * self.order.price - self.fee_base
-            )
-            self._new_quote_amount = self._quote - spent_quote_amount
-            self._new_base_amount = self._base + bought_base_amount
+        if fill:
+            self._new_quote_amount, self._new_base_amount, self.fee_base = fill
             self._proceed_updates()
 
         return
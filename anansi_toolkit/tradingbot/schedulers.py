@@ -0,0 +1,289 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import pendulum
+from pony.orm import db_session
+from ..marketdata import handlers
+from ..settings import PossibleModes as MODE, PossibleStatuses as STAT
+from ..share.tools import open_time_offset, seconds_in
+from .models import BufferedLogSink, run_unit_of_work
+from .traders import SimpleKlinesTrader
+
+
+class SharedFetch:
+    """A blocking getter shared by the operations watching the same market.
+    'fetch' runs the call on the executor; operations awaiting the same
+    call (same arguments) share it, instead of calling the broker again.
+    The result of the last call is kept, to be served by 'get' (the
+    getter interface of the trader); other calls ('get' misses) run on the
+    executor too. The getter is called by one thread at a time, as it may
+    keep state between calls (e.g. 'KlinesFromBroker').
+    """
+
+    __slots__ = ["getter", "_executor", "_key", "_future", "_lock"]
+
+    def __init__(self, getter, executor: ThreadPoolExecutor):
+        self.getter = getter
+        self._executor = executor
+        self._key = None
+        self._future = None
+        self._lock = threading.Lock()
+
+    def _call(self, **kwargs):
+        with self._lock:
+            return self.getter.get(**kwargs)
+
+    def _call_on_executor(self, **kwargs):
+        return self._executor.submit(partial(self._call, **kwargs)).result()
+
+    async def fetch(self, **kwargs):
+        key = tuple(sorted(kwargs.items()))
+        if key != self._key:
+            self._key = key
+            self._future = asyncio.get_running_loop().run_in_executor(
+                self._executor, partial(self._call, **kwargs))
+        try:
+            await asyncio.shield(self._future)
+        except Exception:  # Raised again to the trader, by 'get'
+            pass
+
+    def _fetched(self, **kwargs):
+        if (self._future is None or not self._future.done()
+                or self._key != tuple(sorted(kwargs.items()))):
+            return None
+        return self._future
+
+    def get(self, **kwargs):
+        fetched = self._fetched(**kwargs)
+        if fetched is None:  # Not prefetched
+            return self._call_on_executor(**kwargs)
+        return fetched.result()
+
+
+class SharedKlines(SharedFetch):
+    """Klines of a market and time frame shared by the operations watching
+    it: fetched once by cycle, with the largest number of candles asked,
+    and sliced for each operation (by number of candles, or since a given
+    open time, when the fetched ones cover it).
+    """
+
+    __slots__ = ["number_of_candles"]
+
+    def __init__(self, getter, executor: ThreadPoolExecutor):
+        super(SharedKlines, self).__init__(getter, executor)
+        self.number_of_candles = 0
+
+    async def fetch(self, until: int):
+        await super(SharedKlines, self).fetch(
+            number_of_candles=self.number_of_candles, until=until)
+
+    def get(self, **kwargs):
+        number_of_candles = kwargs.get("number_of_candles")
+        since = kwargs.get("since")
+        fetched = self._fetched(number_of_candles=self.number_of_candles,
+                                until=kwargs.get("until"))
+        if fetched is None or bool(number_of_candles) == bool(since):
+            return self._call_on_executor(**kwargs)
+        if number_of_candles:
+            return fetched.result()[-number_of_candles:]
+
+        klines = fetched.result()
+        if not len(klines) or klines.Open_time.iloc[0] > since:
+            return self._call_on_executor(**kwargs)  # Not covered
+        return klines[klines.Open_time.to_numpy() >= since]
+
+
+class OperationsScheduler:
+    """Runs many live operations from a single process, each one as an
+    asyncio task: the cycles of an operation (as on 'SimpleKlinesTrader')
+    start on its time frame boundaries, plus 'delay' seconds (for the
+    broker to close the candle). The broker I/O runs concurrently on a
+    pool of 'max_workers' threads, and the klines (and prices) are fetched
+    once per market and time frame, for all the operations watching it.
+    The operational logs of all operations are flushed by a single task,
+    each 'flush_every' seconds.
+
+    The database work (the cycles, their commits and the logs flushes) runs
+    off the event loop, on a single thread, each piece on a db_session of
+    its own. The scheduler must be created inside a db_session; 'run'
+    returns when no operation is running anymore (or after 'stop').
+    """
+
+    def __init__(self, operations: list,
+                 max_workers: int = 32,
+                 delay: int = 3,
+                 flush_every: float = 5.0):
+
+        for operation in operations:
+            if operation.mode == MODE.BackTesting:
+                raise ValueError(
+                    "{} does not run {} operations".format(
+                        self.__class__.__name__, MODE.BackTesting))
+
+        self.delay = delay
+        self.flush_every = flush_every
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._database_executor = ThreadPoolExecutor(max_workers=1)
+        self._klines = dict()
+        self._stop_klines = dict()
+        self._prices = dict()
+        self._stopping = None
+        self.traders = [self._trader_for(operation)
+                        for operation in operations]
+
+    def _shared_klines(self, shared: dict, market: tuple, time_frame: str,
+                       number_of_candles: int) -> SharedKlines:
+        if market + (time_frame,) not in shared:
+            shared[market + (time_frame,)] = SharedKlines(
+                handlers.KlinesFromBroker(*market, time_frame=time_frame,
+                                          human_readable_datetime=False),
+                self._executor)
+        klines = shared[market + (time_frame,)]
+        klines.number_of_candles = max(klines.number_of_candles,
+                                       number_of_candles)
+        return klines
+
+    def _trader_for(self, operation) -> SimpleKlinesTrader:
+        trader = SimpleKlinesTrader(
+            operation, log_sink=BufferedLogSink(operation, background=False))
+        market = (operation.market.exchange, trader.ticker_symbol)
+
+        if market not in self._prices:
+            self._prices[market] = SharedFetch(
+                handlers.PriceGetter(*market), self._executor)
+
+        trader.KlinesGetter = self._shared_klines(
+            self._klines, market, trader.Classifier.parameters.time_frame,
+            trader.Classifier.number_of_candles)
+        # Apart from the classifier ones (even on the same time frame), as
+        # they are fetched until the last closed candle
+        trader.StopKlinesGetter = self._shared_klines(
+            self._stop_klines, market, trader.StopLoss.parameters.time_frame,
+            trader.StopLoss.n_samples_to_analyze)
+        trader.PriceGetter = self._prices[market]
+        return trader
+
+    def _next_cycle_at(self, trader: SimpleKlinesTrader, now: int) -> int:
+        time_frame = (
+            trader.StopLoss.parameters.time_frame
+            if trader._step == trader.StopLoss.step  # Following a stop
+            else trader.Classifier.parameters.time_frame)
+        step = seconds_in(time_frame)
+        offset = open_time_offset(time_frame)
+        return ((now - self.delay - offset) // step + 1) * step + offset + (
+            self.delay)
+
+    async def _sleep_until(self, timestamp: int) -> bool:
+        """False if stopped while sleeping.
+        """
+
+        if self._stopping.is_set():  # Not seen by a timeout of 0
+            return False
+        timeout = max(0, timestamp - pendulum.now().int_timestamp)
+        try:
+            await asyncio.wait_for(self._stopping.wait(), timeout)
+            return False
+        except asyncio.TimeoutError:
+            return True
+
+    @staticmethod
+    def _on_database(trader: SimpleKlinesTrader, work):
+        with db_session:
+            trader._refresh()  # The entities of this db_session
+            return work()
+
+    async def _database(self, trader: SimpleKlinesTrader, work):
+        """Runs 'work()' on the database thread.
+        """
+
+        return await asyncio.get_running_loop().run_in_executor(
+            self._database_executor,
+            partial(self._on_database, trader, work))
+
+    @staticmethod
+    def _is_running(trader: SimpleKlinesTrader) -> bool:
+        return trader.operation.status == STAT.Running
+
+    def _started(self, trader: SimpleKlinesTrader) -> bool:
+        run_unit_of_work(trader._start, on_retry=trader._refresh)
+        return self._is_running(trader)
+
+    def _cycled(self, trader: SimpleKlinesTrader) -> bool:
+        trader._cycle()
+        return self._is_running(trader)
+
+    async def _operate(self, trader: SimpleKlinesTrader, now: int):
+        """Failures out of the trader cycles (e.g. on its start, or getting
+        its operation again) end only that operation.
+        """
+
+        try:
+            await self._cycles(trader, now)
+        except Exception as e:  # TODO: To logger instead print
+            print("Operation {} stopped, due: ".format(trader.operation.id), e)
+        finally:
+            try:
+                await self._database(trader, trader._end)
+            except Exception as e:  # TODO: To logger instead print
+                print("Fail to end the operation {}, due: ".format(
+                    trader.operation.id), e)
+
+    async def _cycles(self, trader: SimpleKlinesTrader, now: int):
+        running = await self._database(trader, partial(self._started, trader))
+
+        while running:
+            trader._now = now
+            fetches = [trader.KlinesGetter.fetch(until=now),
+                       trader.PriceGetter.fetch(at=now)]
+            if trader._step == trader.StopLoss.step:  # Following a stop
+                fetches.append(trader.StopKlinesGetter.fetch(
+                    until=now - trader.StopLoss.step))
+            await asyncio.gather(*fetches)
+            running = await self._database(
+                trader, partial(self._cycled, trader))
+
+            now = self._next_cycle_at(
+                trader, max(now, pendulum.now().int_timestamp))
+            if running and not await self._sleep_until(now):
+                break
+
+    async def _flush_logs(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(),
+                                       self.flush_every)
+            except asyncio.TimeoutError:
+                pass
+            for trader in self.traders:
+                try:
+                    await asyncio.get_running_loop().run_in_executor(
+                        self._database_executor, trader.log.flush)
+                except Exception as e:  # TODO: To logger instead print
+                    print("Fail to flush the operational log, due: ", e)
+
+    async def _main(self):
+        self._stopping = asyncio.Event()
+        flushing = asyncio.ensure_future(self._flush_logs())
+        now = pendulum.now().int_timestamp  # Same first cycle for all
+        try:
+            await asyncio.gather(*[self._operate(trader, now)
+                                   for trader in self.traders])
+        finally:
+            self._stopping.set()
+            await flushing
+
+    def stop(self):
+        """To be called from the scheduler loop (e.g. by a task or a signal
+        handler): the operations end after their current cycle.
+        """
+
+        if self._stopping:
+            self._stopping.set()
+
+    def run(self):
+        try:
+            asyncio.run(self._main())
+        finally:
+            self._executor.shutdown(wait=True)
+            self._database_executor.shutdown(wait=True)
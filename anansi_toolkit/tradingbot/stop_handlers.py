@@ -1,8 +1,68 @@
 import json
+import numpy as np
+from ..settings import PossibleSides as SIDE
 from ..share import tools
+from .classifiers import Result
 deserialize = tools.Deserialize()
 
 
+def rolling_count(hits: np.ndarray, n: int) -> np.ndarray:
+    """Number of hits on the last 'n' positions (or fewer, on the first
+    ones), for each position.
+    """
+
+    sums = np.cumsum(hits, dtype=np.int64)
+    counts = sums.copy()
+    counts[n:] -= sums[:-n]
+    return counts
+
+
+def first_confirmation(hits: np.ndarray, treshold, start: int = 0) -> int:
+    """First position, from 'start' on, where at least 'n_positives' of the
+    last 'n_measurements' are hits (None if there is no one).
+    """
+
+    confirmed = np.flatnonzero(
+        rolling_count(hits, treshold.n_measurements)[start:]
+        >= treshold.n_positives)
+    return int(confirmed[0]) + start if len(confirmed) else None
+
+
+class TrailingExtreme:
+    """Running extreme price (the max for Long, the min for Short) of a
+    position since its entry, updated in O(1) per price; so a long held
+    position costs no more to follow than a new one. Only 'extreme' needs
+    to be persisted.
+    """
+
+    __slots__ = ["sign", "extreme"]
+
+    def __init__(self, side: str, extreme: float = None):
+        self.sign = 1.0 if side == SIDE.Long else -1.0
+        self.extreme = extreme
+
+    def push(self, price: float) -> float:
+        if (self.extreme is None
+                or self.sign * price > self.sign * self.extreme):
+            self.extreme = price
+        return self.extreme
+
+    def push_many(self, prices: np.ndarray) -> np.ndarray:
+        """Pushes the 'prices' at once; returns the extreme since the entry
+        after each one of them.
+        """
+
+        prices = np.asarray(prices, dtype=float)
+        if not len(prices):
+            return prices
+
+        first = prices[0] if self.extreme is None else self.extreme
+        extremes = self.sign * np.maximum.accumulate(
+            self.sign * np.r_[first, prices])[1:]
+        self.extreme = float(extremes[-1])
+        return extremes
+
+
 class Treshold:
     def __init__(self, n_measurements: int, n_positives: int):
         self.n_measurements = n_measurements
@@ -39,6 +99,12 @@ class StopTrailing3T:
                 rate=0.7,
                 treshold=Treshold(n_measurements=10, n_positives=3))
 
+    _triggers = ["first_trigger", "second_trigger", "third_trigger"]
+    _block = 4096  # measurements scanned at once
+    # Changed by an analysis (replaced, besides the extreme price)
+    _state = ["side", "position_at", "reference_price", "extremes",
+              "last_open_time", "_last_prices"]
+
     def __init__(self, parameters, log, data_to_analyze=None):
         self.parameters = deserialize.from_json(parameters)
         self.log = log
@@ -49,6 +115,168 @@ class StopTrailing3T:
             self.parameters.third_trigger.treshold.n_measurements,
             self.parameters.update_target_if.treshold.n_measurements,
         )
+        self.step = tools.seconds_in(self.parameters.time_frame)
+        self.side = SIDE.Zeroed
+        self.position_at: int = None  # Traded at, of the followed position
+        self.reference_price: float = None
+        self.extremes = TrailingExtreme(self.side)
+        self.last_open_time: int = None  # Of the last measured candle
+        self._last_prices = np.empty(0)
+
+    @property
+    def extreme_price(self) -> float:
+        """Extreme price since the entry of the followed position.
+        """
+
+        return self.extremes.extreme
+
+    def start(self, side: str, reference_price: float, at: int,
+              extreme_price: float = None):
+        """Follows the position of 'side' traded 'at' (timestamp), measuring
+        the candles closed after it against the 'reference_price'.
+        """
+
+        self.side = side
+        self.position_at = at
+        self.reference_price = reference_price
+        self.extremes = TrailingExtreme(
+            side, extreme=(extreme_price if extreme_price is not None
+                           else reference_price))
+        self.last_open_time = (at // self.step) * self.step - self.step
+        self._last_prices = np.empty(0)
+
+    def state(self) -> tuple:
+        """Snapshot of the followed position measurements, to 'restore'
+        them.
+        """
+
+        return (tuple(getattr(self, name) for name in self._state),
+                self.extremes.extreme)
+
+    def restore(self, state: tuple):
+        values, extreme = state
+        for name, value in zip(self._state, values):
+            setattr(self, name, value)
+        self.extremes.extreme = extreme
+
+    def resume(self, data, measured_until: int):
+        """After 'start', for a position already measured until the candle
+        opened at 'measured_until': the windows are rebuilt from its last
+        candles ('data'), which are not measured again.
+        """
+
+        if not data.empty:
+            data = data[data.Open_time.to_numpy() <= measured_until]
+        if len(data):
+            prices = data.PriceFromKline.using(
+                self.parameters.price_source)._series.to_numpy()[
+                    -self.n_samples_to_analyze:]
+            self.extremes.push_many(prices)
+            self._last_prices = prices[-(self.n_samples_to_analyze - 1):] if (
+                self.n_samples_to_analyze > 1) else np.empty(0)
+        self.last_open_time = max(self.last_open_time, measured_until)
+
+    def _sign(self) -> float:
+        return 1.0 if self.side == SIDE.Long else -1.0
+
+    def _scan(self, prices: np.ndarray, start: int):
+        """Measures the 'prices' from the position 'start' on (the previous
+        ones are the last measured, kept for the windows), as percent moves
+        from the reference price. Each time 'update_target_if' confirms a
+        move beyond the reference, it goes to the running extreme price
+        (and the windows are measured again against it). Returns the
+        position where a trigger confirms a fall first, and its name (or
+        None, None). All the triggers are counted at once, by blocks.
+        """
+
+        sign = self._sign()
+        extremes = self.extremes.push_many(prices[start:])
+        update = self.parameters.update_target_if
+        i = start
+
+        while i < len(prices):
+            end = min(len(prices), i + self._block)
+            first = max(0, i - self.n_samples_to_analyze + 1)
+            moves = sign * (prices[first:end] / self.reference_price - 1) * 100
+
+            fired = [(position + first, name) for position, name in (
+                (first_confirmation(
+                    moves <= -getattr(self.parameters, name).rate,
+                    getattr(self.parameters, name).treshold, i - first), name)
+                for name in self._triggers) if position is not None]
+            updated = first_confirmation(
+                moves >= update.rate, update.treshold, i - first)
+            updated = None if updated is None else updated + first
+
+            stop = min(fired) if fired else (None, None)
+            if stop[0] is not None and (updated is None or stop[0] <= updated):
+                self.extremes.extreme = float(extremes[stop[0] - start])
+                return stop
+
+            if updated is not None:
+                self.reference_price = extremes[updated - start]
+                i = updated + 1
+            else:
+                i = end
+        return None, None
+
+    def _result(self, open_times: np.ndarray, prices: np.ndarray,
+                start: int) -> Result:
+        result = Result()
+        if self.side == SIDE.Zeroed:  # No position followed (or stopped)
+            return result
+
+        position, trigger = self._scan(prices, start)
+        result.side = self.side
+        result.reference_price = self.reference_price
+        result.extreme_price = self.extreme_price
+        if position is not None:
+            result.side = SIDE.Zeroed
+            result.due_to_stop = True
+            result.trigger = trigger
+            result.stopped_at = int(open_times[position]) + self.step
+            result.price = float(prices[position])
+        return result
+
+    def get_results_for_series(self, data, side: str, reference_price: float,
+                               at: int) -> Result:
+        """Vectorized stop analysis of the position of 'side' traded 'at',
+        over the whole path of its candles ('data', of the stop time frame,
+        after 'at'): the stop (if any) is on 'stopped_at' (the close of the
+        candle where a trigger confirmed it).
+        """
+
+        self.start(side, reference_price, at)
+        return self.get_result_for_this(data)
+
+    def get_result_for_this(self, data) -> Result:
+        """Incremental stop analysis of the followed position, given the
+        candles closed since the last analysis ('data'; the ones already
+        measured are skipped). Only the last measurements (as many as the
+        longest window) are kept between calls.
+        """
+
+        if not data.empty:
+            data = data[data.Open_time.to_numpy() > self.last_open_time]
+        open_times = data.Open_time.to_numpy(dtype=np.int64)
+        prices = np.r_[self._last_prices,
+                       data.PriceFromKline.using(
+                           self.parameters.price_source)._series.to_numpy()
+                       if len(data) else np.empty(0)]
+        start = len(self._last_prices)
+
+        result = self._result(
+            np.r_[np.zeros(start, dtype=np.int64), open_times], prices, start)
+        if len(open_times):
+            self.last_open_time = int(open_times[-1])
+        self._last_prices = prices[-(self.n_samples_to_analyze - 1):] if (
+            self.n_samples_to_analyze > 1) else np.empty(0)
+
+        if result.due_to_stop:
+            self.side = SIDE.Zeroed
+            self._append_to_log(result)
+        return result
 
-    def get_result(self):
-        pass
+    def _append_to_log(self, result):
+        self.log.analyzed_by = self.__class__.__name__
+        self.log.analysis_result = tools.Serialize(result).to_dict()
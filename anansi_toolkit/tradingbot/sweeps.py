@@ -0,0 +1,381 @@
+import itertools
+import json
+import multiprocessing
+import os
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from ..marketdata import handlers
+from ..settings import Default
+from ..share.tools import Serialize, SharedArrays
+from . import classifiers
+from .backtesters import Simulation, suggested_sides
+from .trade_brokers import trade_broker
+
+
+class _UnloggedAnalysis:
+    """Log of the classifiers on a sweep: analyses are not kept.
+    """
+
+    analyzed_by = ""
+    analysis_result = None
+    last_analyzed_data = None
+
+
+def parameters_grid(defaults: dict, grid: dict) -> list:
+    """All the combinations of the 'grid' values (lists, by parameter name),
+    the parameters out of the grid taking their 'defaults'.
+    """
+
+    unknown = set(grid) - set(defaults)
+    if unknown:
+        raise ValueError("Unknown parameters: {}".format(sorted(unknown)))
+
+    names = list(grid)
+    return [{**defaults, **dict(zip(names, values))}
+            for values in itertools.product(*[grid[name] for name in names])]
+
+
+def equity_curve(simulation: Simulation, steps: np.ndarray,
+                 prices: np.ndarray, initial_base_amount: float) -> np.ndarray:
+    """Equivalent base amount on each step (valued at the last price got),
+    after the trades made until it.
+    """
+
+    trade_times = np.array([trade["timestamp"] for trade in simulation.trades],
+                           dtype=np.int64)
+    bases = np.array([initial_base_amount]
+                     + [base for base, _ in simulation.holdings])
+    quotes = np.array([0.0] + [quote for _, quote in simulation.holdings])
+
+    done = np.searchsorted(trade_times, steps, side="right")
+    prices = np.nan_to_num(pd.Series(prices).ffill().to_numpy())
+    return bases[done] + quotes[done] * prices
+
+
+def max_drawdown(equity: np.ndarray) -> float:
+    """Largest fall (%) of the equity from a previous peak.
+    """
+
+    if not len(equity):
+        return 0.0
+    return float(np.max(1 - equity / np.maximum.accumulate(equity)) * 100)
+
+
+class _Worker:
+    """State of a sweep worker process: the shared klines and prices, and
+    the klines dataframes over them (the indicators computed on a
+    dataframe are memoized, so combinations sharing them compute them
+    once per worker; up to 'cached_indicators' series by time frame, the
+    least recently used dropped beyond it).
+    """
+
+    shared: SharedArrays = None
+    settings: dict = None
+    klines = dict()
+    cached_indicators = 32
+
+    @classmethod
+    def start(cls, descriptor: tuple, settings: dict):
+        cls.shared = SharedArrays.attach(descriptor)
+        cls.settings = settings
+        cls.klines = dict()
+
+    @classmethod
+    def klines_of(cls, time_frame: str) -> pd.DataFrame:
+        if time_frame not in cls.klines:  # Views of the shared arrays
+            values = cls.shared["{}/values".format(time_frame)]
+            cls.klines[time_frame] = pd.concat(
+                [pd.DataFrame(
+                    cls.shared["{}/open_times".format(time_frame)][:, None],
+                    columns=["Open_time"], copy=False),
+                 pd.DataFrame(values.T, columns=ParametersSweep._columns,
+                              copy=False)],
+                axis=1, copy=False)
+            cls.klines[time_frame].IndicatorsCache.max_size = (
+                cls.cached_indicators)
+        return cls.klines[time_frame]
+
+
+def _evaluate(combination: dict, since: int = None, until: int = None,
+              with_equity: bool = False) -> dict:
+    """Back testing of a combination over the steps from 'since' until
+    'until' (the candles before 'since' are analyzed, but not traded).
+    """
+
+    settings = _Worker.settings
+    time_frame = combination["time_frame"]
+    frame = settings["time_frames"][time_frame]
+
+    classifier = getattr(classifiers, settings["classifier"])(
+        parameters=json.dumps(combination), log=_UnloggedAnalysis())
+    base = frame["oldest_open_time"] + 3  # 'now' of the steps: base + k*step
+    first = base + classifier.step * max(
+        classifier.number_of_candles,
+        -((base - since) // classifier.step) if since else 0)
+    last = min(until, frame["newest_open_time"]) if until else (
+        frame["newest_open_time"])
+    steps = np.arange(first, max(first, last) + 1, classifier.step)
+
+    prices = _Worker.shared["{}/prices".format(time_frame)][
+        (steps - base) // classifier.step]
+
+    simulation = Simulation(
+        initial_base_amount=settings["initial_base_amount"],
+        fee_rate_decimal=settings["fee_rate_decimal"],
+        minimal_amount=settings["minimal_amount"],
+        allowed_special_signals=settings["allowed_special_signals"],
+    )
+    simulation.run(
+        steps, suggested_sides(classifier, steps,
+                               _Worker.klines_of(time_frame)),
+        price_at=lambda at: prices[(at - first) // classifier.step])
+
+    equity = equity_curve(simulation, steps, prices,
+                          settings["initial_base_amount"])
+    result = dict(final_equity=float(equity[-1]),
+                  trades=len(simulation.trades),
+                  max_drawdown=max_drawdown(equity))
+    if with_equity:
+        result.update(equity=pd.Series(equity, index=steps))
+    return result
+
+
+def _evaluate_task(task: tuple) -> dict:
+    return _evaluate(*task)
+
+
+class ParametersSweep:
+    """Back testing of a classifier for each combination of a parameters
+    grid, spread across a pool of processes ('processes', all the cores by
+    default). The klines of each time frame on the grid, and the prices on
+    its steps, are loaded once and put on shared memory, read by all the
+    workers; each combination is simulated as on 'VectorizedBackTester'
+    (same steps and trades), with no database. The back testing takes the
+    klines from 'since' until 'until' (timestamps), the whole history by
+    default.
+
+    Usage:
+        sweep = ParametersSweep.from_operation(my_op)
+        sweep.run(dict(smaller_sample=range(2, 20),
+                       larger_sample=range(20, 200, 10)))
+    """
+
+    _columns = ["Open", "High", "Low", "Close", "Volume"]
+
+    def __init__(self,
+                 broker_name: str = Default.exchange,
+                 ticker_symbol: str = Default.quote_symbol + Default.base_symbol,
+                 classifier: str = Default.classifier,
+                 initial_base_amount: float = Default.initial_base_amount,
+                 allowed_special_signals: list = Default.allowed_special_signals,
+                 processes: int = None,
+                 since: int = None,
+                 until: int = None):
+
+        self.since = since
+        self.until = until
+        self.broker_name = broker_name
+        self.ticker_symbol = ticker_symbol
+        self.classifier = classifier
+        self.initial_base_amount = initial_base_amount
+        self.allowed_special_signals = list(allowed_special_signals)
+        self.processes = processes if processes else os.cpu_count()
+
+    @classmethod
+    def from_operation(cls, operation, **kwargs):
+        return cls(broker_name=operation.market.exchange,
+                   ticker_symbol=operation.market.ticker_symbol,
+                   classifier=operation.classifier.name,
+                   initial_base_amount=operation.initial_base_amount,
+                   allowed_special_signals=operation.allowed_special_signals,
+                   **kwargs)
+
+    def default_parameters(self) -> dict:
+        return Serialize(
+            getattr(classifiers, self.classifier).DefaultParameters()
+        ).to_dict()
+
+    def combinations(self, grid: dict) -> list:
+        return parameters_grid(self.default_parameters(), grid)
+
+    def _last_step(self, combinations: list, oldest: int, newest: int) -> int:
+        first_steps = [
+            oldest + 3 + classifier.step * classifier.number_of_candles
+            for classifier in (
+                getattr(classifiers, self.classifier)(
+                    parameters=json.dumps(combination),
+                    log=_UnloggedAnalysis())
+                for combination in combinations)]
+        return max(first_steps + [newest])
+
+    def _share(self, combinations: list) -> tuple:
+        """Klines and prices of each time frame on shared memory, and the
+        time frames bounds.
+        """
+
+        arrays, time_frames = dict(), dict()
+        price_getter = handlers.BackTestingPriceGetter(
+            self.broker_name, self.ticker_symbol)
+
+        for time_frame in sorted(set(c["time_frame"] for c in combinations)):
+            klines_getter = handlers.BackTestingKlines(
+                self.broker_name, self.ticker_symbol, time_frame=time_frame)
+            oldest = klines_getter._oldest_open_time()
+            if self.since:
+                oldest = max(oldest,
+                             klines_getter._first_open_time_from(self.since))
+            newest = klines_getter._newest_open_time()
+            if self.until:
+                newest = min(newest, self.until)
+            klines = klines_getter.get(since=oldest, until=newest)
+
+            last = self._last_step(
+                [c for c in combinations if c["time_frame"] == time_frame],
+                oldest, newest)
+            nows = np.arange(oldest + 3, last + 1,
+                             klines_getter.SecondsTimeFrame())
+            price_getter.preload(since=int(nows[0]), until=int(nows[-1]))
+
+            arrays.update({
+                "{}/open_times".format(time_frame):
+                    klines.Open_time.to_numpy(dtype=np.int64),
+                "{}/values".format(time_frame):
+                    klines[self._columns].to_numpy(dtype=np.float64).T,
+                "{}/prices".format(time_frame): np.fromiter(
+                    (price_getter.get(at=int(now)) for now in nows),
+                    dtype=np.float64, count=len(nows)),
+            })
+            time_frames[time_frame] = dict(oldest_open_time=oldest,
+                                           newest_open_time=newest)
+
+        return SharedArrays.create(arrays), time_frames
+
+    @contextmanager
+    def _workers(self, combinations: list):
+        """Pool of processes attached to the shared klines and prices of
+        the combinations time frames (and their bounds).
+        """
+
+        shared, time_frames = self._share(combinations)
+        broker = trade_broker(self.broker_name, self.ticker_symbol)
+        settings = dict(
+            classifier=self.classifier,
+            time_frames=time_frames,
+            initial_base_amount=self.initial_base_amount,
+            fee_rate_decimal=broker.fee_rate_decimal,
+            minimal_amount=broker.mininal_amount,
+            allowed_special_signals=self.allowed_special_signals,
+        )
+
+        try:
+            with multiprocessing.Pool(self.processes,
+                                      initializer=_Worker.start,
+                                      initargs=(shared.descriptor,
+                                                settings)) as pool:
+                yield pool, time_frames
+        finally:
+            shared.close()
+            shared.unlink()
+
+    def _chunksize(self, number_of_tasks: int) -> int:
+        return max(1, number_of_tasks // (self.processes * 8))
+
+    def run(self, grid: dict) -> pd.DataFrame:
+        """Results of each combination of the 'grid' (lists of values, by
+        parameter name): final equity (base units), number of trades and
+        max drawdown (%), ranked by the final equity.
+        """
+
+        combinations = self.combinations(grid)
+        with self._workers(combinations) as (pool, _):
+            results = pool.map(_evaluate, combinations,
+                               chunksize=self._chunksize(len(combinations)))
+
+        table = pd.concat([pd.DataFrame(combinations),
+                           pd.DataFrame(results)], axis=1)
+        return table.sort_values(
+            "final_equity", ascending=False, kind="mergesort").reset_index(
+                drop=True)
+
+
+class WalkForward(ParametersSweep):
+    """Walk-forward evaluation of a classifier: the klines history is split
+    into rolling windows of 'train_period' seconds followed by 'test_period'
+    seconds (the next window starting a test period later). The grid
+    combinations are back tested on each training window, all the windows
+    at once, and the best one (by final equity) is back tested on the test
+    window that follows it, all the test windows in parallel as well. The
+    klines and prices are loaded once (as on 'ParametersSweep') for all the
+    windows.
+
+    Each window starts with 'initial_base_amount' and no position; the out
+    of sample equity is stitched chaining the test windows returns.
+    """
+
+    def __init__(self, train_period: int, test_period: int, **kwargs):
+        super(WalkForward, self).__init__(**kwargs)
+        self.train_period = train_period
+        self.test_period = test_period
+
+    def windows(self, since: int, until: int) -> list:
+        """(train since, test since, test until) of each window, the until
+        excluded, from 'since' until 'until' (included). A last window not
+        fully covered by them is left out.
+        """
+
+        return [(start, start + self.train_period,
+                 start + self.train_period + self.test_period)
+                for start in range(
+                    since, until - self.train_period - self.test_period + 2,
+                    self.test_period)]
+
+    def _stitched(self, equities: list) -> pd.Series:
+        scale, stitched = 1.0, []
+        for equity in equities:
+            stitched.append(equity * scale)
+            scale *= equity.iloc[-1] / self.initial_base_amount
+        return pd.concat(stitched) if stitched else pd.Series(dtype=float)
+
+    def run(self, grid: dict) -> tuple:
+        """Returns:
+            pd.DataFrame: Each window bounds, its best combination, the
+            final equity of it on the training window ('train_equity') and
+            its results on the test window.
+            pd.Series: The out of sample equity (base units), by step.
+        """
+
+        combinations = self.combinations(grid)
+        with self._workers(combinations) as (pool, time_frames):
+            since = max(frame["oldest_open_time"]
+                        for frame in time_frames.values())
+            until = min(frame["newest_open_time"]
+                        for frame in time_frames.values())
+            windows = self.windows(since, until)
+
+            trainings = [(combination, train_since, test_since - 1)
+                         for train_since, test_since, _ in windows
+                         for combination in combinations]
+            trained = np.array(
+                [result["final_equity"] for result in pool.map(
+                    _evaluate_task, trainings,
+                    chunksize=self._chunksize(len(trainings)))]
+            ).reshape(len(windows), len(combinations))
+
+            best = [combinations[int(i)] for i in
+                    np.argmax(trained, axis=1)]  # First best on ties
+            tests = pool.map(
+                _evaluate_task,
+                [(combination, test_since, test_until - 1, True)
+                 for combination, (_, test_since, test_until)
+                 in zip(best, windows)])
+
+        table = pd.concat([
+            pd.DataFrame(windows,
+                         columns=["train_since", "test_since", "test_until"]),
+            pd.DataFrame(best),
+            pd.DataFrame(dict(train_equity=trained.max(axis=1)
+                              if len(windows) else [])),
+            pd.DataFrame(tests).drop(columns="equity", errors="ignore"),
+        ], axis=1)
+        return table, self._stitched([test["equity"] for test in tests])
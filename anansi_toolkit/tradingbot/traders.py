@@ -3,8 +3,8 @@ import pendulum
 import math
 from ..marketdata import handlers
 from ..share.tools import EventContainer
-from . import classifiers, orders
-from .models import DefaultLog
+from . import classifiers, orders, stop_handlers
+from .models import BufferedLogSink, DefaultLog, Operation, run_unit_of_work
 
 from ..settings import (
     PossibleModes as MODE,
@@ -14,18 +14,34 @@ from ..settings import (
 )
 
 class SimpleKlinesTrader:
-    def __init__(self, operation):
+    # Changed by a cycle on the trader itself (replaced), besides the
+    # database and the components snapshots ('state'/'restore')
+    _cycle_state = ["last_result", "_stopped_from", "_step", "_price_now"]
+
+    def __init__(self, operation, report_every: int = 1,
+                 log_sink: BufferedLogSink = None):
+        """On back testing, the cycle report is printed each 'report_every'
+        cycles (and on the last one); 0 turns it off. The operational log
+        is written through 'log_sink' (see 'DefaultLog').
+        """
+
         self._event = EventContainer(reporter=self.__class__.__name__)
         self.ticker_symbol = (
             operation.market.quote_symbol + operation.market.base_symbol
         )
-        self.log = DefaultLog(operation)
+        self.log = DefaultLog(operation, sink=log_sink)
         self.OrderHandler = orders.Handler(operation, self.log)
         self.Classifier = getattr(classifiers, operation.classifier.name)(
             parameters=operation.classifier.parameters, log=self.log
         )
+        self.StopLoss = getattr(stop_handlers, operation.stop_loss.name)(
+            parameters=operation.stop_loss.parameters, log=self.log
+        )
         self.operation = operation
         self.last_result = None
+        self.report_every = report_every
+        self._cycles:int = 0
+        self._stopped_from:str = None  # Side left due to the stop loss
         self._step:int = None
         self._price_now:float = None
         self._instantiate_klines_and_price_getters()
@@ -47,6 +63,13 @@ class SimpleKlinesTrader:
             if backtesting
             else handlers.PriceGetter(**kwargs)
         )
+        stop_tf = dict(time_frame=self.StopLoss.parameters.time_frame,
+                       human_readable_datetime=False)
+        self.StopKlinesGetter = (
+            handlers.BackTestingKlines(**kwargs, **stop_tf)
+            if backtesting
+            else handlers.KlinesFromBroker(**kwargs, **stop_tf)
+        )
 
     def _get_initial_backtesting_now(self):
         step_in_seconds = (
@@ -69,15 +92,23 @@ class SimpleKlinesTrader:
             # values ​​of '_now' must be attributes of the operation
             self._now = self._get_initial_backtesting_now()
             self._final_backtesting_now = self._get_final_backtesting_now()
+            self.PriceGetter.preload(
+                since=self._now, until=self._final_backtesting_now)
 
     def _get_ready_to_repeat(self):
-        self._consolidate_log()
         if self.operation.mode == MODE.BackTesting:
-            self.operation.print_report()
+            self._cycles += 1
             self._now += self._step
+            is_the_last = bool(self._now > self._final_backtesting_now)
+
+            if self.report_every and (
+                    is_the_last or not self._cycles % self.report_every):
+                self.operation.print_report(log=self.log.last_record)
 
-            if self._now > self._final_backtesting_now:
-                self.operation.update(status=STAT.NotRunning)
+            if is_the_last:
+                run_unit_of_work(
+                    lambda: self.operation.update(status=STAT.NotRunning),
+                    on_retry=self._refresh)
 
         else:
             sleep_time = (
@@ -89,6 +120,7 @@ class SimpleKlinesTrader:
 
     def _end(self):  #TODO: Make a final report
         self._report_to_log("It's the end!") #TODO: Not appending, cause is after "repeat"
+        self.log.flush()
 
     def _get_price(self):
         price = self.PriceGetter.get(at=self._now)
@@ -101,14 +133,15 @@ class SimpleKlinesTrader:
     def _do_analysis(self):
         self._get_price()
         self._step = self.Classifier.step
+        self._classifier_analysis()
         is_positioned = bool(self.operation.position.side != SIDE.Zeroed)
 
         if is_positioned and self.operation.is_stop_loss_enabled:
-            pass
-            # self._step = self.StopLoss.step
-            # self._stop_analysis()
-
-        self._classifier_analysis()
+            if self.operation.mode != MODE.BackTesting:
+                # Live, it wakes on each candle of the stop time frame. The
+                # back testing analyzes them all at once, on its steps.
+                self._step = self.StopLoss.step
+            self._stop_analysis()
 
     def _classifier_analysis(self):
         is_there_a_new_candle = bool(
@@ -127,22 +160,96 @@ class SimpleKlinesTrader:
             self.last_result = self.Classifier.get_result_for_this(data)
             self.operation.last_check.update(by_classifier_at=self._now)
     
+    def _start_stop_loss(self, position):
+        """Follows the position from its persisted reference and extreme
+        prices; if it was already measured (e.g. the trader restarted), only
+        the candles of the longest trigger window are read again, whatever
+        the age of the position.
+        """
+
+        step = self.StopLoss.step
+        self.StopLoss.start(
+            side=position.side,
+            reference_price=(position.exit_reference_price
+                             or position.traded_price),
+            at=position.traded_at,
+            extreme_price=position.extreme_price)
+
+        checked_at = self.operation.last_check.by_stop_loss_at
+        if checked_at and checked_at > position.traded_at:
+            measured_until = ((checked_at - step) // step) * step
+            self.StopLoss.resume(
+                self.StopKlinesGetter.get(
+                    since=max(self.StopLoss.last_open_time + step,
+                              measured_until - (
+                                  self.StopLoss.n_samples_to_analyze - 1)
+                              * step),
+                    until=measured_until),
+                measured_until)
+
     def _stop_analysis(self):
-        pass
+        """Measures the stop candles closed since the last analysis (the
+        stop handler keeps what it needs of the previous ones); if the stop
+        is confirmed, it replaces the classifier result.
+        """
+
+        position = self.operation.position
+        if not (position.traded_at and position.traded_price):
+            return  # Not traded by the operation: nothing to measure from
+
+        if self.StopLoss.position_at != position.traded_at:  # A new one
+            self._start_stop_loss(position)
+
+        since = self.StopLoss.last_open_time + self.StopLoss.step
+        until = self._now - self.StopLoss.step  # The closed candles
+        if since > until:
+            return
+
+        result = self.StopLoss.get_result_for_this(
+            self.StopKlinesGetter.get(since=since, until=until))
+        self.operation.last_check.update(by_stop_loss_at=self._now)
+
+        if (result.reference_price != position.exit_reference_price
+                or result.extreme_price != position.extreme_price):
+            position.update(exit_reference_price=result.reference_price,
+                            extreme_price=result.extreme_price)
+        # A stop confirmed before now came first, whatever the classifier
+        # says now; on now, it only exits a position the classifier keeps
+        if result.due_to_stop and (self.last_result is None
+                                   or result.stopped_at < self._now
+                                   or position.side == self.last_result.side):
+            self.last_result = result
 
     def _execute_the_order_if_the_side_changes(self):
         current_side = self.operation.position.side
         suggested_side = self.last_result.side
-        
+        due_to_stop = self.last_result.due_to_stop
+
+        # After a stop, the side left is not entered again until the
+        # classifier suggests another one.
+        if suggested_side != self._stopped_from:
+            self._stopped_from = None
+        elif not due_to_stop:
+            return
+
         if current_side != suggested_side:
+            # Back testing, the stop is on the candle where it was confirmed
+            stopped_at = getattr(self.last_result, "stopped_at", None)
+            timestamp = (
+                stopped_at if (due_to_stop and stopped_at
+                               and self.operation.mode == MODE.BackTesting)
+                else self._now)
             order = dict(
-                timestamp=self._now,
+                timestamp=timestamp,
                 from_side=current_side,
                 to_side=suggested_side, 
-                price = self._price_now,
-                due_to_stop = self.last_result.due_to_stop,
+                price = (self._price_now if timestamp == self._now
+                         else self.PriceGetter.get(at=timestamp)),
+                due_to_stop = due_to_stop,
             )
             self.OrderHandler.execute(order)
+            if due_to_stop:
+                self._stopped_from = current_side
 
     def _report_to_log(self, event_description:str):
         self._event.description = event_description
@@ -153,14 +260,58 @@ class SimpleKlinesTrader:
         self.log.update(timestamp=self._now)
         return
     
+    def _refresh(self):
+        """Gets the operation again, after its transaction was rolled back
+        (its entities can't be changed anymore).
+        """
+
+        operation = Operation[self.operation.id]
+        self.operation = operation
+        self.log.operation = operation
+        self.OrderHandler.operation = operation
+
+    def _components(self) -> dict:
+        return dict(Classifier=self.Classifier, StopLoss=self.StopLoss,
+                    SigGen=self.OrderHandler.SigGen, log=self.log)
+
+    def _cycle_snapshot(self) -> tuple:
+        return ({name: getattr(self, name) for name in self._cycle_state},
+                {name: component.state()
+                 for name, component in self._components().items()})
+
+    def _restore(self, snapshot: tuple):
+        state, components_state = snapshot
+        for name, value in state.items():
+            setattr(self, name, value)
+        for name, component in self._components().items():
+            component.restore(components_state[name])
+
+    def _analyze_and_order(self):
+        self._do_analysis()
+        self._execute_the_order_if_the_side_changes()
+
+    def _cycle(self):
+        """The cycle changes are committed at once. If it fails, they are
+        rolled back, as the trader state; if the commit fails, the whole
+        cycle runs again.
+        """
+
+        snapshot = self._cycle_snapshot()
+
+        def again():
+            self._refresh()
+            self._restore(snapshot)
+
+        try:
+            run_unit_of_work(self._analyze_and_order, on_retry=again)
+        except (Exception, ConnectionError) as e:
+            again()
+            self._report_to_log(str(e))
+        self._consolidate_log()
+
     def run(self):
-        self._start()
+        run_unit_of_work(self._start, on_retry=self._refresh)
         while self.operation.status == STAT.Running:
-            try:
-                self._do_analysis()
-                self._execute_the_order_if_the_side_changes()
-            except (Exception, ConnectionError) as e:
-                self._report_to_log(str(e))
-            
+            self._cycle()
             self._get_ready_to_repeat()
         self._end()
@@ -0,0 +1,81 @@
+import math
+import os
+import re
+import tempfile
+from urllib.parse import parse_qs, urlparse
+
+import pendulum
+import pytest
+import requests_mock
+from anansi_toolkit.settings import Environments
+
+# The tradingbot models bind their database on import: a temporary one
+Environments.ENV.ORM_bind_to = dict(
+    Environments.ENV.ORM_bind_to,
+    filename=os.path.join(tempfile.mkdtemp(), "test_tradingbot.db"))
+
+
+class FakeBinance:
+    """Binance klines endpoints, over a deterministic 1m price path of
+    'days' days until 'now', with no candles opened on the 'gaps' (since,
+    until excluded). The (interval, since, until) of each klines request
+    are kept on 'requests'.
+    """
+
+    now = 1600000000
+    _time_frames = dict(m=60, h=3600, d=86400, w=604800)
+
+    def __init__(self, days: int = 6):
+        self.first_open_time = self.now - days * 86400
+        self.gaps = []
+        self.requests = []
+
+    @staticmethod
+    def price(timestamp: int) -> float:
+        return (10000 + 300 * math.sin(timestamp / 20000)
+                + 40 * math.sin(timestamp / 1300))
+
+    def _kline(self, open_time: int, seconds: int) -> list:
+        open_, close = self.price(open_time), self.price(open_time + seconds)
+        return [open_time * 1000, "%.8f" % open_,
+                "%.8f" % (max(open_, close) + 5), "%.8f" % (min(open_, close) - 5),
+                "%.8f" % close, "1.0", (open_time + seconds) * 1000 - 1,
+                "1.0", 10, "0.5", "0.5", "0"]
+
+    def klines(self, request, context):
+        query = parse_qs(urlparse(request.url).query)
+        interval = query["interval"][0]
+        seconds = int(interval[:-1]) * self._time_frames[interval[-1]]
+        limit = int(query.get("limit", ["500"])[0])
+        until = (int(query["endTime"][0]) // 1000 if "endTime" in query
+                 else self.now)
+        since = (int(query["startTime"][0]) // 1000 if "startTime" in query
+                 else until - (limit - 1) * seconds)
+
+        self.requests.append((interval, since, until))
+
+        open_time = max(self.first_open_time, since + (-since % seconds))
+        klines = []
+        while open_time <= min(until, self.now) and len(klines) < limit:
+            if not any(gap_since <= open_time < gap_until
+                       for gap_since, gap_until in self.gaps):
+                klines.append(self._kline(open_time, seconds))
+            open_time += seconds
+        context.headers["x-mbx-used-weight-1m"] = "1"
+        return klines
+
+
+@pytest.fixture
+def fake_binance(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # 'klines.db' is written on cwd
+    broker = FakeBinance()
+    pendulum.set_test_now(pendulum.from_timestamp(broker.now))
+    with requests_mock.Mocker() as mocker:
+        mocker.get(re.compile(r"https://api\.binance\.com/api/v3/klines.*"),
+                   json=broker.klines)
+        mocker.get("https://api.binance.com/api/v3/ping", json={},
+                   headers={"x-mbx-used-weight-1m": "1"})
+        mocker.get("https://api.binance.com/api/v3/time",
+                   json={"serverTime": broker.now * 1000})
+        yield broker
+    pendulum.set_test_now()
@@ -0,0 +1,81 @@
+import math
+import numpy as np
+from pony.orm import db_session
+from anansi_toolkit.share.tools import Serialize
+from anansi_toolkit.tradingbot import classifiers
+from anansi_toolkit.tradingbot.backtesters import (
+    Simulation, VectorizedBackTester)
+from anansi_toolkit.tradingbot.models import Operation, TradeLog, User
+from anansi_toolkit.tradingbot.traders import SimpleKlinesTrader
+from anansi_toolkit.tradingbot.views import (
+    create_default_operation, create_user)
+
+
+def _simulation(initial_base_amount=100.0):
+    return Simulation(initial_base_amount=initial_base_amount,
+                      fee_rate_decimal=0.001,
+                      minimal_amount=0.00001,
+                      allowed_special_signals=[])
+
+
+def _operation(first_name: str) -> int:
+    parameters = classifiers.CrossSMA.DefaultParameters()
+    parameters.time_frame, parameters.larger_sample = "1h", 20
+
+    create_user(first_name=first_name)
+    with db_session:
+        create_default_operation(User.get(first_name=first_name))
+        operation = User.get(first_name=first_name).operations.select().first()
+        operation.classifier.parameters = Serialize(parameters).to_json()
+        return operation.id
+
+
+def _back_tested(trader_class, operation_id: int):
+    with db_session:
+        trader_class(Operation[operation_id], report_every=0).run()
+
+    with db_session:
+        operation = Operation[operation_id]
+        trades = [(trade.timestamp, trade.signal, trade.price,
+                   trade.quote_amount, trade.fee)
+                  for trade in operation.trades_log.order_by(TradeLog.timestamp)]
+        position = operation.position
+        return trades, (position.side, position.traded_at,
+                        position.assets.base, position.assets.quote)
+
+
+def test_vectorized_back_testing_matches_the_step_by_step_one(fake_binance):
+    step_by_step = _back_tested(SimpleKlinesTrader, _operation("Stepper"))
+    vectorized = _back_tested(VectorizedBackTester, _operation("Vectorizer"))
+
+    trades, _ = step_by_step
+    assert len(trades) > 4
+    assert vectorized == step_by_step
+
+
+def test_simulation_holds_until_a_not_allowed_suggestion_changes():
+    simulation = _simulation()
+    trades = simulation.run(np.arange(5), ["Short", "Short", "Zeroed",
+                                           "Long", "Long"],
+                            price_at=lambda at: 10.0)
+
+    assert [(trade["timestamp"], trade["signal"]) for trade in trades] == [
+        (3, "Buy")]
+    assert simulation.side == "Long"
+
+
+def test_simulation_tries_again_on_no_price_or_no_funds():
+    prices = {1: math.nan, 2: 10.0, 3: 10.0}
+
+    def price_at(at):
+        if at == 0:
+            raise ValueError("No klines")
+        return prices[at]
+
+    simulation = _simulation()
+    trades = simulation.run(np.arange(4), ["Long"] * 4, price_at)
+    assert [trade["timestamp"] for trade in trades] == [2]
+
+    broke = _simulation(initial_base_amount=0.0)
+    assert broke.run(np.arange(4), ["Long"] * 4, lambda at: 10.0) == []
+    assert broke.side == "Zeroed"
@@ -0,0 +1,237 @@
+import json
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import pytest
+from anansi_toolkit.marketdata import data_brokers
+from anansi_toolkit.marketdata.data_brokers import (
+    BinanceDataBroker, BrokerTransport, RetryPolicy)
+from anansi_toolkit.marketdata.handlers import (
+    BackTestingPriceGetter, KlinesFromBroker, ResampledKlines)
+from anansi_toolkit.settings import ImplementedKlinesStorages
+
+
+class StubBroker(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    statuses = []
+    client_ports = set()
+
+    def do_GET(self):
+        self.client_ports.add(self.client_address[1])
+        status = self.statuses.pop(0) if self.statuses else 200
+        body = json.dumps({"status": status}).encode()
+        self.send_response(status)
+        if status == 429:
+            self.send_header("Retry-After", "0")
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_broker():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubBroker)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    StubBroker.statuses, StubBroker.client_ports = [], set()
+    yield "http://127.0.0.1:{}/".format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def test_transport_retries_and_reuses_the_connection(stub_broker):
+    StubBroker.statuses = [429, 503]
+    transport = BrokerTransport(
+        retry_policy=RetryPolicy(max_retries=3, backoff_factor=0.0))
+
+    for _ in range(3):
+        response = transport.get(stub_broker)
+
+    assert response.json() == {"status": 200}
+    assert transport.stats.requests == 5
+    assert transport.stats.retries == 2
+    assert transport.stats.failures == 0
+    assert transport.stats.mean_latency > 0
+    assert len(StubBroker.client_ports) == 1
+
+
+def test_transport_raises_once_retries_are_exhausted(stub_broker):
+    StubBroker.statuses = [503, 503, 400]
+    transport = BrokerTransport(
+        retry_policy=RetryPolicy(max_retries=5, backoff_factor=0.0))
+
+    with pytest.raises(ConnectionError):
+        transport.get(stub_broker)
+
+    assert transport.stats.retries == 2
+    assert transport.stats.failures == 1
+
+
+def test_the_default_transport_is_created_on_first_use(stub_broker,
+                                                      monkeypatch):
+    monkeypatch.setattr(data_brokers, "_default_transport", None)
+    created = []
+
+    def counted_transport():
+        created.append(BrokerTransport())
+        return created[-1]
+
+    monkeypatch.setattr(data_brokers, "BrokerTransport", counted_transport)
+
+    for _ in range(2):
+        assert data_brokers.get_response(stub_broker).json() == {
+            "status": 200}
+
+    assert len(created) == 1 and data_brokers._default_transport is created[0]
+    created[0].close()
+
+
+class FlakyBroker:
+    def __init__(self, errors):
+        self.errors = errors
+        self.calls = 0
+
+    def get_klines(self, ticker_symbol, time_frame, since):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return pd.DataFrame({"Open_time": [since, since + 60]})
+
+
+def _klines_getter(broker):
+    getter = object.__new__(KlinesFromBroker)
+    getter._broker, getter.ticker_symbol, getter._time_frame = (
+        broker, "BTCUSDT", "1m")
+    return getter
+
+
+def test_pages_are_not_retried_on_top_of_the_transport():
+    broker = FlakyBroker([])
+    assert len(_klines_getter(broker)._get_page(60, 120)) == 2
+
+    broker = FlakyBroker([ConnectionError("HTTP 503, after the retries")])
+    with pytest.raises(ConnectionError):
+        _klines_getter(broker)._get_page(60, 120)
+    assert broker.calls == 1
+
+
+def test_request_weight_is_not_locked_while_waiting(monkeypatch):
+    broker = BinanceDataBroker()
+    broker._weight_minute = broker._current_minute()
+    broker._used_weight = broker._request_weight_per_minute
+    sleeping, released = threading.Event(), threading.Event()
+
+    def sleep(seconds):
+        sleeping.set()
+        released.wait(5)
+        broker._weight_minute = None  # The minute turns
+
+    monkeypatch.setattr(data_brokers.time, "sleep", sleep)
+    waiter = threading.Thread(target=broker._reserve_request_weight,
+                              args=(1,))
+    waiter.start()
+    assert sleeping.wait(5)
+
+    assert broker._weight_lock.acquire(timeout=1)  # Free while it sleeps
+    broker._weight_lock.release()
+    released.set()
+    waiter.join(5)
+    assert not waiter.is_alive()
+
+
+@pytest.mark.parametrize("storage", [ImplementedKlinesStorages.SQLite,
+                                     ImplementedKlinesStorages.Columnar])
+def test_stored_klines_are_not_requested_again(fake_binance, storage):
+    klines = KlinesFromBroker("binance", "BTCUSDT", time_frame="1m",
+                              human_readable_datetime=False, storage=storage)
+    since = (fake_binance.now - 3 * 86400) // 60 * 60
+
+    first = klines.get(since=since, until=since + 1199 * 60)
+    assert len(first) == 1200
+    assert len(fake_binance.requests) == 3  # Pages of 500 candles
+
+    repeated = klines.get(since=since, until=since + 1199 * 60)
+    assert repeated.equals(first)
+    assert len(fake_binance.requests) == 3  # Served locally
+
+    overlapping = klines.get(since=since + 600 * 60, until=since + 1799 * 60)
+    assert overlapping.Open_time.tolist() == list(
+        range(since + 600 * 60, since + 1800 * 60, 60))
+    assert sorted(start for _, start, _ in fake_binance.requests[3:]) == [
+        since + 1200 * 60, since + 1700 * 60]  # Only the uncovered range
+
+
+def _rolling_price(klines: KlinesFromBroker, at: int) -> float:
+    """The price of 'BackTestingPriceGetter', as it was computed on each
+    call, from the klines until 'at' + 3000 s.
+    """
+
+    price = klines.get(number_of_candles=100, until=at + 3000)
+    return float(price.apply_indicator.trend.simple_moving_average(
+        number_of_candles=5, metrics="ohlc4")._series.mean())
+
+
+def test_preloaded_prices_are_the_rolling_ones(fake_binance):
+    minute = (fake_binance.now - 2 * 86400) // 60 * 60
+    fake_binance.gaps = [(minute + 300 * 60, minute + 330 * 60)]
+    klines = KlinesFromBroker("binance", "BTCUSDT", time_frame="1m",
+                              human_readable_datetime=False)
+    getter = BackTestingPriceGetter("binance", "BTCUSDT")
+    since, until = minute + 3, minute + 600 * 60 + 3
+    getter.preload(since=since, until=until)
+
+    ats = ([since, since + 60, until - 60, until]  # The edges
+           + list(range(minute + 200 * 60 + 3, minute + 340 * 60, 420)))
+    prices = [getter.get(at=at) for at in ats]
+    assert not any(math.isnan(price) for price in prices)
+    assert prices == pytest.approx(
+        [_rolling_price(klines, at) for at in ats], rel=1e-12)
+
+    history = fake_binance.first_open_time
+    for at in [history - 86400, fake_binance.now + 86400]:  # No klines
+        assert math.isnan(getter.get(at=at))
+        assert math.isnan(_rolling_price(klines, at))
+    assert getter.get(at=history + 120) == pytest.approx(
+        _rolling_price(klines, history + 120), rel=1e-12)  # A partial window
+
+
+def _new_rows(chunks: list) -> pd.DataFrame:
+    return pd.concat([chunk[chunk.attrs["overlap"]:] for chunk in chunks],
+                     ignore_index=True)
+
+
+def test_chunks_with_no_local_cache_are_not_stored(fake_binance, tmp_path):
+    klines = KlinesFromBroker("binance", "BTCUSDT", time_frame="1m",
+                              use_local_cache=False,
+                              human_readable_datetime=False)
+    since = (fake_binance.now - 86400) // 60 * 60
+    until = since + 1199 * 60
+
+    chunks = list(klines.chunks(since, until, chunk_size=500, overlap=4))
+
+    assert [len(chunk) for chunk in chunks] == [500, 504, 204]
+    assert [chunk.attrs["overlap"] for chunk in chunks] == [0, 4, 4]
+    assert _new_rows(chunks).equals(klines.get(since=since, until=until)[
+        list(chunks[0])].reset_index(drop=True))
+    assert not list(tmp_path.iterdir())  # No 'klines.db', nor 'klines/'
+
+
+def test_resampled_chunks_are_the_resampled_klines(fake_binance):
+    klines = ResampledKlines("binance", "BTCUSDT", "1h",
+                             human_readable_datetime=False)
+    since = fake_binance.now - 3 * 86400 - 1800  # Inside a candle
+    until = fake_binance.now
+
+    chunks = list(klines.chunks(since, until, chunk_size=20, overlap=2))
+    resampled = klines.get(since=since, until=until)
+
+    assert [chunk.attrs["overlap"] for chunk in chunks] == [0, 2, 2, 2]
+    assert max(len(chunk) for chunk in chunks) == 22
+    assert all((chunk.Open_time.diff().dropna() == 3600).all()
+               for chunk in chunks)
+    assert _new_rows(chunks).equals(resampled.reset_index(drop=True))
@@ -0,0 +1,175 @@
+import sqlite3
+import numpy as np
+import pandas as pd
+import pytest
+from anansi_toolkit.share.db_handlers import ColumnarStorageKlines, StorageKlines
+
+
+def klines_at(open_times, close=1.0):
+    return pd.DataFrame({"Open_time": list(open_times),
+                         "Open": 1.0, "High": 2.0, "Low": 0.5,
+                         "Close": close, "Volume": 3.0})
+
+
+@pytest.fixture(params=[StorageKlines, ColumnarStorageKlines])
+def storage(request, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # 'klines.db' is written on cwd
+    storage = request.param("binance_btcusdt_1m_raw")
+    storage.create_table()
+    yield storage
+    storage.close()
+
+
+def test_overlapping_appends_are_upserted(storage):
+    storage.append_dataframe(klines_at(range(0, 600, 60)))
+    storage.append_dataframe(klines_at(range(300, 900, 60), close=2.0))
+
+    stored = storage.range(0, 900)
+
+    assert stored["Open_time"].tolist() == list(range(0, 900, 60))
+    assert stored["Close"].tolist() == [1.0] * 5 + [2.0] * 10
+
+
+def test_coverage_is_merged_and_asked_by_missing_ranges(storage):
+    storage.append_dataframe(klines_at(range(0, 600, 60)), covering=(0, 600))
+    storage.append_dataframe(klines_at(range(1200, 1800, 60)),
+                             covering=(1200, 1800))
+    storage.cover(1800, 2400)  # No candles there
+
+    assert storage.coverage() == [(0, 600), (1200, 2400)]
+    assert storage.missing_ranges(300, 3000) == [(600, 1200), (2400, 3000)]
+    assert storage.missing_ranges(1300, 2000) == []
+
+    storage.append_dataframe(klines_at(range(600, 1200, 60)),
+                             covering=(600, 1200))
+
+    assert storage.coverage() == [(0, 2400)]
+
+
+def test_range_returns_typed_arrays_across_months(storage):
+    month = 31 * 86400  # 2020-01-01 to 2020-02-01
+    open_times = np.arange(1577836800 - 600, 1577836800 + month + 600, 60)
+    storage.append_dataframe(klines_at(open_times[::-1]))  # Unsorted
+
+    klines = storage.range(1577836800 - 120, 1577836800 + month + 60,
+                           columns=["Open_time", "Close"])
+
+    assert list(klines) == ["Open_time", "Close"]
+    assert klines["Open_time"].dtype == np.int64
+    assert klines["Close"].dtype == np.float64
+    assert klines["Open_time"].tolist() == open_times[8:-8].tolist()
+    assert storage.range(0, 60)["Open_time"].tolist() == []
+    assert storage.range(0, 1577836800, as_dataframe=True).dtypes.tolist() == [
+        np.int64] + [np.float64] * 5
+
+
+def test_chunks_carry_overlap_for_windows_across_boundaries(storage):
+    open_times = np.arange(0, 60 * 1000, 60)
+    closes = np.arange(1000, dtype=float)
+    klines = klines_at(open_times)
+    klines["Close"] = closes
+    storage.append_dataframe(klines)
+
+    chunks = list(storage.chunks(0, 60 * 999, chunk_size=300,
+                                 columns=["Close"], overlap=9))
+
+    assert [len(chunk) for chunk in chunks] == [300, 309, 309, 109]
+    assert [chunk.attrs["overlap"] for chunk in chunks] == [0, 9, 9, 9]
+    assert list(chunks[1]) == ["Close"]
+    windowed = np.concatenate(
+        [chunk.Close.rolling(10).mean().to_numpy()[chunk.attrs["overlap"]:]
+         for chunk in chunks])
+    assert np.array_equal(windowed, klines.Close.rolling(10).mean(),
+                          equal_nan=True)
+
+
+def test_columnar_partitions_are_memory_mapped_and_reopened(tmp_path):
+    storage = ColumnarStorageKlines("binance_btcusdt_1m_raw",
+                                    root=str(tmp_path))
+    storage.create_table()
+    storage.append_dataframe(klines_at(range(0, 600, 60)), covering=(0, 600))
+    storage.append_dataframe(klines_at(range(600, 1200, 60)))  # Appended
+    storage.append_dataframe(klines_at(range(300, 900, 60), close=2.0))
+
+    reopened = ColumnarStorageKlines("binance_btcusdt_1m_raw",
+                                     root=str(tmp_path))
+    reopened.create_table()
+    closes = reopened.range(0, 1200)["Close"]
+
+    assert isinstance(closes, np.memmap)
+    assert closes.tolist() == [1.0] * 5 + [2.0] * 10 + [1.0] * 5
+    assert reopened.coverage() == [(0, 600)]
+
+
+def test_legacy_tables_are_deduplicated_and_coverage_rebuilt(tmp_path,
+                                                             monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with sqlite3.connect("klines.db") as conn:  # As written by to_sql before
+        conn.execute("CREATE TABLE binance_btcusdt_1m_raw (Open_time INTEGER, "
+                     "Open REAL, High REAL, Low REAL, Close REAL, Volume REAL)")
+        conn.executemany(
+            "INSERT INTO binance_btcusdt_1m_raw VALUES (?, 1, 2, 0.5, 1, 3)",
+            [(t,) for t in [0, 60, 60, 120, 300, 360]])
+
+    legacy = StorageKlines("binance_btcusdt_1m_raw")
+    legacy.create_table()
+    legacy.rebuild_coverage(step=60)
+    legacy.append_dataframe(klines_at([360, 420]))
+
+    assert [row[0] for row in legacy._get_all()] == [0, 60, 120, 300, 360, 420]
+    assert legacy.coverage() == [(0, 180), (300, 420)]
+    legacy.close()
+
+
+def test_klines_and_their_coverage_are_written_on_one_transaction(tmp_path,
+                                                                  monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    storage = StorageKlines("binance_btcusdt_1m_raw")
+    storage.create_table()
+    statements = []
+    storage._connection().set_trace_callback(statements.append)
+
+    storage.append_dataframe(klines_at(range(0, 600, 60)), covering=(0, 600))
+
+    transactions = [statement.split()[0] for statement in statements
+                    if statement.split()[0] in ("BEGIN", "COMMIT")]
+    assert transactions == ["BEGIN", "COMMIT"]
+    storage.close()
+
+
+def test_a_failing_batch_is_rolled_back_with_its_coverage(storage):
+    storage.append_dataframe(klines_at(range(0, 600, 60)), covering=(0, 600))
+    failing = klines_at(range(300, 1200, 60))
+    failing["Close"] = [2.0] * 14 + [object()]  # Not a number, the last one
+
+    with pytest.raises((TypeError, sqlite3.Error)):
+        storage.append_dataframe(failing, covering=(300, 1200))
+
+    assert storage.range(0, 1200)["Close"].tolist() == [1.0] * 10
+    assert storage.coverage() == [(0, 600)]
+    assert storage.missing_ranges(0, 1200) == [(600, 1200)]
+
+
+def test_a_failing_columnar_rewrite_keeps_the_stored_files(tmp_path,
+                                                           monkeypatch):
+    storage = ColumnarStorageKlines("binance_btcusdt_1m_raw",
+                                    root=str(tmp_path))
+    storage.create_table()
+    storage.append_dataframe(klines_at(range(0, 600, 60)), covering=(0, 600))
+
+    def failing_cover(self, since, until):
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(ColumnarStorageKlines, "_cover", failing_cover)
+    with pytest.raises(OSError):  # After the partition is rewritten
+        storage.append_dataframe(klines_at(range(300, 900, 60), close=2.0),
+                                 covering=(300, 900))
+
+    monkeypatch.undo()
+    reopened = ColumnarStorageKlines("binance_btcusdt_1m_raw",
+                                     root=str(tmp_path))
+    reopened.create_table()
+    for kept in [storage, reopened]:
+        assert kept.range(0, 900)["Close"].tolist() == [1.0] * 10
+        assert kept.coverage() == [(0, 600)]
+    assert not list(tmp_path.glob("**/*.tmp"))
@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+import pytest
+from anansi_toolkit.marketdata import handlers  # Registers the accessors
+
+
+def _klines(number_of_candles=1000):
+    close = 10000 + np.cumsum(
+        np.random.default_rng(7).normal(0, 10, number_of_candles))
+    return pd.DataFrame({
+        "Open_time": np.arange(number_of_candles) * 60,
+        "Open": close.round(2),
+        "High": (close + 5.13).round(2),
+        "Low": (close - 3.71).round(2),
+        "Close": (close + 1.07).round(2),
+        "Volume": 1.0,
+    })
+
+
+def test_incremental_sma_matches_the_batch_computation():
+    klines = _klines()
+    batch = (klines.apply_indicator.trend
+             .simple_moving_average(number_of_candles=80))._series
+
+    sma = klines[:100].apply_indicator.trend.incremental_simple_moving_average(
+        number_of_candles=80)
+    incremental = [sma.last()] + [
+        sma.update(candle) for candle in klines[100:].to_dict("records")]
+
+    assert np.allclose(incremental, batch[99:], rtol=1e-12, atol=0)
+    assert sma.update(klines.iloc[500].to_dict()) == incremental[-1]  # Old
+
+    pandas_mean = klines[["Open", "High", "Low", "Close"]].mean(
+        axis=1).rolling(80).mean()
+    assert np.allclose(batch, pandas_mean, rtol=1e-12, atol=0,
+                       equal_nan=True)
+
+
+@pytest.mark.parametrize("price", [1.2e9, 9.9e15, 1.234567e-7, 3.3e-12])
+def test_smas_keep_the_prices_magnitude(price):
+    klines = _klines(300)
+    for column in ["Open", "High", "Low", "Close"]:
+        klines[column] = price * klines[column] / 10000
+    klines.loc[150, "Close"] = np.nan
+
+    batch = (klines.apply_indicator.trend
+             .simple_moving_average(number_of_candles=20))._series
+    sma = klines[:100].apply_indicator.trend.incremental_simple_moving_average(
+        number_of_candles=20)
+    incremental = [sma.last()] + [
+        sma.update(candle) for candle in klines[100:].to_dict("records")]
+
+    assert np.allclose(incremental, batch[99:], rtol=1e-12, atol=0,
+                       equal_nan=True)
+    assert np.isnan(incremental[51:71]).all() and not np.isnan(incremental[71])
+    assert abs(batch.iloc[-1] / price - 1) < 0.1
+
+
+def test_indicators_are_memoized_until_the_klines_change():
+    klines = _klines(200)
+    trend = klines.apply_indicator.trend
+
+    sma = trend.simple_moving_average(number_of_candles=20)
+    assert trend.simple_moving_average(number_of_candles=20) is sma
+    assert (klines.PriceFromKline.using("ohlc4")
+            is klines.PriceFromKline.using("ohlc4"))
+
+    klines.loc[len(klines)] = klines.iloc[-1] + 60
+    assert trend.simple_moving_average(number_of_candles=20) is not sma
+    assert len(trend.simple_moving_average(number_of_candles=20)._series) == 201
+
+
+def test_a_bounded_cache_drops_the_least_recently_used_indicators():
+    klines = _klines(200)
+    klines.IndicatorsCache.max_size = 3
+    trend = klines.apply_indicator.trend
+
+    price = klines.PriceFromKline.using("ohlc4")
+    sma = trend.simple_moving_average(number_of_candles=10)
+    trend.simple_moving_average(number_of_candles=20)
+    assert klines.PriceFromKline.using("ohlc4") is price  # Used again
+
+    trend.simple_moving_average(number_of_candles=30)
+    assert len(klines.IndicatorsCache._cached) == 3
+    assert klines.PriceFromKline.using("ohlc4") is price
+    assert trend.simple_moving_average(number_of_candles=10) is not sma
+
+
+def test_a_restored_incremental_sma_forgets_the_updates_after_its_state():
+    trend = _klines(300)[:100].apply_indicator.trend
+    sma = trend.incremental_simple_moving_average(number_of_candles=20)
+    state = sma.state()
+    klines = _klines(300)
+
+    for candle in klines[100:150].to_dict("records"):
+        sma.update(candle)
+    sma.restore(state)
+
+    follower = trend.incremental_simple_moving_average(number_of_candles=20)
+    for candle in klines[100:].to_dict("records"):
+        assert sma.update(candle) == follower.update(candle)
@@ -0,0 +1,194 @@
+import gc
+import json
+import sqlite3
+import threading
+
+import pytest
+from pony.orm import Database, db_session
+from anansi_toolkit.settings import Environments
+from anansi_toolkit.tradingbot import models
+from anansi_toolkit.tradingbot.models import (
+    BufferedLogSink, Operation, OperationalLogRecord, User, run_unit_of_work)
+from anansi_toolkit.tradingbot.views import (
+    create_default_operation, create_user)
+
+
+def _operation(first_name: str) -> int:
+    create_user(first_name=first_name)
+    with db_session:
+        create_default_operation(User.get(first_name=first_name))
+        return User.get(first_name=first_name).operations.select().first().id
+
+
+def _record(timestamp: int) -> OperationalLogRecord:
+    return OperationalLogRecord(
+        timestamp=timestamp, price=10.0, equivalent_base_amount=100.0,
+        analyzed_by="CrossSMA", side="Long", sma_smaller=10.5,
+        sma_larger=10.0, signal="Buy", last_analyzed_data=dict(),
+        analysis_result=dict(side="Long"), order=dict(signal="Buy"),
+        events=dict())
+
+
+def _logged_timestamps(operation_id: int) -> list:
+    with db_session:
+        return [log.timestamp for log in Operation[operation_id]
+                .operational_log.order_by(models.OperationalLog.id)]
+
+
+def test_log_sink_writes_by_batches_in_order_and_on_close():
+    operation_id = _operation("Sinker")
+    with db_session:
+        sink = BufferedLogSink(Operation[operation_id], max_records=3)
+
+    for timestamp in [1, 2]:
+        sink.append(_record(timestamp))
+    assert len(sink) == 2 and _logged_timestamps(operation_id) == []
+
+    sink.append(_record(3))  # Full
+    assert len(sink) == 0 and _logged_timestamps(operation_id) == [1, 2, 3]
+
+    sink.append(_record(4))
+    sink.flush()
+    sink.append(_record(5))
+    assert sink in models._open_sinks
+    sink.close()
+
+    assert _logged_timestamps(operation_id) == [1, 2, 3, 4, 5]
+    assert sink not in models._open_sinks
+
+
+def test_log_sinks_not_closed_are_not_kept_alive_by_the_exit_hook():
+    operation_id = _operation("Forgetful")
+    with db_session:
+        sink = BufferedLogSink(Operation[operation_id])
+    sink.append(_record(1))
+    models._close_open_sinks()  # As at the interpreter exit
+    assert _logged_timestamps(operation_id) == [1]
+
+    assert sink not in models._open_sinks
+
+    open_sinks = len(models._open_sinks)
+    with db_session:
+        BufferedLogSink(Operation[operation_id])  # Never closed
+    gc.collect()
+    assert len(models._open_sinks) == open_sinks
+
+
+def test_report_renders_the_position_again_when_it_changes():
+    operation_id = _operation("Reported")
+    with db_session:
+        operation = Operation[operation_id]
+        before = operation.msg(_record(60))
+        handlers, position = (operation._tables_cache["handlers"],
+                              operation._tables_cache["position"])
+        operation.msg(_record(120))
+        assert operation._tables_cache["position"] is position
+
+        operation.position.update(side="Long", traded_price=10.0,
+                                  traded_at=60)
+        after = operation.msg(_record(120))
+
+    assert "Zeroed" in before and "Zeroed" not in after
+    assert "Long" in after and "10.0" in after
+    assert operation._tables_cache["handlers"] is handlers
+
+
+def _position(operation_id: int) -> tuple:
+    with db_session:
+        position = Operation[operation_id].position
+        return position.side, position.assets.base
+
+
+def _trade(operation_id: int):
+    operation = Operation[operation_id]
+    operation.position.update(side="Long", traded_at=60)
+    operation.position.assets.update(quote=1.0, base=0.0)
+
+
+def test_a_unit_of_work_locked_on_commit_runs_again_and_is_kept():
+    operation_id = _operation("Locked")
+    retries = []
+    with db_session:  # The pony connection is kept by the thread
+        models.db.get_connection().execute("PRAGMA busy_timeout = 50")
+    lock = sqlite3.connect(Environments.ENV.ORM_bind_to["filename"],
+                           check_same_thread=False)
+    lock.execute("BEGIN IMMEDIATE")  # Another writer, for a while
+    threading.Timer(0.3, lock.rollback).start()
+    try:
+        with db_session:
+            run_unit_of_work(_trade, operation_id,
+                             on_retry=lambda: retries.append(1))
+    finally:
+        with db_session:
+            models.db.get_connection().execute("PRAGMA busy_timeout = 5000")
+        lock.close()
+
+    assert retries
+    assert _position(operation_id) == ("Long", 0.0)
+
+
+def test_a_unit_of_work_that_raises_is_rolled_back():
+    operation_id = _operation("Regretful")
+    logged = []
+
+    def trade_and_fail():
+        _trade(operation_id)
+        models.after_commit(lambda: logged.append(1))
+        raise ValueError("No klines")
+
+    with db_session:
+        with pytest.raises(ValueError):
+            run_unit_of_work(trade_and_fail)
+        assert Operation[operation_id].position.side == "Zeroed"
+
+    assert _position(operation_id)[0] == "Zeroed" and logged == []
+
+
+def test_operational_logs_of_the_json_columns_schema_are_migrated(tmp_path):
+    filename = str(tmp_path / "old_tradingbot.db")
+    old = sqlite3.connect(filename)
+    old.execute("""CREATE TABLE "OperationalLog" (
+        "id" INTEGER PRIMARY KEY AUTOINCREMENT, "operation" INTEGER,
+        "timestamp" INTEGER, "price" REAL, "equivalent_base_amount" REAL,
+        "analyzed_by" TEXT NOT NULL, "last_analyzed_data" JSON NOT NULL,
+        "analysis_result" JSON NOT NULL, "order" JSON NOT NULL,
+        "events" JSON NOT NULL)""")
+    old.execute(
+        'INSERT INTO "OperationalLog" VALUES (1, 1, 60, 10.0, 100.0, '
+        "'CrossSMA', ?, ?, ?, ?)", [json.dumps(details) for details in [
+            dict(Close=10.0), dict(side="Long", SMA_smaller=10.5,
+                                   SMA_larger=10.0),
+            dict(signal="Buy", price=10.0), dict(event_60="Stopped")]])
+    old.commit()
+
+    models.migrate(Database(provider="sqlite", filename=filename))
+    models.migrate(Database(provider="sqlite", filename=filename))  # Once
+
+    columns = [column[1] for column in old.execute(
+        'PRAGMA table_info("OperationalLog")')]
+    assert "order" not in columns and "payload" in columns
+    side, sma_smaller, signal, payload = old.execute(
+        'SELECT "side", "sma_smaller", "signal", "payload" '
+        'FROM "OperationalLog"').fetchone()
+    assert (side, sma_smaller, signal) == ("Long", 10.5, "Buy")
+    assert models.decompress_payload(payload) == dict(
+        last_analyzed_data=dict(Close=10.0), analysis_result=dict(),
+        order=dict(price=10.0), events=dict(event_60="Stopped"))
+    old.close()
+
+
+def test_positions_are_migrated_to_follow_the_extreme_price(tmp_path):
+    filename = str(tmp_path / "old_tradingbot.db")
+    old = sqlite3.connect(filename)
+    old.execute("""CREATE TABLE "Position" (
+        "id" INTEGER PRIMARY KEY AUTOINCREMENT, "side" TEXT NOT NULL,
+        "traded_price" REAL, "exit_reference_price" REAL)""")
+    old.execute("INSERT INTO \"Position\" VALUES (1, 'Long', 10.0, 10.5)")
+    old.commit()
+
+    models.migrate(Database(provider="sqlite", filename=filename))
+
+    assert old.execute(
+        'SELECT "side", "exit_reference_price", "extreme_price" '
+        'FROM "Position"').fetchall() == [("Long", 10.5, None)]
+    old.close()
@@ -0,0 +1,124 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import pandas as pd
+from pony.orm import db_session
+from anansi_toolkit.marketdata import handlers
+from anansi_toolkit.settings import PossibleModes as MODE
+from anansi_toolkit.tradingbot.models import Operation, User
+from anansi_toolkit.tradingbot.schedulers import (
+    OperationsScheduler, SharedFetch, SharedKlines)
+from anansi_toolkit.tradingbot.views import (
+    create_default_operation, create_user)
+
+
+class StatefulGetter:
+    def __init__(self):
+        self.calls, self.threads, self._inside, self.overlaps = 0, set(), 0, 0
+
+    def get(self, at):
+        self.calls += 1
+        self.threads.add(threading.current_thread())
+        self._inside += 1
+        self.overlaps += self._inside > 1
+        time.sleep(0.01)
+        self._inside -= 1
+        return at
+
+
+def test_shared_fetch_calls_its_getter_off_the_loop_one_at_a_time():
+    getter, executor = StatefulGetter(), ThreadPoolExecutor(max_workers=8)
+    shared = SharedFetch(getter, executor)
+
+    async def prefetch_and_miss():
+        await asyncio.gather(*[shared.fetch(at=60) for _ in range(5)])
+        assert shared.get(at=60) == 60 and getter.calls == 1  # Prefetched
+
+        loop = asyncio.get_running_loop()
+        return await asyncio.gather(
+            shared.fetch(at=120),
+            *[loop.run_in_executor(None, partial(shared.get, at=at))
+              for at in range(10)])
+
+    results = asyncio.run(prefetch_and_miss())
+    executor.shutdown(wait=True)
+
+    assert results[1:] == list(range(10))
+    assert getter.calls == 12 and getter.overlaps == 0
+    assert threading.main_thread() not in getter.threads
+
+
+class KlinesGetter:
+    def __init__(self):
+        self.calls = []
+
+    def get(self, **kwargs):
+        self.calls.append(kwargs)
+        until = kwargs["until"]
+        since = kwargs.get("since", until - (kwargs.get(
+            "number_of_candles", 0) - 1) * 60)
+        return pd.DataFrame({"Open_time": range(since, until + 1, 60)})
+
+
+def test_shared_klines_are_sliced_since_an_open_time_they_cover():
+    getter, executor = KlinesGetter(), ThreadPoolExecutor(max_workers=2)
+    shared = SharedKlines(getter, executor)
+    shared.number_of_candles = 5
+    asyncio.run(shared.fetch(until=600))
+
+    assert shared.get(since=480, until=600).Open_time.tolist() == [
+        480, 540, 600]
+    assert shared.get(number_of_candles=2, until=600).Open_time.tolist() == [
+        540, 600]
+    assert len(getter.calls) == 1
+
+    assert len(shared.get(since=300, until=600)) == 6  # Not covered
+    assert len(shared.get(since=480, until=540)) == 2  # Other until
+    assert len(getter.calls) == 3
+    executor.shutdown(wait=True)
+
+
+def _advisor_operations(first_name: str, number: int) -> list:
+    create_user(first_name=first_name)
+    with db_session:
+        user = User.get(first_name=first_name)
+        for _ in range(number):
+            create_default_operation(user)
+        operations = list(user.operations.select().order_by(Operation.id))
+        for operation in operations:
+            operation.mode = MODE.Advisor
+        return [operation.id for operation in operations]
+
+
+def test_an_operation_failing_to_start_ends_alone(fake_binance, monkeypatch):
+    monkeypatch.setattr(handlers.PriceGetter, "get",  # Not implemented live
+                        lambda self, at: fake_binance.price(at))
+    failing, running = _advisor_operations("Schedulee", 2)
+    with db_session:
+        scheduler = OperationsScheduler(
+            [Operation[failing], Operation[running]], delay=0)
+
+    def refused():
+        raise ValueError("Operation not found")
+
+    scheduler.traders[0]._start = refused
+    ended, cycles = [], []
+    for trader in scheduler.traders:
+        trader._end = partial(ended.append, trader.operation.id)
+
+    def next_cycle_at(trader, now):
+        cycles.append(trader.operation.id)
+        if len(cycles) == 3:
+            scheduler.stop()
+        return now
+
+    scheduler._next_cycle_at = next_cycle_at
+    scheduler.run()
+
+    assert cycles == [running] * 3
+    assert sorted(ended) == [failing, running]
+    with db_session:
+        assert Operation[running].operational_log.count() == 3
@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+import pytest
+from anansi_toolkit.marketdata import handlers  # Registers the accessors
+from anansi_toolkit.share.tools import Serialize
+from anansi_toolkit.tradingbot.stop_handlers import (
+    StopTrailing3T, TrailingExtreme)
+
+
+def _path(number_of_candles=20000, seed=3, volatility=0.002):
+    close = 10000 * np.exp(np.cumsum(np.random.default_rng(seed).normal(
+        0, volatility, number_of_candles)))
+    return pd.DataFrame({
+        "Open_time": 60 * (1 + np.arange(number_of_candles)),
+        "Open": close, "High": close, "Low": close, "Close": close,
+        "Volume": 1.0,
+    })
+
+
+def _stop_handler():
+    return StopTrailing3T(
+        parameters=Serialize(StopTrailing3T.DefaultParameters()).to_json(),
+        log=type("Log", (), {})())
+
+
+def _measured_one_by_one(prices, side, reference_price, parameters):
+    """The stop by its definition, measurement by measurement.
+    """
+
+    sign = 1.0 if side == "Long" else -1.0
+    extreme = reference_price
+    for j, price in enumerate(prices):
+        extreme = max(extreme, price) if sign > 0 else min(extreme, price)
+
+        def confirmed(trigger, falls):
+            window = prices[max(0, j - trigger.treshold.n_measurements + 1):
+                            j + 1]
+            moves = sign * (window / reference_price - 1) * 100
+            hits = moves <= -trigger.rate if falls else moves >= trigger.rate
+            return hits.sum() >= trigger.treshold.n_positives
+
+        for name in StopTrailing3T._triggers:
+            if confirmed(getattr(parameters, name), falls=True):
+                return j, name
+        if confirmed(parameters.update_target_if, falls=False):
+            reference_price = extreme
+    return None, None
+
+
+@pytest.mark.parametrize("side,seed,block", [("Long", 3, 4096),
+                                             ("Short", 3, 4096),
+                                             ("Long", 11, 16),
+                                             ("Short", 5, 16)])
+def test_vectorized_stop_matches_its_definition(side, seed, block):
+    path = _path(seed=seed)
+    stop = _stop_handler()
+    stop._block = block  # Windows across the blocks
+
+    result = stop.get_results_for_series(path, side, reference_price=10000.0,
+                                         at=0)
+
+    position, trigger = _measured_one_by_one(
+        path.Close.to_numpy(), side, 10000.0, stop.parameters)
+    assert position is not None
+    assert result.due_to_stop and result.side == "Zeroed"
+    assert result.stopped_at == path.Open_time[position] + 60
+    assert result.trigger == trigger
+
+
+def test_incremental_stop_matches_the_vectorized_one():
+    path = _path(seed=11)
+    vectorized = _stop_handler().get_results_for_series(
+        path, "Long", reference_price=10000.0, at=0)
+
+    stop = _stop_handler()
+    stop.start("Long", reference_price=10000.0, at=0)
+    for first in range(0, len(path), 7):  # Overlapping candles are skipped
+        result = stop.get_result_for_this(path[max(0, first - 3):first + 7])
+        if result.due_to_stop:
+            break
+
+    assert result.stopped_at == vectorized.stopped_at
+    assert result.reference_price == vectorized.reference_price
+    assert not stop.get_result_for_this(path[-10:]).due_to_stop  # Stopped
+
+
+@pytest.mark.parametrize("side", ["Long", "Short"])
+def test_trailing_extreme_matches_the_running_extreme(side):
+    prices = _path(number_of_candles=500).Close.to_numpy()
+    best = np.maximum if side == "Long" else np.minimum
+    tracker = TrailingExtreme(side)
+
+    for j, price in enumerate(prices[:300]):  # One by one
+        tracker.push(price)
+        assert tracker.extreme == best.reduce(prices[:j + 1])
+
+    extremes = tracker.push_many(prices[300:])  # At once
+    assert np.array_equal(extremes, best.accumulate(prices)[300:])
+    assert tracker.extreme == best.reduce(prices)
+
+
+def test_resumed_stop_matches_the_uninterrupted_one():
+    path = _path(seed=11, volatility=0.0005)  # A long held position
+    uninterrupted = _stop_handler().get_results_for_series(
+        path, "Long", reference_price=10000.0, at=0)
+
+    split = int(np.searchsorted(path.Open_time, uninterrupted.stopped_at)) // 2
+    first = _stop_handler()
+    first.start("Long", reference_price=10000.0, at=0)
+    measured = first.get_result_for_this(path[:split])
+    assert not measured.due_to_stop
+
+    restarted = _stop_handler()  # Only the persisted prices, and a window
+    restarted.start("Long", reference_price=measured.reference_price, at=0,
+                    extreme_price=measured.extreme_price)
+    restarted.resume(path[split - restarted.n_samples_to_analyze:split],
+                     measured_until=int(path.Open_time[split - 1]))
+    result = restarted.get_result_for_this(path[split:])
+
+    assert result.stopped_at == uninterrupted.stopped_at
+    assert result.reference_price == uninterrupted.reference_price
+    assert result.extreme_price == uninterrupted.extreme_price
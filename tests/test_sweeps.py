@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pony.orm import db_session
+from anansi_toolkit.share.tools import Serialize
+from anansi_toolkit.tradingbot import classifiers
+from anansi_toolkit.tradingbot.backtesters import VectorizedBackTester
+from anansi_toolkit.tradingbot.models import Operation, User
+from anansi_toolkit.tradingbot.sweeps import (
+    ParametersSweep, WalkForward, max_drawdown, parameters_grid)
+from anansi_toolkit.tradingbot.views import (
+    create_default_operation, create_user)
+
+
+def _operation(first_name: str, **parameters) -> int:
+    defaults = classifiers.CrossSMA.DefaultParameters()
+    for name, value in parameters.items():
+        setattr(defaults, name, value)
+
+    create_user(first_name=first_name)
+    with db_session:
+        create_default_operation(User.get(first_name=first_name))
+        operation = User.get(first_name=first_name).operations.select().first()
+        operation.classifier.parameters = Serialize(defaults).to_json()
+        return operation.id
+
+
+def test_a_combination_is_back_tested_as_on_the_vectorized_back_tester(
+        fake_binance):
+    operation_id = _operation("Sweeper", time_frame="1h", smaller_sample=3,
+                              larger_sample=20)
+    with db_session:
+        back_tester = VectorizedBackTester(Operation[operation_id],
+                                           report_every=0)
+        back_tester.run()
+        assets = Operation[operation_id].position.assets
+        trades = Operation[operation_id].trades_log.count()
+        final_equity = assets.base + assets.quote * (
+            back_tester.PriceGetter.get(at=back_tester._now))
+        sweep = ParametersSweep.from_operation(Operation[operation_id],
+                                               processes=2)
+
+    results = sweep.run(dict(time_frame=["1h"], smaller_sample=[2, 3],
+                             larger_sample=[20]))
+    result = results[results.smaller_sample == 3].iloc[0]
+
+    assert trades > 4 and result.trades == trades
+    assert result.final_equity == pytest.approx(final_equity, rel=1e-12)
+
+
+def test_max_drawdown_is_the_largest_fall_from_a_previous_peak():
+    assert max_drawdown(np.array([])) == 0.0
+    assert max_drawdown(np.array([100.0, 100.0, 101.0, 105.0])) == 0.0
+    assert max_drawdown(np.array([100.0, 120.0, 90.0, 130.0, 117.0])) == (
+        pytest.approx(25.0))
+
+
+def test_parameters_grid_varies_the_last_parameter_first():
+    defaults = dict(time_frame="1h", smaller_sample=3, larger_sample=80)
+    grid = parameters_grid(defaults, dict(smaller_sample=[2, 3, 5],
+                                          larger_sample=[20, 40]))
+
+    assert len(grid) == 6
+    assert [(c["smaller_sample"], c["larger_sample"]) for c in grid] == [
+        (2, 20), (2, 40), (3, 20), (3, 40), (5, 20), (5, 40)]
+    assert all(c["time_frame"] == "1h" for c in grid)
+    assert parameters_grid(defaults, dict()) == [defaults]
+
+    with pytest.raises(ValueError):
+        parameters_grid(defaults, dict(window=[1]))
+
+
+def test_walk_forward_windows_follow_each_other_with_no_gap():
+    walk = WalkForward(train_period=40, test_period=10)
+    windows = walk.windows(since=100, until=179)
+
+    assert windows == [(100, 140, 150), (110, 150, 160), (120, 160, 170),
+                       (130, 170, 180)]
+    for (_, test_since, test_until), (_, next_since, _) in zip(
+            windows, windows[1:]):
+        assert next_since == test_until
+    assert walk.windows(since=100, until=178)[-1] == (120, 160, 170)  # Partial
+    assert walk.windows(since=100, until=148) == []
+
+
+def test_walk_forward_stitching_carries_the_equity_across_windows():
+    walk = WalkForward(train_period=40, test_period=10,
+                       initial_base_amount=100.0)
+    stitched = walk._stitched([pd.Series([100.0, 110.0], index=[150, 155]),
+                               pd.Series([100.0, 90.0], index=[160, 165]),
+                               pd.Series([100.0, 120.0], index=[170, 175])])
+
+    assert stitched.index.tolist() == [150, 155, 160, 165, 170, 175]
+    assert stitched.tolist() == pytest.approx(
+        [100.0, 110.0, 110.0, 99.0, 99.0, 118.8])
+    assert walk._stitched([]).empty
+
+
+def test_walk_forward_tests_the_best_combination_out_of_sample(fake_binance):
+    operation_id = _operation("Walker")
+    with db_session:
+        walk = WalkForward.from_operation(
+            Operation[operation_id], train_period=2 * 86400,
+            test_period=86400, processes=2)
+
+    grid = dict(time_frame=["1h"], smaller_sample=[2, 3],
+                larger_sample=[10, 20])
+    table, equity = walk.run(grid)
+
+    assert len(table) == 4  # 6 days of history
+    assert (table.test_since - table.train_since == 2 * 86400).all()
+    assert (table.test_until - table.test_since == 86400).all()
+    assert set(zip(table.smaller_sample, table.larger_sample)) <= {
+        (smaller, larger) for smaller in grid["smaller_sample"]
+        for larger in grid["larger_sample"]}
+
+    assert equity.index.is_monotonic_increasing
+    assert equity.index[0] >= table.test_since.iloc[0]
+    assert equity.index[-1] < table.test_until.iloc[-1]
+    assert equity.iloc[-1] == pytest.approx(
+        100.0 * (table.final_equity / 100.0).prod())
@@ -0,0 +1,149 @@
+import multiprocessing
+import numpy as np
+import pandas as pd
+import pendulum
+import pytest
+from anansi_toolkit.share.tools import (
+    FormatKlines,
+    KlinesBuffer,
+    KlinesResampler,
+    ParseDateTime,
+    RetryPolicy,
+    SharedArrays,
+    human_readable_to_timestamps,
+    resample_klines,
+    timestamps_to_human_readable,
+)
+
+
+def minute_klines(number_of_candles=20000, gaps=(500, 501, 7000)):
+    random = np.random.default_rng(1)
+    open_times = np.delete(
+        1577836800 + 60 * np.arange(number_of_candles), gaps)
+    return pd.DataFrame({"Open_time": open_times,
+                         "Open": random.random(len(open_times)),
+                         "High": random.random(len(open_times)) + 1,
+                         "Low": random.random(len(open_times)) - 1,
+                         "Close": random.random(len(open_times)),
+                         "Volume": random.random(len(open_times))})
+
+
+def test_klines_buffer_builds_the_frame_once_keeping_columns_and_attrs():
+    buffer = KlinesBuffer()
+    for first in (0, 3, 6):
+        page = pd.DataFrame({"Open_time": range(first, first + 3),
+                             "Close": [1.5, 2.5, 3.5]})
+        page.attrs.update({"SecondsTimeFrame": 60})
+        buffer.append(page)
+    buffer.append(page[:0])
+
+    klines = buffer.to_dataframe()
+
+    assert len(buffer) == 9
+    assert list(klines.columns) == ["Open_time", "Close"]
+    assert klines.Open_time.tolist() == list(range(9))
+    assert klines.attrs == {"SecondsTimeFrame": 60}
+
+
+def test_format_klines_parses_columns_even_with_equal_values():
+    columns = ["Open_time", "Open", "High", "Low", "Close", "Volume",
+               "Close_time", "Number_of_trades"]
+    # Open equals Close and Volume equals Number_of_trades on purpose
+    raw_klines = [
+        [1600000012345, "10.5", "11.0", "10.0", "10.5", "3", 1600000071999, 3],
+        [1600000072000, "10.5", "12.0", "9.5", "11.5", "4", 1600000131999, 5],
+    ]
+
+    klines = FormatKlines("1m", raw_klines, DateTimeFmt="timestamp",
+                          DateTimeUnit="milliseconds",
+                          columns=columns).to_dataframe()
+
+    assert klines.Open_time.tolist() == [1599999960, 1600000020]
+    assert klines.Close_time.tolist() == [1600000071, 1600000131]
+    assert klines.Close.tolist() == [10.5, 11.5]
+    assert klines.Number_of_trades.tolist() == [3.0, 5.0]
+    assert klines.attrs == {"SecondsTimeFrame": 60}
+
+
+def test_vectorized_datetime_conversion_matches_parse_datetime():
+    timestamps = [0, 1600000000, 1600000060, 2145916800]
+
+    human_readable = timestamps_to_human_readable(timestamps)
+
+    assert list(human_readable) == [
+        ParseDateTime(timestamp).from_timestamp_to_human_readable()
+        for timestamp in timestamps]
+    assert list(human_readable_to_timestamps(human_readable)) == timestamps
+
+
+@pytest.mark.parametrize("time_frame, rule", [
+    ("5m", "5min"), ("6h", "6H"), ("1d", "1D"), ("1w", "W-MON")])
+def test_resample_klines_matches_pandas_on_broker_boundaries(time_frame,
+                                                              rule):
+    klines = minute_klines()
+
+    resampled = resample_klines(klines, time_frame)
+
+    expected = (klines.set_index(pd.to_datetime(klines.Open_time, unit="s"))
+                .resample(rule, label="left", closed="left")
+                .agg({"Open": "first", "High": "max", "Low": "min",
+                      "Close": "last", "Volume": "sum"})
+                .dropna())
+    assert (resampled.Open_time.to_numpy()
+            == expected.index.astype("int64") // 10**9).all()
+    assert np.allclose(resampled.drop(columns="Open_time"), expected)
+
+
+def test_klines_resampler_returns_closed_candles_as_they_arrive():
+    klines = minute_klines()
+    resampler = KlinesResampler("1h")
+
+    closed = [resampler.update(klines.iloc[chunk])
+              for chunk in np.array_split(np.arange(len(klines)), 37)]
+    closed.append(resampler.update(klines[:10]))  # Already fed
+
+    incremental = pd.concat(closed + [resampler.forming], ignore_index=True)
+    resampled = resample_klines(klines, "1h")
+    assert len(closed[-1]) == 0
+    assert incremental.Open_time.tolist() == resampled.Open_time.tolist()
+    assert np.allclose(incremental, resampled)
+
+
+def _sum_of_shared(descriptor):
+    shared = SharedArrays.attach(descriptor)
+    total = float(shared["values"].sum()) + int(shared["open_times"].sum())
+    shared.close()
+    return total
+
+
+def test_shared_arrays_are_attached_by_other_processes_with_no_copies():
+    open_times = np.arange(0, 600, 60)
+    values = np.random.default_rng(1).random((5, 10))
+    shared = SharedArrays.create(dict(open_times=open_times, values=values))
+    try:
+        attached = SharedArrays.attach(shared.descriptor)
+        attached["values"][0, 0] = 7.0
+        values[0, 0] = 7.0
+
+        assert shared["values"][0, 0] == 7.0
+        assert shared["open_times"].dtype == np.int64
+        with multiprocessing.Pool(1) as pool:
+            assert pool.apply(_sum_of_shared, (shared.descriptor,)) == (
+                values.sum() + open_times.sum())
+        attached.close()
+    finally:
+        shared.close()
+        shared.unlink()
+
+
+def test_retry_after_in_seconds_or_as_an_http_date():
+    policy = RetryPolicy(backoff_factor=1.0, jitter=0.0)
+
+    def response(retry_after):
+        return type("Response", (), dict(
+            status_code=429, headers={"Retry-After": retry_after}))()
+
+    assert policy.delay(0, response("7")) == 7.0
+    in_a_minute = pendulum.now("UTC").add(seconds=60).to_rfc1123_string()
+    assert 55 <= policy.delay(0, response(in_a_minute)) <= 60
+    assert policy.delay(0, response("soon")) == 1.0  # The policy delay
@@ -0,0 +1,93 @@
+from types import SimpleNamespace
+
+import pytest
+from pony.orm import db_session
+from anansi_toolkit.share.tools import Serialize
+from anansi_toolkit.tradingbot import classifiers
+from anansi_toolkit.tradingbot.models import Operation, User, run_unit_of_work
+from anansi_toolkit.tradingbot.traders import SimpleKlinesTrader
+from anansi_toolkit.tradingbot.views import (
+    create_default_operation, create_user)
+
+
+def _trader(now: int, classifier_side: str, stopped_at: int):
+    position = SimpleNamespace(
+        side="Long", traded_at=60, traded_price=10.0,
+        exit_reference_price=10.0, extreme_price=11.0,
+        update=lambda **kwargs: None)
+    stop = SimpleNamespace(
+        side="Zeroed", due_to_stop=True, stopped_at=stopped_at,
+        reference_price=10.0, extreme_price=11.0)
+
+    trader = object.__new__(SimpleKlinesTrader)
+    trader._now = now
+    trader.operation = SimpleNamespace(
+        position=position,
+        last_check=SimpleNamespace(update=lambda **kwargs: None))
+    trader.StopLoss = SimpleNamespace(
+        position_at=60, last_open_time=now - 180, step=60,
+        get_result_for_this=lambda data: stop)
+    trader.StopKlinesGetter = SimpleNamespace(get=lambda **kwargs: None)
+    trader.last_result = SimpleNamespace(side=classifier_side,
+                                         due_to_stop=False)
+    return trader, stop
+
+
+@pytest.mark.parametrize("classifier_side", ["Long", "Zeroed", "Short"])
+def test_a_stop_confirmed_before_now_wins_over_the_classifier(
+        classifier_side):
+    trader, stop = _trader(now=600, classifier_side=classifier_side,
+                           stopped_at=540)
+    trader._stop_analysis()
+    assert trader.last_result is stop
+
+
+def test_a_stop_confirmed_on_now_only_exits_a_kept_position():
+    trader, stop = _trader(now=600, classifier_side="Long", stopped_at=600)
+    trader._stop_analysis()
+    assert trader.last_result is stop
+
+    trader, stop = _trader(now=600, classifier_side="Short", stopped_at=600)
+    trader._stop_analysis()
+    assert trader.last_result.side == "Short"  # The classifier exit, at now
+
+
+def _operation(first_name: str) -> int:
+    parameters = classifiers.CrossSMA.DefaultParameters()
+    parameters.time_frame, parameters.larger_sample = "1h", 20
+
+    create_user(first_name=first_name)
+    with db_session:
+        create_default_operation(User.get(first_name=first_name))
+        operation = User.get(first_name=first_name).operations.select().first()
+        operation.classifier.parameters = Serialize(parameters).to_json()
+        return operation.id
+
+
+def test_a_failed_cycle_leaves_the_trader_and_its_log_as_before(
+        fake_binance):
+    operation_id = _operation("Failer")
+    with db_session:
+        trader = SimpleKlinesTrader(Operation[operation_id], report_every=0)
+        run_unit_of_work(trader._start, on_retry=trader._refresh)
+        for _ in range(3):
+            trader._cycle()
+            trader._get_ready_to_repeat()
+
+        analyzed = trader.Classifier.state()
+        last_result, side = trader.last_result, trader.OrderHandler.SigGen.side
+
+        def ordering_fails():
+            trader.log.order = dict(signal="Buy")
+            raise ValueError("No funds")
+
+        trader._execute_the_order_if_the_side_changes = ordering_fails
+        trader._cycle()
+
+        assert trader.Classifier.state() == analyzed
+        assert trader.last_result is last_result
+        assert trader.OrderHandler.SigGen.side == side
+        record = trader.log.last_record
+        assert (record.analyzed_by, record.analysis_result, record.order) == (
+            "", dict(), dict())
+        assert list(record.events.values()) == ["No funds"]